@@ -1,16 +1,64 @@
-from flask import Flask, request, render_template, redirect, url_for, jsonify
-from data_structures.user_store import UserStore
+from flask import Flask, Response, request, render_template, redirect, url_for, jsonify
+from data_structures.user_store import UserStore, MEMORY_BUDGET, STORAGE_FILE
+from data_structures.sharding import ShardRouter
 from data_structures.generator import generate_random_location
+from data_structures.scheduler import Scheduler
+from data_structures.rollup import GRANULARITIES
+from data_structures.sessions import SessionManager, LoginBusy
+from data_structures.retention import parse_retention
+from data_structures.queue_ds import QueueFull
+from data_structures.presence import Box, Circle
+import os
+import json
 import time
-import threading
-import random
+import math
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.secret_key = 'replace-this-with-a-secure-secret'
 
-store = UserStore()
+# GEOVERSE_STORAGE points the store at another snapshot file (e.g. a temp dir in tests);
+# GEOVERSE_MEMORY_BUDGET_MB bounds the memory used by resident per-user structures;
+# GEOVERSE_SHARDS=N spreads users over N worker processes (storage under <storage>.shards/);
+# GEOVERSE_RETENTION opts in to downsampling old history, e.g. '7d:1m,90d:1h' (unset keeps everything);
+# GEOVERSE_QUEUE_CAPACITY bounds offline queues (unset: unbounded); when one is full,
+# GEOVERSE_QUEUE_POLICY 'reject' (the default) turns inserts away and 'drop_oldest' drops old entries
+budget_mb = os.environ.get('GEOVERSE_MEMORY_BUDGET_MB')
+memory_budget = int(budget_mb) * 1024 * 1024 if budget_mb else MEMORY_BUDGET
+retention_spec = os.environ.get('GEOVERSE_RETENTION')
+retention = parse_retention(retention_spec)
+queue_capacity = int(os.environ.get('GEOVERSE_QUEUE_CAPACITY') or 0) or None
+store_kwargs = dict(retention=retention, queue_capacity=queue_capacity,
+                    queue_policy=os.environ.get('GEOVERSE_QUEUE_POLICY', 'reject'))
+shards = int(os.environ.get('GEOVERSE_SHARDS', '0'))
+if shards > 0:
+    storage_base = os.path.splitext(os.environ.get('GEOVERSE_STORAGE') or STORAGE_FILE)[0]
+    store = ShardRouter(shards, storage_base + '.shards', memory_budget=memory_budget // shards, **store_kwargs)
+else:
+    store = UserStore(os.environ.get('GEOVERSE_STORAGE'), memory_budget=memory_budget, **store_kwargs)
+# Session tokens are signed with GEOVERSE_SESSION_SECRET (a random key per process if
+# unset, so tokens then do not survive a restart). Every request must carry a token;
+# GEOVERSE_REQUIRE_SESSION=0 also accepts a bare ?userid= from older clients (logged once per user).
+SESSION_COOKIE = 'geoverse_session'
+sessions = SessionManager(os.environ.get('GEOVERSE_SESSION_SECRET') or os.urandom(32),
+                          workers=int(os.environ.get('GEOVERSE_LOGIN_WORKERS', 2)))
+REQUIRE_SESSION = os.environ.get('GEOVERSE_REQUIRE_SESSION', '1') != '0'
+legacy_userids = set()  # users already warned about, so the log names each one once
 # per-user online status (True=online, False=offline). Default: True when initialized.
 user_online_status = {}
+# upper bound on points returned by one paginated timeline/search call
+MAX_PAGE_SIZE = 5000
+# largest batch accepted by /api/ingest
+MAX_INGEST_POINTS = 10000
+# most timestamps / neighbours per lookup accepted by the nearest-in-time searches
+MAX_NEAREST_LOOKUPS = 10000
+MAX_NEAREST_K = 1000
+# reach of a /api/co-location query; presence keys probed per key grow with both
+MAX_CO_LOCATION_KM = 5.0
+MAX_CO_LOCATION_GAP = 3600
+# points fetched (and written out) per chunk of an /api/export stream
+EXPORT_CHUNK = 1000
+# seconds between keepalive comments on idle event streams
+STREAM_HEARTBEAT = 15
 
 
 def ensure_user_status(userid):
@@ -19,36 +67,108 @@ def ensure_user_status(userid):
     return user_online_status[userid]
 
 
-# Background generator thread: periodically create simulated locations for users.
-def generator_loop(poll_interval=10):
-    while True:
+def request_token():
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        return auth[len('Bearer '):].strip()
+    return request.cookies.get(SESSION_COOKIE)
+
+
+def request_userid(claimed):
+    """The userid a request acts for, or None if it may not act for `claimed`.
+    A session token (cookie or `Authorization: Bearer`) costs one HMAC check, or a
+    cache hit, and no store lookup; a `claimed` userid must then match it. Without
+    a token the legacy bare userid is only accepted (and logged) if it exists and
+    REQUIRE_SESSION is off.
+    """
+    token = request_token()
+    if token:
+        userid = sessions.verify(token)
+        if userid is None or (claimed and claimed != userid):
+            return None
+        return userid
+    if REQUIRE_SESSION or not claimed or not store.userid_exists(claimed):
+        return None
+    if claimed not in legacy_userids:
+        legacy_userids.add(claimed)
+        app.logger.warning('user %s is accessed via a bare ?userid= without a session token', claimed)
+    return claimed
+
+
+def page_args():
+    """Parse the limit/after/before/order query args shared by the timeline and search APIs.
+    Returns (limit, after, before, reverse); raises ValueError on malformed input.
+    """
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    before = request.args.get('before')
+    order = request.args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    if limit is not None:
+        limit = int(limit)
+        if limit <= 0:
+            raise ValueError('limit must be positive')
+        limit = min(limit, MAX_PAGE_SIZE)
+    after = float(after) if after is not None else None
+    before = float(before) if before is not None else None
+    return limit, after, before, order == 'desc'
+
+
+def conditional_json(etag, build):
+    """Answer 304 if the client's If-None-Match already has `etag`, else jsonify(build()).
+    Either way the response carries the ETag and asks the browser to revalidate,
+    so idle polling costs one version lookup.
+    """
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = jsonify(build())
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
+# Background generator: each user gets a simulated location every GENERATOR_INTERVAL
+# seconds (+/- GENERATOR_JITTER), scheduled on a heap of next-due times and run in
+# batches on a small worker pool, so the per-user rate does not drop as users are added.
+GENERATOR_INTERVAL = 20.0
+GENERATOR_JITTER = 10.0
+
+
+def generate_for(userids):
+    for uid in userids:
+        if not store.userid_exists(uid):
+            generator.remove(uid)
+            continue
+        online = ensure_user_status(uid)
+        entry = generate_random_location()
+        ts = entry.get('timestamp', time.time())
         try:
-            # snapshot user ids
-            userids = list(store.users.keys())
-            for uid in userids:
-                # decide interval per user to jitter generation
-                # skip if user structures missing (will be initialized on demand)
-                ensure_user_status(uid)
-                online = user_online_status.get(uid, True)
-                # generate a random location and insert accordingly
-                entry = generate_random_location()
-                ts = entry.get('timestamp', time.time())
-                if online:
-                    store.insert_location(uid, ts, entry['lat'], entry['lon'], online=True)
-                else:
-                    store.insert_location(uid, ts, entry['lat'], entry['lon'], online=False)
-                # small sleep between users to avoid tight bursts
-                time.sleep(0.05)
-        except Exception:
-            # swallow thread exceptions, continue looping
-            pass
-        # randomize wait to simulate 10-30s
-        time.sleep(random.uniform(poll_interval, poll_interval + 20))
-
-
-# start background thread once
-gen_thread = threading.Thread(target=generator_loop, args=(10,), daemon=True)
-gen_thread.start()
+            store.insert_location(uid, ts, entry['lat'], entry['lon'], online=online)
+        except QueueFull:
+            pass  # the user's offline queue is full and rejecting; skip this tick
+
+
+def schedule_user(userid):
+    if userid not in generator:
+        generator.add(userid, GENERATOR_INTERVAL, GENERATOR_JITTER)
+
+
+generator = Scheduler(generate_for, workers=int(os.environ.get('GEOVERSE_GENERATOR_WORKERS', 4)))
+for _uid in store.userids():
+    schedule_user(_uid)
+# start the scheduler once (GEOVERSE_GENERATOR=0 disables it, e.g. in tests)
+if os.environ.get('GEOVERSE_GENERATOR', '1') != '0':
+    generator.start()
+
+# Background compactor: downsamples history past the retention tiers every
+# RETENTION_INTERVAL seconds, on its own single-worker scheduler.
+RETENTION_INTERVAL = 3600.0
+compactor = Scheduler(lambda keys: store.apply_retention(), workers=1)
+if retention and os.environ.get('GEOVERSE_COMPACTOR', '1') != '0':
+    compactor.add('retention', RETENTION_INTERVAL)
+    compactor.start()
 
 @app.route('/')
 def index():
@@ -72,6 +192,7 @@ def signup():
             userid = store.reserve_user(phone)
         except ValueError as e:
             return str(e), 400
+        schedule_user(userid)
         # render password form and show generated userid
         return render_template('signup_password.html', phone=phone, userid=userid)
 
@@ -85,6 +206,7 @@ def signup():
             return 'Passwords do not match', 400
         try:
             store.set_password_for_user(userid, password)
+            sessions.forget_user(userid)
         except ValueError as e:
             return str(e), 400
         # show success page with UserID
@@ -96,16 +218,42 @@ def signup():
 def login():
     login = request.form.get('login')
     password = request.form.get('password')
-    userid = store.authenticate(login, password)
+    try:
+        userid = sessions.login(store.authenticate, login, password)
+    except LoginBusy:
+        return 'Too many login attempts in progress, try again shortly', 503, {'Retry-After': '1'}
     if not userid:
         return 'Invalid credentials', 401
-    # simple flow: redirect to dashboard with userid in query
-    return redirect(url_for('dashboard') + f'?userid={userid}')
+    # the session cookie identifies the user from here on
+    resp = redirect(url_for('dashboard'))
+    resp.set_cookie(SESSION_COOKIE, sessions.issue(userid), max_age=sessions.ttl, httponly=True, samesite='Lax')
+    return resp
+
+
+@app.route('/api/session', methods=['POST'])
+def api_session():
+    """Exchange {login, password} for a bearer token, for API clients without cookies."""
+    data = request.json or {}
+    try:
+        userid = sessions.login(store.authenticate, data.get('login'), data.get('password'))
+    except LoginBusy:
+        return jsonify({'error': 'too many logins in progress'}), 503, {'Retry-After': '1'}
+    if not userid:
+        return jsonify({'error': 'invalid credentials'}), 401
+    return jsonify({'userid': userid, 'token': sessions.issue(userid), 'expires_in': sessions.ttl})
+
+
+@app.route('/logout', methods=['POST'])
+def logout():
+    sessions.revoke(request_token())
+    resp = redirect(url_for('index'))
+    resp.delete_cookie(SESSION_COOKIE)
+    return resp
 
 @app.route('/dashboard')
 def dashboard():
-    userid = request.args.get('userid')
-    if not userid or not store.userid_exists(userid):
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
         return redirect(url_for('index'))
     # ensure status exists
     ensure_user_status(userid)
@@ -114,40 +262,38 @@ def dashboard():
 
 @app.route('/api/latest-location')
 def api_latest_location():
-    userid = request.args.get('userid')
+    userid = request_userid(request.args.get('userid'))
     count = int(request.args.get('count', 5))
-    if not userid or not store.userid_exists(userid):
+    if not userid:
         return jsonify({'error': 'invalid userid'}), 400
-    timeline = store.timeline(userid)
-    # return last `count` entries
-    last = timeline[-count:] if len(timeline) > 0 else []
-    return jsonify({'latest': last})
+    version = store.version(userid)
+    # the last `count` rows of the timeline
+    return conditional_json(f'{userid}-{version}-{count}',
+                            lambda: {'latest': store.latest(userid, count), 'version': version})
 
 
 @app.route('/api/offline-queue-count')
 def api_offline_queue_count():
-    userid = request.args.get('userid')
-    if not userid or not store.userid_exists(userid):
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
         return jsonify({'error': 'invalid userid'}), 400
-    s = store.get_structs(userid)
-    q = s['queue']
-    return jsonify({'count': len(q)})
+    count, queue_version = store.queue_state(userid)
+    return conditional_json(f'{userid}-q{queue_version}', lambda: {'count': count})
 
 
 @app.route('/api/sync-offline-data', methods=['POST'])
 def api_sync_offline_data():
     data = request.json or {}
-    userid = data.get('userid')
-    if not userid or not store.userid_exists(userid):
+    userid = request_userid(data.get('userid'))
+    if not userid:
         return jsonify({'error': 'invalid userid'}), 400
-    inserted = store.sync_queue(userid)
-    return jsonify({'synced': [n.to_dict() for n in inserted]})
+    return jsonify({'synced': store.sync_queue(userid)})
 
 
 @app.route('/api/user-status', methods=['GET'])
 def api_user_status():
-    userid = request.args.get('userid')
-    if not userid or not store.userid_exists(userid):
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
         return jsonify({'error': 'invalid userid'}), 400
     status = user_online_status.get(userid, True)
     return jsonify({'online': bool(status)})
@@ -156,34 +302,147 @@ def api_user_status():
 @app.route('/api/set-online', methods=['POST'])
 def api_set_online():
     data = request.json or {}
-    userid = data.get('userid')
+    userid = request_userid(data.get('userid'))
     online = data.get('online')
-    if not userid or not store.userid_exists(userid):
+    if not userid:
         return jsonify({'error': 'invalid userid'}), 400
     user_online_status[userid] = bool(online)
+    store.publish(userid, 'status', online=user_online_status[userid])
     return jsonify({'ok': True, 'online': user_online_status[userid]})
 
 
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events feed of a user's new points, synced batches and status changes.
+    A client that falls too far behind is dropped; EventSource reconnects and the
+    opening `hello` event lets it resynchronise.
+    """
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
+        return jsonify({'error': 'invalid userid'}), 400
+    sub = store.events.subscribe(userid)
+    count, queue_version = store.queue_state(userid)
+    hello = {'type': 'hello', 'version': store.version(userid), 'queue_version': queue_version,
+             'count': count, 'online': ensure_user_status(userid)}
+
+    def stream():
+        try:
+            yield f'event: hello\ndata: {json.dumps(hello)}\n\n'
+            while True:
+                event = sub.get(timeout=STREAM_HEARTBEAT)
+                if event is None:
+                    if sub.closed:
+                        break
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'event: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+        finally:
+            store.events.unsubscribe(sub)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def export_points(userid, start, end):
+    """Yield the points of start..end (inclusive) in chunks of EXPORT_CHUNK.
+    Each chunk is one page() walk (bisect + row scan) under a short read lock,
+    so memory stays bounded and a slow client never holds the user's lock.
+    """
+    after = math.nextafter(start, -math.inf) if start is not None else None
+    before = math.nextafter(end, math.inf) if end is not None else None
+    while True:
+        points, after = store.page(userid, after=after, before=before, limit=EXPORT_CHUNK)
+        if points:
+            yield points
+        if after is None:
+            return
+
+
+def export_ndjson(chunks):
+    for points in chunks:
+        yield ''.join(json.dumps(p) + '\n' for p in points)
+
+
+def export_csv(chunks):
+    yield 'timestamp,lat,lon,source\r\n'
+    for points in chunks:
+        yield ''.join(f"{p['timestamp']!r},{p['lat']!r},{p['lon']!r},{p['source']}\r\n" for p in points)
+
+
+def export_geojson(chunks):
+    yield '{"type": "FeatureCollection", "features": ['
+    sep = ''
+    for points in chunks:
+        features = [json.dumps({'type': 'Feature',
+                                'geometry': {'type': 'Point', 'coordinates': [p['lon'], p['lat']]},
+                                'properties': {'timestamp': p['timestamp'], 'source': p['source']}})
+                    for p in points]
+        yield sep + ', '.join(features)
+        sep = ', '
+    yield ']}\n'
+
+
+EXPORT_FORMATS = {
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+    'csv': (export_csv, 'text/csv'),
+    'geojson': (export_geojson, 'application/geo+json'),
+}
+
+
+@app.route('/api/export')
+def api_export():
+    """Stream a user's timeline (optionally start..end) as ndjson, csv or geojson.
+    The body is generated chunk by chunk (chunked transfer encoding), so server
+    memory does not grow with the size of the export.
+    """
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
+        return jsonify({'error': 'invalid userid'}), 400
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'format must be one of {", ".join(EXPORT_FORMATS)}'}), 400
+    try:
+        start, end = time_window_args()
+    except ValueError:
+        return jsonify({'error': 'invalid start/end'}), 400
+    encode, mimetype = EXPORT_FORMATS[fmt]
+    return Response(encode(export_points(userid, start, end)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{userid}.{fmt}"',
+                             'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/store-stats')
+def api_store_stats():
+    # cache hit/miss/eviction counters for tuning the memory budget, and generator lag
+    if not request_userid(None):
+        return jsonify({'error': 'session required'}), 401
+    stats = store.cache_stats()
+    stats['generator'] = generator.metrics()
+    stats['compactor'] = compactor.metrics()
+    stats['sessions'] = sessions.stats()
+    return jsonify(stats)
+
+
 @app.route('/history')
 def history():
-    userid = request.args.get('userid')
-    if not userid or not store.userid_exists(userid):
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
         return redirect(url_for('index'))
     return render_template('history.html', userid=userid)
 
 
 @app.route('/timeline')
 def timeline_page():
-    userid = request.args.get('userid')
-    if not userid or not store.userid_exists(userid):
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
         return redirect(url_for('index'))
     return render_template('timeline.html', userid=userid)
 
 
 @app.route('/search')
 def search_page():
-    userid = request.args.get('userid')
-    if not userid or not store.userid_exists(userid):
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
         return redirect(url_for('index'))
     # Search page removed; redirect users to the Timeline Map which contains search controls
     return redirect(url_for('timeline_page') + f'?userid={userid}')
@@ -191,55 +450,155 @@ def search_page():
 @app.route('/api/generate', methods=['POST'])
 def api_generate():
     data = request.json or {}
-    userid = data.get('userid')
+    userid = request_userid(data.get('userid'))
     online = data.get('online', True)
     count = int(data.get('count', 1))
-    if not userid or not store.userid_exists(userid):
+    if not userid:
         return jsonify({'error': 'invalid userid'}), 400
     created = []
     for _ in range(count):
         entry = generate_random_location()
         ts = entry['timestamp'] if 'timestamp' in entry else time.time()
-        if online:
-            node = store.insert_location(userid, ts, entry['lat'], entry['lon'], online=True)
-            created.append(node.to_dict())
-        else:
-            store.insert_location(userid, ts, entry['lat'], entry['lon'], online=False)
-            created.append({'timestamp': ts, 'lat': entry['lat'], 'lon': entry['lon'], 'source': 'offline'})
+        created.append({'timestamp': float(ts), 'lat': float(entry['lat']), 'lon': float(entry['lon']),
+                        'source': 'online' if online else 'offline'})
+    try:
+        store.insert_many(userid, [(p['timestamp'], p['lat'], p['lon'], online) for p in created])
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 429
     return jsonify({'created': created})
 
+@app.route('/api/ingest', methods=['POST'])
+def api_ingest():
+    """Bulk upload from a device: {userid, points: [{timestamp, lat, lon, online}, ...]}.
+    Points may also be [timestamp, lat, lon, online] arrays. The batch is validated as
+    a whole and applied with one merge and one log record.
+    """
+    data = request.json or {}
+    userid = request_userid(data.get('userid'))
+    points = data.get('points')
+    if not userid:
+        return jsonify({'error': 'invalid userid'}), 400
+    if not isinstance(points, list):
+        return jsonify({'error': 'points must be a list'}), 400
+    if len(points) > MAX_INGEST_POINTS:
+        return jsonify({'error': f'at most {MAX_INGEST_POINTS} points per request'}), 413
+    t0 = time.perf_counter()
+    try:
+        inserted, queued = store.insert_many(userid, points)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull as e:
+        # backpressure: the device should sync (or retry later) before queueing more
+        return jsonify({'error': str(e)}), 429
+    elapsed = time.perf_counter() - t0
+    return jsonify({'inserted': inserted, 'queued': queued, 'elapsed_ms': round(elapsed * 1000, 3)})
+
 @app.route('/api/sync', methods=['POST'])
 def api_sync():
     data = request.json or {}
-    userid = data.get('userid')
-    if not userid or not store.userid_exists(userid):
+    userid = request_userid(data.get('userid'))
+    if not userid:
         return jsonify({'error': 'invalid userid'}), 400
-    inserted = store.sync_queue(userid)
-    return jsonify({'synced': [n.to_dict() for n in inserted]})
+    return jsonify({'synced': store.sync_queue(userid)})
 
 @app.route('/api/timeline')
 def api_timeline():
-    userid = request.args.get('userid')
-    if not userid or not store.userid_exists(userid):
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
         return jsonify({'error': 'invalid userid'}), 400
-    return jsonify({'timeline': store.timeline(userid)})
+    try:
+        limit, after, before, reverse = page_args()
+        since = request.args.get('since')
+        since = int(since) if since is not None else None
+    except ValueError:
+        return jsonify({'error': 'invalid paging arguments'}), 400
+    try:
+        zoom = request.args.get('zoom')
+        zoom = int(zoom) if zoom is not None else None
+    except ValueError:
+        return jsonify({'error': 'invalid zoom'}), 400
+    version = store.version(userid)
+    etag = f'{userid}-{version}-{request.query_string.decode()}'
+    if zoom is not None:
+        # level-of-detail track for map rendering
+        def build():
+            return {'timeline': store.simplified(userid, zoom), 'version': version, 'zoom': zoom}
+    elif since is not None:
+        # delta poll: only points added or merged after `since`
+        def build():
+            points, current, reset = store.changes_since(userid, since)
+            return {'timeline': points, 'version': current, 'reset': reset}
+    elif limit is None and after is None and before is None and not reverse:
+        def build():
+            return {'timeline': store.timeline(userid), 'version': version}
+    else:
+        def build():
+            points, cursor = store.page(userid, after=after, before=before, limit=limit, reverse=reverse)
+            return {'timeline': points, 'next_cursor': cursor, 'version': version}
+    return conditional_json(etag, build)
 
 @app.route('/api/search')
 def api_search():
-    userid = request.args.get('userid')
+    userid = request_userid(request.args.get('userid'))
     start = float(request.args.get('start', 0))
     end = float(request.args.get('end', time.time()))
-    if not userid or not store.userid_exists(userid):
+    if not userid:
         return jsonify({'error': 'invalid userid'}), 400
-    res = store.search_range(userid, start, end)
-    return jsonify({'results': res})
+    try:
+        limit, after, before, reverse = page_args()
+    except ValueError:
+        return jsonify({'error': 'invalid paging arguments'}), 400
+    mode = request.args.get('mode')
+    if mode is not None:
+        return search_aggregate(userid, mode, start, end)
+    zoom = request.args.get('zoom')
+    if zoom is not None:
+        try:
+            zoom = int(zoom)
+        except ValueError:
+            return jsonify({'error': 'invalid zoom'}), 400
+        return jsonify({'results': store.simplified(userid, zoom, start, end), 'zoom': zoom})
+    if limit is None and after is None and before is None and not reverse:
+        res = store.search_range(userid, start, end)
+        return jsonify({'results': res})
+    # start/end are inclusive; the page walk takes exclusive cursors
+    lo = math.nextafter(start, -math.inf)
+    hi = math.nextafter(end, math.inf)
+    lo = max(lo, after) if after is not None else lo
+    hi = min(hi, before) if before is not None else hi
+    res, cursor = store.page(userid, after=lo, before=hi, limit=limit, reverse=reverse)
+    return jsonify({'results': res, 'next_cursor': cursor})
+
+
+def search_aggregate(userid, mode, start, end):
+    """/api/search?mode=count|summary|kth|rank: answered by binary search on
+    the timestamp column and block bounding boxes, without materializing the points in the window."""
+    if mode == 'count':
+        return jsonify({'count': store.count_range(userid, start, end)})
+    if mode == 'summary':
+        return jsonify(store.range_summary(userid, start, end))
+    if mode == 'kth':
+        try:
+            k = int(request.args.get('k', 0))
+        except ValueError:
+            return jsonify({'error': 'invalid k'}), 400
+        return jsonify({'result': store.kth_in_range(userid, start, end, k), 'k': k})
+    if mode == 'rank':
+        try:
+            ts = float(request.args['ts'])
+        except (KeyError, ValueError):
+            return jsonify({'error': 'missing or invalid ts'}), 400
+        # points of the window strictly before ts
+        before = store.count_range(userid, start, min(end, math.nextafter(ts, -math.inf)))
+        return jsonify({'rank': before, 'ts': ts})
+    return jsonify({'error': 'invalid mode'}), 400
 
 
 @app.route('/api/search-nearest')
 def api_search_nearest():
-    userid = request.args.get('userid')
+    userid = request_userid(request.args.get('userid'))
     ts = request.args.get('ts')
-    if not userid or not store.userid_exists(userid):
+    if not userid:
         return jsonify({'error': 'invalid userid'}), 400
     if not ts:
         return jsonify({'error': 'missing ts'}), 400
@@ -247,8 +606,166 @@ def api_search_nearest():
         tsv = float(ts)
     except Exception:
         return jsonify({'error': 'invalid ts'}), 400
-    res = store.search_nearest(userid, tsv)
+    if 'k' not in request.args and 'max_distance' not in request.args:
+        res = store.search_nearest(userid, tsv)
+        return jsonify({'results': res})
+    try:
+        k, max_distance = nearest_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'results': store.search_k_nearest(userid, tsv, k, max_distance)})
+
+
+def nearest_args(args):
+    """k (default 1) and optional max_distance (seconds) for the k-nearest searches."""
+    try:
+        k = int(args.get('k', 1))
+        max_distance = args.get('max_distance')
+        max_distance = float(max_distance) if max_distance is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('invalid k or max_distance')
+    if not 1 <= k <= MAX_NEAREST_K:
+        raise ValueError(f'k must be between 1 and {MAX_NEAREST_K}')
+    if max_distance is not None and not max_distance >= 0:
+        raise ValueError('max_distance must be >= 0')
+    return k, max_distance
+
+
+@app.route('/api/search-nearest/batch', methods=['POST'])
+def api_search_nearest_batch():
+    """{userid, timestamps: [sorted], k, max_distance} -> one result list per timestamp,
+    answered in a single pass along the user's timeline."""
+    data = request.json or {}
+    userid = request_userid(data.get('userid'))
+    timestamps = data.get('timestamps')
+    if not userid:
+        return jsonify({'error': 'invalid userid'}), 400
+    if not isinstance(timestamps, list):
+        return jsonify({'error': 'timestamps must be a list'}), 400
+    if len(timestamps) > MAX_NEAREST_LOOKUPS:
+        return jsonify({'error': f'at most {MAX_NEAREST_LOOKUPS} timestamps per request'}), 413
+    try:
+        k, max_distance = nearest_args(data)
+        timestamps = [float(t) for t in timestamps]
+        results = store.search_nearest_many(userid, timestamps, k, max_distance)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'results': results})
+
+def time_window_args():
+    """Optional start/end query args for the spatial searches; raises ValueError if malformed."""
+    start = request.args.get('start')
+    end = request.args.get('end')
+    return (float(start) if start is not None else None,
+            float(end) if end is not None else None)
+
+
+@app.route('/api/rollup')
+def api_rollup():
+    """Per-bucket count, first/last point, distance and bbox; cost grows with buckets, not points."""
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
+        return jsonify({'error': 'invalid userid'}), 400
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in GRANULARITIES:
+        return jsonify({'error': f'granularity must be one of {", ".join(GRANULARITIES)}'}), 400
+    try:
+        start, end = time_window_args()
+    except ValueError:
+        return jsonify({'error': 'invalid start/end'}), 400
+    version = store.version(userid)
+    etag = f'{userid}-{version}-{request.query_string.decode()}'
+    return conditional_json(etag, lambda: {'granularity': granularity, 'version': version,
+                                           'buckets': store.rollup(userid, granularity, start, end)})
+
+
+@app.route('/api/search-bbox')
+def api_search_bbox():
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
+        return jsonify({'error': 'invalid userid'}), 400
+    try:
+        min_lat = float(request.args['min_lat'])
+        min_lon = float(request.args['min_lon'])
+        max_lat = float(request.args['max_lat'])
+        max_lon = float(request.args['max_lon'])
+        start, end = time_window_args()
+    except (KeyError, ValueError):
+        return jsonify({'error': 'min_lat, min_lon, max_lat and max_lon are required numbers'}), 400
+    if min_lat > max_lat:
+        return jsonify({'error': 'min_lat must not exceed max_lat'}), 400
+    res = store.search_bbox(userid, min_lat, min_lon, max_lat, max_lon, start, end)
+    return jsonify({'results': res})
+
+
+@app.route('/api/search-radius')
+def api_search_radius():
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
+        return jsonify({'error': 'invalid userid'}), 400
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        radius_km = float(request.args['radius_km'])
+        start, end = time_window_args()
+    except (KeyError, ValueError):
+        return jsonify({'error': 'lat, lon and radius_km are required numbers'}), 400
+    if radius_km < 0:
+        return jsonify({'error': 'radius_km must be non-negative'}), 400
+    res = store.search_radius(userid, lat, lon, radius_km, start, end)
     return jsonify({'results': res})
 
+
+def region_args(args):
+    """A presence Box (min_lat, min_lon, max_lat, max_lon) or Circle (lat, lon, radius_km) from query args."""
+    if 'radius_km' in args:
+        radius_km = float(args['radius_km'])
+        if radius_km < 0:
+            raise ValueError('radius_km must be non-negative')
+        return Circle(float(args['lat']), float(args['lon']), radius_km)
+    box = Box(float(args['min_lat']), float(args['min_lon']), float(args['max_lat']), float(args['max_lon']))
+    if box.min_lat > box.max_lat:
+        raise ValueError('min_lat must not exceed max_lat')
+    return box
+
+
+@app.route('/api/nearby-users')
+def api_nearby_users():
+    """Other users with points in a box or circle during start..end, from the store-wide presence index."""
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
+        return jsonify({'error': 'invalid userid'}), 400
+    try:
+        region = region_args(request.args)
+        start, end = time_window_args()
+    except KeyError:
+        return jsonify({'error': 'min_lat, min_lon, max_lat and max_lon, or lat, lon and radius_km, are required'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    users = [u for u in store.nearby_users(region, start, end) if u['userid'] != userid]
+    return jsonify({'users': users})
+
+
+@app.route('/api/co-location')
+def api_co_location():
+    """Episodes in which the user and `other` were within max_distance_km and max_gap_s of each other."""
+    userid = request_userid(request.args.get('userid'))
+    if not userid:
+        return jsonify({'error': 'invalid userid'}), 400
+    other = request.args.get('other')
+    if not other or not store.userid_exists(other):
+        return jsonify({'error': 'invalid other'}), 400
+    try:
+        max_distance_km = float(request.args.get('max_distance_km', 0.1))
+        max_gap_s = float(request.args.get('max_gap_s', 300))
+        start, end = time_window_args()
+    except ValueError:
+        return jsonify({'error': 'max_distance_km, max_gap_s, start and end must be numbers'}), 400
+    if not (0 <= max_distance_km <= MAX_CO_LOCATION_KM and 0 <= max_gap_s <= MAX_CO_LOCATION_GAP):
+        return jsonify({'error': f'max_distance_km must be within [0, {MAX_CO_LOCATION_KM}] '
+                                 f'and max_gap_s within [0, {MAX_CO_LOCATION_GAP}]'}), 400
+    episodes = store.co_location(userid, other, max_distance_km, max_gap_s, start, end)
+    return jsonify({'episodes': episodes})
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,153 @@
+"""Compare the iterative / bulk-loaded AVLTree against the original recursive one.
+
+Usage (from the repository root):
+    python -m GeoVerse.benchmarks.bench_avl            # 10^4 and 10^5 points
+    python -m GeoVerse.benchmarks.bench_avl 10000 1000000
+"""
+import sys
+import time
+import random
+from GeoVerse.data_structures.avl import AVLTree
+from GeoVerse.data_structures.dll import DLLNode
+
+
+class RecursiveAVLNode:
+    def __init__(self, key, value):
+        self.key = key
+        self.values = [value]
+        self.left = None
+        self.right = None
+        self.height = 1
+
+
+class RecursiveAVLTree:
+    """The original recursive implementation, kept as the benchmark baseline."""
+    def __init__(self):
+        self.root = None
+
+    def _height(self, node):
+        return node.height if node else 0
+
+    def _balance_factor(self, node):
+        return self._height(node.left) - self._height(node.right)
+
+    def _rotate_right(self, y):
+        x = y.left
+        T2 = x.right
+        x.right = y
+        y.left = T2
+        y.height = 1 + max(self._height(y.left), self._height(y.right))
+        x.height = 1 + max(self._height(x.left), self._height(x.right))
+        return x
+
+    def _rotate_left(self, x):
+        y = x.right
+        T2 = y.left
+        y.left = x
+        x.right = T2
+        x.height = 1 + max(self._height(x.left), self._height(x.right))
+        y.height = 1 + max(self._height(y.left), self._height(y.right))
+        return y
+
+    def _insert(self, node, key, value):
+        if not node:
+            return RecursiveAVLNode(key, value)
+        if key < node.key:
+            node.left = self._insert(node.left, key, value)
+        elif key > node.key:
+            node.right = self._insert(node.right, key, value)
+        else:
+            node.values.append(value)
+            return node
+        node.height = 1 + max(self._height(node.left), self._height(node.right))
+        balance = self._balance_factor(node)
+        if balance > 1 and key < node.left.key:
+            return self._rotate_right(node)
+        if balance < -1 and key > node.right.key:
+            return self._rotate_left(node)
+        if balance > 1 and key > node.left.key:
+            node.left = self._rotate_left(node.left)
+            return self._rotate_right(node)
+        if balance < -1 and key < node.right.key:
+            node.right = self._rotate_right(node.right)
+            return self._rotate_left(node)
+        return node
+
+    def insert(self, key, value):
+        self.root = self._insert(self.root, float(key), value)
+
+    def _range_collect(self, node, start, end, out):
+        if not node:
+            return
+        if node.key > start:
+            self._range_collect(node.left, start, end, out)
+        if start <= node.key <= end:
+            out.extend(node.values)
+        if node.key < end:
+            self._range_collect(node.right, start, end, out)
+
+    def search_range(self, start, end):
+        out = []
+        self._range_collect(self.root, float(start), float(end), out)
+        return out
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - t0, result
+
+
+def run(n, queries=1000, seed=42):
+    rnd = random.Random(seed)
+    t0 = 1.7e9
+    sorted_keys = [t0 + i * 10.0 for i in range(n)]
+    shuffled = sorted_keys[:]
+    rnd.shuffle(shuffled)
+    nodes = [DLLNode(k, 0.0, 0.0) for k in sorted_keys]
+    windows = []
+    for _ in range(queries):
+        a = rnd.uniform(t0, t0 + n * 10.0)
+        windows.append((a, a + 600.0))
+
+    def load_old():
+        tree = RecursiveAVLTree()
+        for node in nodes:
+            tree.insert(node.timestamp, node)
+        return tree
+
+    def load_new():
+        return AVLTree.build_sorted((node.timestamp, node) for node in nodes)
+
+    def random_insert(cls):
+        def go():
+            tree = cls()
+            for k in shuffled:
+                tree.insert(k, None)
+            return tree
+        return go
+
+    rows = []
+    old_load, old_tree = timed(load_old)
+    new_load, new_tree = timed(load_new)
+    rows.append(('startup load (sorted)', old_load, new_load))
+    old_ins, _ = timed(random_insert(RecursiveAVLTree))
+    new_ins, _ = timed(random_insert(AVLTree))
+    rows.append(('insert (random order)', old_ins, new_ins))
+    old_rng, a = timed(lambda: [len(old_tree.search_range(s, e)) for s, e in windows])
+    new_rng, b = timed(lambda: [len(new_tree.search_range(s, e)) for s, e in windows])
+    assert a == b
+    rows.append((f'search_range x{queries}', old_rng, new_rng))
+    return rows
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [10 ** 4, 10 ** 5]
+    print(f"{'n':>9}  {'operation':<24} {'recursive s':>12} {'current s':>10} {'speedup':>8}")
+    for n in sizes:
+        for name, old, new in run(n):
+            print(f"{n:>9}  {name:<24} {old:>12.4f} {new:>10.4f} {old / new:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
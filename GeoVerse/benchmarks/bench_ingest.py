@@ -0,0 +1,58 @@
+"""Ingest throughput in points per second: one insert_location call per point
+versus UserStore.insert_many batches.
+
+Usage (from the repository root):
+    python -m GeoVerse.benchmarks.bench_ingest            # 20000 points, batches of 500
+    python -m GeoVerse.benchmarks.bench_ingest 100000 1000
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+from GeoVerse.data_structures.user_store import UserStore
+
+
+def make_points(n, late_fraction=0.1, offline_fraction=0.1, seed=42):
+    rnd = random.Random(seed)
+    t0 = 1.7e9
+    points = []
+    for i in range(n):
+        ts = t0 + i
+        if rnd.random() < late_fraction:
+            ts -= rnd.uniform(0, 3600)
+        points.append((ts, rnd.uniform(-60, 60), rnd.uniform(-170, 170), rnd.random() >= offline_fraction))
+    return points
+
+
+def run(n, batch):
+    points = make_points(n)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ('insert_location', 'insert_many'):
+            store = UserStore(storage_file=os.path.join(tmp, name + '.json'), memory_budget=None)
+            uid = store.reserve_user('+' + name)
+            store.get_structs(uid)
+            start = time.perf_counter()
+            if name == 'insert_location':
+                for ts, lat, lon, online in points:
+                    store.insert_location(uid, ts, lat, lon, online=online)
+            else:
+                for i in range(0, n, batch):
+                    store.insert_many(uid, points[i:i + batch])
+            store.flush()
+            results.append((name, time.perf_counter() - start))
+            store.close()
+    return results
+
+
+def main(argv):
+    n = int(argv[0]) if argv else 20000
+    batch = int(argv[1]) if len(argv) > 1 else 500
+    print(f"{'method':<16} {'points':>8} {'seconds':>9} {'points/s':>10}")
+    for name, secs in run(n, batch):
+        print(f"{name:<16} {n:>8} {secs:>9.3f} {n / secs:>10.0f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+"""Login throughput and latency under concurrent load, and the per-request cost
+of identifying a user by session token.
+
+`direct` runs store.authenticate (scrypt) on every request thread, as /login
+used to; `pool` runs it on the SessionManager's bounded password-check pool
+(requests turned away with LoginBusy are counted as rejected); `cached`
+repeats logins that already succeeded.
+
+Usage (from the repository root):
+    python -m GeoVerse.benchmarks.bench_login            # 8 threads, 8 users, 4 logins each
+    python -m GeoVerse.benchmarks.bench_login 32 16 4
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+from GeoVerse.data_structures.user_store import UserStore
+from GeoVerse.data_structures.sessions import SessionManager, LoginBusy
+
+
+def load(threads, per_thread, login_once):
+    latencies, rejected = [], [0]
+    lock = threading.Lock()
+
+    def worker(n):
+        for i in range(per_thread):
+            start = time.perf_counter()
+            try:
+                login_once(n, i)
+            except LoginBusy:
+                with lock:
+                    rejected[0] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    ts = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return time.perf_counter() - start, sorted(latencies), rejected[0]
+
+
+def main(argv):
+    threads = int(argv[0]) if argv else 8
+    users = int(argv[1]) if len(argv) > 1 else 8
+    per_thread = int(argv[2]) if len(argv) > 2 else 4
+    with tempfile.TemporaryDirectory() as tmp:
+        store = UserStore(storage_file=os.path.join(tmp, 'storage.json'))
+        phones = [f'+1555{i:04d}' for i in range(users)]
+        for phone in phones:
+            store.create_user(phone, 'password-' + phone)
+        sessions = SessionManager(os.urandom(32))
+
+        def creds(n, i):
+            phone = phones[(n * per_thread + i) % users]
+            return phone, 'password-' + phone
+
+        runs = [
+            ('direct', lambda n, i: store.authenticate(*creds(n, i))),
+            ('pool', lambda n, i: sessions.login(store.authenticate, *creds(n, i))),
+        ]
+        print(f"{'path':<8} {'logins':>7} {'rejected':>8} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+        # 'cached' repeats the 'pool' logins, which are then all remembered
+        for name, fn in runs + [('cached', runs[1][1])]:
+            secs, lat, rejected = load(threads, per_thread, fn)
+            if not lat:
+                print(f'{name:<8} all {rejected} logins rejected')
+                continue
+            print(f'{name:<8} {len(lat):>7} {rejected:>8} {len(lat) / secs:>9.1f} {lat[len(lat) // 2] * 1e3:>8.2f} '
+                  f'{lat[int(0.95 * (len(lat) - 1))] * 1e3:>8.2f} {lat[-1] * 1e3:>8.2f}')
+
+        uid = store.phone_to_userid(phones[0])
+        token = sessions.issue(uid)
+        cold = SessionManager(sessions.secret)
+        n = 100000
+        for name, fn in [('userid_exists', lambda: store.userid_exists(uid)),
+                         ('verify (cached)', lambda: sessions.verify(token)),
+                         ('verify (HMAC)', lambda: cold._verified.pop(token) or cold.verify(token))]:
+            start = time.perf_counter()
+            for _ in range(n):
+                fn()
+            print(f'{name:<16} {(time.perf_counter() - start) / n * 1e6:>8.2f} us/call')
+        sessions.close()
+        cold.close()
+        store.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,60 @@
+"""Aggregate ingest + query throughput with the store split over 1..N shard processes.
+
+Usage (from the repository root):
+    python -m GeoVerse.benchmarks.bench_shards            # 1, 2 and 4 shards
+    python -m GeoVerse.benchmarks.bench_shards 1 2 4 8
+
+Each run pipelines batched inserts and range queries for 64 users from a few
+client threads; on an idle machine ops/s should grow roughly with the number of
+shards up to the core count.
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+from GeoVerse.data_structures.sharding import ShardRouter
+
+USERS = 64
+BATCHES = 20
+BATCH = 200
+CLIENTS = 4
+
+
+def run(shards):
+    with tempfile.TemporaryDirectory() as tmp:
+        router = ShardRouter(shards, tmp, memory_budget=None)
+        uids = [router.reserve_user(f'+{i}') for i in range(USERS)]
+
+        def client(mine):
+            for b in range(BATCHES):
+                futures = []
+                for uid in mine:
+                    t0 = 1e10 + b * BATCH
+                    futures.append(router.submit(uid, 'insert_many', [(t0 + i, 0.0, 0.0) for i in range(BATCH)]))
+                    futures.append(router.submit(uid, 'search_range', t0, t0 + BATCH / 2))
+                for f in futures:
+                    f.result()
+
+        threads = [threading.Thread(target=client, args=(uids[i::CLIENTS],)) for i in range(CLIENTS)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        router.close()
+    return USERS * BATCHES * BATCH / elapsed, USERS * BATCHES * 2 / elapsed
+
+
+def main(argv):
+    counts = [int(a) for a in argv] or [1, 2, 4]
+    print(f'cpus: {os.cpu_count()}')
+    print(f"{'shards':>6} {'points/s':>10} {'requests/s':>11}")
+    for n in counts:
+        points, requests = run(n)
+        print(f'{n:>6} {points:>10.0f} {requests:>11.0f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,272 @@
+"""Reproducible benchmark suite: data-structure micro-benchmarks at several
+timeline sizes and in-process HTTP runs against the Flask app, with JSON
+output and comparison against a stored baseline.
+
+Datasets are built with generate_random_location from a fixed seed: one point
+every ~20 s (the generator's cadence) with 10% of them arriving late. Each
+micro-benchmark is timed `--repeat` times and the best run is kept; HTTP
+endpoints report requests/s and p50/p95/max latency over `--requests` calls
+through the test client (no network or server process involved).
+
+Usage (from the repository root):
+    python -m GeoVerse.benchmarks.suite                                  # sizes 1e3..1e5
+    python -m GeoVerse.benchmarks.suite --sizes 1000,1000000 --json run.json
+    python -m GeoVerse.benchmarks.suite --json new.json --baseline run.json --threshold 0.25
+
+With --baseline, every result is matched to the baseline's by name and size.
+A result more than `threshold` slower (per-op time for micro-benchmarks, p50
+latency for endpoints) is reported as a regression and the exit status is 1.
+Timings are only comparable on the same machine: benchmarks/baseline.json is a
+reference run with the default arguments, not something to gate other hosts on;
+record a baseline with --json on the machine that runs the comparison.
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+from GeoVerse.data_structures.dll import DoublyLinkedList
+from GeoVerse.data_structures.avl import AVLTree
+from GeoVerse.data_structures.user_store import UserStore
+from GeoVerse.data_structures.generator import generate_random_location
+
+GEOVERSE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_SIZES = (1000, 10000, 100000)
+T0 = 1.7e9
+# lookups/late inserts per micro-benchmark run, so per-op figures compare across sizes
+QUERIES = 1000
+
+
+def make_dataset(n, seed=42, late_fraction=0.1):
+    """n points as (timestamp, lat, lon) in arrival order; a late point lags by up to an hour."""
+    rnd, loc_rnd = random.Random(seed), random.Random(seed)
+    points = []
+    for i in range(n):
+        ts = T0 + 20 * i + rnd.uniform(-10, 10)
+        if rnd.random() < late_fraction:
+            ts -= rnd.uniform(0, 3600)
+        loc = generate_random_location(ts, loc_rnd)
+        points.append((loc['timestamp'], loc['lat'], loc['lon']))
+    return points
+
+
+def best_of(repeat, setup, run):
+    """Best wall time of run(setup()) over `repeat` runs; setup is not timed."""
+    best = None
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        secs = time.perf_counter() - start
+        best = secs if best is None else min(best, secs)
+    return best
+
+
+def micro(n, repeat, seed, tmp):
+    points = make_dataset(n, seed)
+    ordered = sorted(points)
+    rnd = random.Random(seed)
+    late = [(ordered[-1][0] - rnd.uniform(0, 3600), lat, lon) for _, lat, lon in points[:QUERIES]]
+    span = ordered[-1][0] - ordered[0][0]
+    # windows of about 100 points each
+    windows = [(t, t + 2000) for t in (ordered[0][0] + rnd.uniform(0, span) for _ in range(QUERIES))]
+    probes = [ordered[0][0] + rnd.uniform(0, span) for _ in range(QUERIES)]
+
+    def dll_of(rows):
+        dll = DoublyLinkedList()
+        for ts, lat, lon in rows:
+            dll.append(ts, lat, lon)
+        return dll
+
+    def avl_of(rows):
+        dll = dll_of(rows)
+        return AVLTree.build_sorted((node.timestamp, node) for node in dll)
+
+    def insert_sorted(dll):
+        for ts, lat, lon in late:
+            dll.insert_sorted(ts, lat, lon)
+
+    def avl_insert(avl):
+        for ts, lat, lon in points:
+            avl.insert(ts, (lat, lon))
+
+    def search_range(avl):
+        for start, end in windows:
+            avl.search_range(start, end)
+
+    def find_nearest(avl):
+        for ts in probes:
+            avl.find_nearest(ts)
+
+    def store_with(name, online):
+        # a resident user with the dataset either on its timeline or in its offline queue
+        path = os.path.join(tmp, f'{name}-{n}-{time.perf_counter_ns()}.json')
+        store = UserStore(storage_file=path, memory_budget=None, compact_every=10 ** 9)
+        uid = store.reserve_user('+1555')
+        store.get_structs(uid)
+        store.insert_many(uid, [(ts, lat, lon, online) for ts, lat, lon in points])
+        return store, uid
+
+    def sync_queue(state):
+        store, uid = state
+        store.sync_queue(uid)
+        store.close()
+
+    def save(state):
+        store, _ = state
+        store._save()
+        store.close()
+
+    cases = [
+        ('dll.append', n, lambda: ordered, dll_of),
+        ('dll.insert_sorted', len(late), lambda: dll_of(ordered), insert_sorted),
+        ('avl.insert', n, AVLTree, avl_insert),
+        ('avl.search_range', len(windows), lambda: avl_of(ordered), search_range),
+        ('avl.find_nearest', len(probes), lambda: avl_of(ordered), find_nearest),
+        ('store.sync_queue', n, lambda: store_with('sync', False), sync_queue),
+        ('store._save', n, lambda: store_with('save', True), save),
+    ]
+    results = []
+    for name, ops, setup, run in cases:
+        secs = best_of(repeat, setup, run)
+        results.append({'kind': 'micro', 'name': name, 'n': n, 'ops': ops, 'seconds': secs,
+                        'us_per_op': secs / ops * 1e6})
+        print(f"{name:<20} {n:>9} {ops:>8} {secs:>9.4f} s {secs / ops * 1e6:>11.2f} us/op", flush=True)
+    return results
+
+
+def http(points, requests, seed, tmp):
+    os.environ['GEOVERSE_STORAGE'] = os.path.join(tmp, 'http', 'storage.json')
+    os.environ['GEOVERSE_GENERATOR'] = '0'
+    os.environ['GEOVERSE_COMPACTOR'] = '0'
+    os.environ['GEOVERSE_REQUIRE_SESSION'] = '0'
+    sys.path.insert(0, GEOVERSE_DIR)
+    import app as app_module
+    app_module.app.config['TESTING'] = True
+    client = app_module.app.test_client()
+    store = app_module.store
+    data = sorted(make_dataset(points, seed))
+    uid = store.reserve_user('+1555000')
+    for i in range(0, len(data), 5000):
+        store.insert_many(uid, [(ts, lat, lon, True) for ts, lat, lon in data[i:i + 5000]])
+    t0, t1 = data[0][0], data[-1][0]
+    mid = (t0 + t1) / 2
+    rnd = random.Random(seed)
+    ingest_ts = iter(range(int(t1) + 1, 10 ** 12))
+
+    def ingest_body():
+        return {'userid': uid, 'points': [{'timestamp': next(ingest_ts), 'lat': rnd.uniform(-80, 80),
+                                           'lon': rnd.uniform(-170, 170), 'online': True} for _ in range(100)]}
+
+    endpoints = [
+        ('GET /api/timeline', lambda: client.get(f'/api/timeline?userid={uid}&limit=100&after={mid}')),
+        ('GET /api/search', lambda: client.get(f'/api/search?userid={uid}&start={mid}&end={mid + 2000}')),
+        ('GET /api/search-nearest', lambda: client.get(f'/api/search-nearest?userid={uid}&ts={rnd.uniform(t0, t1)}')),
+        ('GET /api/search-bbox', lambda: client.get(
+            f'/api/search-bbox?userid={uid}&min_lat=10&min_lon=10&max_lat=20&max_lon=20')),
+        ('GET /api/rollup', lambda: client.get(f'/api/rollup?userid={uid}&granularity=day')),
+        ('GET /api/latest-location', lambda: client.get(f'/api/latest-location?userid={uid}')),
+        ('GET /api/nearby-users', lambda: client.get(
+            f'/api/nearby-users?userid={uid}&min_lat=10&min_lon=10&max_lat=20&max_lon=20&start={mid}&end={mid + 86400}')),
+        ('POST /api/ingest', lambda: client.post('/api/ingest', json=ingest_body())),
+    ]
+    results = []
+    for name, call in endpoints:
+        resp = call()
+        if resp.status_code != 200:
+            raise RuntimeError(f'{name} answered {resp.status_code}: {resp.get_data(as_text=True)[:200]}')
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(requests):
+            t = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - t)
+        secs = time.perf_counter() - start
+        latencies.sort()
+        row = {'kind': 'http', 'name': name, 'n': points, 'ops': requests, 'seconds': secs,
+               'requests_per_s': requests / secs,
+               'p50_ms': latencies[len(latencies) // 2] * 1e3,
+               'p95_ms': latencies[int(0.95 * (len(latencies) - 1))] * 1e3,
+               'max_ms': latencies[-1] * 1e3}
+        results.append(row)
+        print(f"{name:<26} {row['requests_per_s']:>9.1f} req/s {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+              f"{row['max_ms']:>8.2f} ms (p50/p95/max)", flush=True)
+    store.close()
+    return results
+
+
+def metric(row):
+    return row['us_per_op'] if row['kind'] == 'micro' else row['p50_ms']
+
+
+def compare(results, baseline, threshold):
+    """Pair each result with the baseline's (same kind, name and n); returns (rows, regressions)
+    where rows are (result, baseline_result or None, ratio or None)."""
+    old = {(r['kind'], r['name'], r['n']): r for r in baseline['results']}
+    rows, regressions = [], []
+    for r in results:
+        base = old.get((r['kind'], r['name'], r['n']))
+        ratio = metric(r) / metric(base) if base and metric(base) else None
+        rows.append((r, base, ratio))
+        if ratio is not None and ratio > 1 + threshold:
+            regressions.append(r)
+    return rows, regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m GeoVerse.benchmarks.suite', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma-separated points per user for the micro-benchmarks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--http-points', type=int, default=10000, help='points on the HTTP benchmark user')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--only', choices=('micro', 'http'))
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file (from the same machine) to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='slowdown reported as a regression')
+    args = parser.parse_args(argv)
+    sizes = [int(float(s)) for s in args.sizes.split(',') if s]
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.only != 'http':
+            print(f"{'benchmark':<20} {'n':>9} {'ops':>8} {'best':>11} {'per op':>14}")
+            for n in sizes:
+                results += micro(n, args.repeat, args.seed, tmp)
+        if args.only != 'micro':
+            print(f'\nHTTP, {args.http_points} points, {args.requests} requests per endpoint')
+            results += http(args.http_points, args.requests, args.seed, tmp)
+
+    report = {
+        'created': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': vars(args),
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nwrote {args.json}')
+    if not args.baseline:
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    rows, regressions = compare(results, baseline, args.threshold)
+    print(f"\n{'benchmark':<26} {'n':>9} {'baseline':>12} {'now':>12} {'ratio':>7}  (us/op or p50 ms)")
+    for r, base, ratio in rows:
+        if base is None:
+            print(f"{r['name']:<26} {r['n']:>9} {'-':>12} {metric(r):>12.3f} {'new':>7}")
+            continue
+        flag = '  REGRESSION' if r in regressions else ''
+        print(f"{r['name']:<26} {r['n']:>9} {metric(base):>12.3f} {metric(r):>12.3f} {ratio:>7.2f}{flag}")
+    print(f'\n{len(regressions)} regression(s) beyond {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -3,5 +3,10 @@ from .avl import AVLTree
 from .queue_ds import QueueDS
 from .user_store import UserStore
 from .generator import generate_random_location
+from .wal import WriteAheadLog
+from .columnar import ColumnarTimeline
+from .pubsub import EventBroker
+from .spatial import GridIndex, haversine_km
+from .scheduler import Scheduler
 
-__all__ = ["DoublyLinkedList", "DLLNode", "AVLTree", "QueueDS", "UserStore", "generate_random_location"]
+__all__ = ["DoublyLinkedList", "DLLNode", "AVLTree", "QueueDS", "UserStore", "generate_random_location", "WriteAheadLog", "ColumnarTimeline", "EventBroker", "GridIndex", "haversine_km", "Scheduler"]
@@ -1,100 +1,286 @@
+INF = float("inf")
+
+
 class AVLNode:
+    # size: values in this subtree; min/max lat/lon: their bounding box (bbox trees only)
+    __slots__ = ("key", "values", "left", "right", "height", "size", "min_lat", "max_lat", "min_lon", "max_lon")
+
     def __init__(self, key, value):
         self.key = key
         self.values = [value]
         self.left = None
         self.right = None
         self.height = 1
+        self.size = 1
 
 class AVLTree:
     """An AVL tree indexing timestamps -> list of DLLNode references.
-    Supports insertion and range search.
+    Supports insertion, range search and O(n) bulk loading from sorted input.
+    Insert and traversal are iterative, so tree depth never hits the recursion limit.
+
+    Every node also records how many values its subtree holds, which gives
+    O(log n) count_range / rank / kth without visiting the matching values. With
+    `track_bbox` (values must have lat/lon) nodes also keep their subtree's
+    bounding box, for O(log n) windowed bounding boxes.
     """
-    def __init__(self):
+    def __init__(self, track_bbox=False):
         self.root = None
+        self.track_bbox = track_bbox
 
-    def _height(self, node):
-        return node.height if node else 0
-
-    def _balance_factor(self, node):
-        return self._height(node.left) - self._height(node.right)
+    def _update(self, node):
+        left, right = node.left, node.right
+        lh = left.height if left else 0
+        rh = right.height if right else 0
+        node.height = 1 + (lh if lh > rh else rh)
+        node.size = len(node.values) + (left.size if left else 0) + (right.size if right else 0)
+        if self.track_bbox:
+            lats = [v.lat for v in node.values]
+            lons = [v.lon for v in node.values]
+            min_lat, max_lat, min_lon, max_lon = min(lats), max(lats), min(lons), max(lons)
+            for child in (left, right):
+                if child:
+                    min_lat = min(min_lat, child.min_lat)
+                    max_lat = max(max_lat, child.max_lat)
+                    min_lon = min(min_lon, child.min_lon)
+                    max_lon = max(max_lon, child.max_lon)
+            node.min_lat, node.max_lat, node.min_lon, node.max_lon = min_lat, max_lat, min_lon, max_lon
 
     def _rotate_right(self, y):
         x = y.left
-        T2 = x.right
+        y.left = x.right
         x.right = y
-        y.left = T2
-        y.height = 1 + max(self._height(y.left), self._height(y.right))
-        x.height = 1 + max(self._height(x.left), self._height(x.right))
+        self._update(y)
+        self._update(x)
         return x
 
     def _rotate_left(self, x):
         y = x.right
-        T2 = y.left
+        x.right = y.left
         y.left = x
-        x.right = T2
-        x.height = 1 + max(self._height(x.left), self._height(x.right))
-        y.height = 1 + max(self._height(y.left), self._height(y.right))
+        self._update(x)
+        self._update(y)
         return y
 
-    def _insert(self, node, key, value):
-        if not node:
-            return AVLNode(key, value)
-        if key < node.key:
-            node.left = self._insert(node.left, key, value)
-        elif key > node.key:
-            node.right = self._insert(node.right, key, value)
-        else:
-            node.values.append(value)
-            return node
-
-        node.height = 1 + max(self._height(node.left), self._height(node.right))
-        balance = self._balance_factor(node)
-
-        # LL
-        if balance > 1 and key < node.left.key:
-            return self._rotate_right(node)
-        # RR
-        if balance < -1 and key > node.right.key:
-            return self._rotate_left(node)
-        # LR
-        if balance > 1 and key > node.left.key:
-            node.left = self._rotate_left(node.left)
-            return self._rotate_right(node)
-        # RL
-        if balance < -1 and key < node.right.key:
-            node.right = self._rotate_right(node.right)
-            return self._rotate_left(node)
-
-        return node
+    def __len__(self):
+        return self.root.size if self.root else 0
 
     def insert(self, key, value):
-        self.root = self._insert(self.root, float(key), value)
-
-    def _range_collect(self, node, start, end, out):
-        if not node:
+        """Iterative AVL insert: descend once recording the path, then retrace it
+        upwards updating heights and aggregates; at most one (single/double)
+        rotation restores balance.
+        """
+        key = float(key)
+        node = self.root
+        if node is None:
+            self.root = AVLNode(key, value)
+            self._update(self.root)
             return
-        if node.key > start:
-            self._range_collect(node.left, start, end, out)
-        if start <= node.key <= end:
-            out.extend(node.values)
-        if node.key < end:
-            self._range_collect(node.right, start, end, out)
+        path = []
+        while True:
+            path.append(node)
+            if key < node.key:
+                if node.left is None:
+                    node.left = AVLNode(key, value)
+                    self._update(node.left)
+                    break
+                node = node.left
+            elif key > node.key:
+                if node.right is None:
+                    node.right = AVLNode(key, value)
+                    self._update(node.right)
+                    break
+                node = node.right
+            else:
+                node.values.append(value)
+                break
+
+        rebalanced = False
+        for i in range(len(path) - 1, -1, -1):
+            node = path[i]
+            lh = node.left.height if node.left else 0
+            rh = node.right.height if node.right else 0
+            balance = lh - rh
+            if rebalanced or -1 <= balance <= 1:
+                # heights above a rotation are unchanged, but sizes/boxes still grow
+                self._update(node)
+                continue
+            if balance > 1:
+                # LL / LR
+                if key > node.left.key:
+                    node.left = self._rotate_left(node.left)
+                sub = self._rotate_right(node)
+            else:
+                # RR / RL
+                if key < node.right.key:
+                    node.right = self._rotate_right(node.right)
+                sub = self._rotate_left(node)
+            rebalanced = True
+            if i == 0:
+                self.root = sub
+            elif path[i - 1].left is node:
+                path[i - 1].left = sub
+            else:
+                path[i - 1].right = sub
+
+    @classmethod
+    def build_sorted(cls, items, track_bbox=False):
+        """Build a balanced tree in O(n) from (key, value) pairs sorted by key.
+        Equal keys are grouped into one node, like repeated insert() calls.
+        """
+        tree = cls(track_bbox)
+        nodes = []
+        for key, value in items:
+            key = float(key)
+            if nodes and nodes[-1].key == key:
+                nodes[-1].values.append(value)
+            else:
+                nodes.append(AVLNode(key, value))
+
+        def build(lo, hi):
+            if lo >= hi:
+                return None
+            mid = (lo + hi) // 2
+            node = nodes[mid]
+            node.left = build(lo, mid)
+            node.right = build(mid + 1, hi)
+            tree._update(node)
+            return node
+
+        tree.root = build(0, len(nodes))
+        return tree
 
     def search_range(self, start, end):
+        """Return values with start <= key <= end in key order (iterative in-order walk)."""
+        start, end = float(start), float(end)
         out = []
-        self._range_collect(self.root, float(start), float(end), out)
+        stack = []
+        node = self.root
+        while stack or node:
+            while node:
+                stack.append(node)
+                # the left subtree only holds keys < node.key
+                node = node.left if node.key > start else None
+            node = stack.pop()
+            if node.key > end:
+                break
+            if node.key >= start:
+                out.extend(node.values)
+            node = node.right if node.key < end else None
         return out
 
+    def rank(self, key, inclusive=False):
+        """Number of values with key < `key` (<= when inclusive), in O(log n)."""
+        key = float(key)
+        node, count = self.root, 0
+        while node:
+            if node.key < key or (inclusive and node.key == key):
+                count += len(node.values) + (node.left.size if node.left else 0)
+                node = node.right
+            else:
+                node = node.left
+        return count
+
+    def count_range(self, start, end):
+        """Number of values with start <= key <= end, without visiting them."""
+        if start > end:
+            return 0
+        return self.rank(end, inclusive=True) - self.rank(start)
+
+    def kth(self, k):
+        """Return the k-th value (0-based) in key order, or None if out of range."""
+        node = self.root
+        if k < 0 or node is None or k >= node.size:
+            return None
+        while node:
+            left = node.left.size if node.left else 0
+            if k < left:
+                node = node.left
+            elif k < left + len(node.values):
+                return node.values[k - left]
+            else:
+                k -= left + len(node.values)
+                node = node.right
+        return None
+
+    def bbox_range(self, start, end):
+        """(min_lat, min_lon, max_lat, max_lon) of values with start <= key <= end, or None.
+        Combines O(log n) whole-subtree boxes along the two search paths; needs track_bbox.
+        """
+        start, end = float(start), float(end)
+        box = [INF, INF, -INF, -INF]
+
+        def add_values(node):
+            for v in node.values:
+                box[0], box[1] = min(box[0], v.lat), min(box[1], v.lon)
+                box[2], box[3] = max(box[2], v.lat), max(box[3], v.lon)
+
+        def add_subtree(node):
+            if node:
+                box[0], box[1] = min(box[0], node.min_lat), min(box[1], node.min_lon)
+                box[2], box[3] = max(box[2], node.max_lat), max(box[3], node.max_lon)
+
+        # descend to the first node inside the window; its subtree holds the whole range
+        node = self.root
+        while node and not start <= node.key <= end:
+            node = node.left if end < node.key else node.right
+        if node is None:
+            return None
+        add_values(node)
+        cur = node.left
+        while cur:
+            if cur.key >= start:
+                add_values(cur)
+                add_subtree(cur.right)
+                cur = cur.left
+            else:
+                cur = cur.right
+        cur = node.right
+        while cur:
+            if cur.key <= end:
+                add_values(cur)
+                add_subtree(cur.left)
+                cur = cur.right
+            else:
+                cur = cur.left
+        return tuple(box)
+
+    def _inorder(self):
+        stack = []
+        node = self.root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node
+            node = node.right
+
     def to_list(self):
-        out = []
-        def inorder(n):
-            if not n: return
-            inorder(n.left)
-            out.append((n.key, [v.to_dict() for v in n.values]))
-            inorder(n.right)
-        inorder(self.root)
-        return out
+        return [(n.key, [v.to_dict() for v in n.values]) for n in self._inorder()]
+
+    def ceiling(self, key, strict=False):
+        """Return the tree node with the smallest key >= `key` (> `key` if strict), or None."""
+        key = float(key)
+        node, best = self.root, None
+        while node:
+            if node.key > key or (not strict and node.key == key):
+                best = node
+                node = node.left
+            else:
+                node = node.right
+        return best
+
+    def floor(self, key, strict=False):
+        """Return the tree node with the largest key <= `key` (< `key` if strict), or None."""
+        key = float(key)
+        node, best = self.root, None
+        while node:
+            if node.key < key or (not strict and node.key == key):
+                best = node
+                node = node.right
+            else:
+                node = node.left
+        return best
 
     def find_nearest(self, key):
         """Find the node(s) with the timestamp nearest to `key`.
@@ -0,0 +1,256 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+# small-int codes for the `source` column
+SOURCES = ("online", "offline", "synced")
+SOURCE_CODES = {name: code for code, name in enumerate(SOURCES)}
+# rows per block summarized by RangeBounds
+BOUNDS_BLOCK = 256
+
+
+class TimelineSlice:
+    """Zero-copy view over rows [start, stop) of a ColumnarTimeline.
+    Columns are memoryviews into the timeline's arrays; call release() (or use
+    the slice as a context manager) once done with it.
+    """
+    def __init__(self, cols, start, stop):
+        ts, lat, lon, src = cols
+        self.timestamps = memoryview(ts)[start:stop]
+        self.lats = memoryview(lat)[start:stop]
+        self.lons = memoryview(lon)[start:stop]
+        self.sources = memoryview(src)[start:stop]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def rows(self):
+        for ts, lat, lon, src in zip(self.timestamps, self.lats, self.lons, self.sources):
+            yield ts, lat, lon, SOURCES[src]
+
+    def to_list(self):
+        return [{"timestamp": ts, "lat": lat, "lon": lon, "source": src} for ts, lat, lon, src in self.rows()]
+
+    def release(self):
+        for mv in (self.timestamps, self.lats, self.lons, self.sources):
+            mv.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ColumnarTimeline:
+    """Chronologically sorted timeline stored as parallel typed arrays.
+    timestamp/lat/lon are float64 columns and source is a uint8 code, so a
+    point costs 25 bytes instead of a Python object plus a dict.
+    Append is amortized O(1) for increasing timestamps; late points are placed
+    with a binary search, and sorted batches are merged in one linear pass.
+
+    Readers need no lock while a single writer mutates the timeline: appends fill
+    the columns in order and `src` last, so its length is the committed row count,
+    and every other write builds new arrays and swaps the column tuple in one
+    assignment. slice()/search_range() therefore always see a consistent prefix.
+    """
+    def __init__(self):
+        self._cols = (array("d"), array("d"), array("d"), array("B"))
+
+    ts = property(lambda self: self._cols[0])
+    lat = property(lambda self: self._cols[1])
+    lon = property(lambda self: self._cols[2])
+    src = property(lambda self: self._cols[3])
+
+    @classmethod
+    def from_dicts(cls, entries):
+        tl = cls()
+        entries = sorted(entries, key=lambda x: x["timestamp"])
+        tl.ts.extend(float(e["timestamp"]) for e in entries)
+        tl.lat.extend(float(e.get("lat", 0.0)) for e in entries)
+        tl.lon.extend(float(e.get("lon", 0.0)) for e in entries)
+        tl.src.extend(SOURCE_CODES[e.get("source", "online")] for e in entries)
+        return tl
+
+    @classmethod
+    def from_columns(cls, timestamps, lats, lons, sources):
+        """Build from parallel column lists that are already sorted by timestamp."""
+        tl = cls()
+        tl.ts.extend(timestamps)
+        tl.lat.extend(lats)
+        tl.lon.extend(lons)
+        tl.src.extend(sources)
+        return tl
+
+    def to_columns(self):
+        """Return the columns as plain lists (sources as codes)."""
+        return self.ts.tolist(), self.lat.tolist(), self.lon.tolist(), self.src.tolist()
+
+    def _detach(self):
+        # a live TimelineSlice pins the arrays (BufferError on resize); swap in private
+        # copies of the committed rows (dropping a half-appended one) and leave the old
+        # buffers to the readers
+        n = len(self.src)
+        self._cols = tuple(col[:n] for col in self._cols)
+
+    def append(self, timestamp, lat, lon, source="online"):
+        timestamp = float(timestamp)
+        if self.ts and timestamp < self.ts[-1]:
+            return self.insert(timestamp, lat, lon, source)
+        try:
+            self._append(timestamp, lat, lon, source)
+        except BufferError:
+            self._detach()
+            self._append(timestamp, lat, lon, source)
+        return len(self.ts) - 1
+
+    def _append(self, timestamp, lat, lon, source):
+        self.ts.append(timestamp)
+        self.lat.append(float(lat))
+        self.lon.append(float(lon))
+        self.src.append(SOURCE_CODES[source])
+
+    def insert(self, timestamp, lat, lon, source="online"):
+        """Insert a point at its chronological position (after equal timestamps)."""
+        timestamp = float(timestamp)
+        i = bisect_right(self.ts, timestamp)
+        self._insert(i, timestamp, lat, lon, source)
+        return i
+
+    def _insert(self, i, timestamp, lat, lon, source):
+        # copy-on-write: shifting rows in place would tear concurrent readers
+        cols = []
+        for col, value in zip(self._cols, (timestamp, float(lat), float(lon), SOURCE_CODES[source])):
+            new = col[:i]
+            new.append(value)
+            new.extend(col[i:])
+            cols.append(new)
+        self._cols = tuple(cols)
+
+    def merge_sorted(self, rows):
+        """Merge (timestamp, lat, lon, source) rows sorted by timestamp and return the
+        indices they landed at, in order. The untouched prefix is copied in bulk, so the
+        Python-level work is O(m log n) for m rows rather than O(n + m).
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+        if not self.ts or rows[0][0] >= self.ts[-1]:
+            return [self.append(ts, lat, lon, source) for ts, lat, lon, source in rows]
+        ots, olat, olon, osrc = self._cols
+        n = len(osrc)
+        # rows before the first merged one are copied wholesale; only the tail is interleaved
+        i = bisect_right(ots, float(rows[0][0]), 0, n)
+        ts, lat, lon, src = ots[:i], olat[:i], olon[:i], osrc[:i]
+        placed = []
+        for rts, rlat, rlon, rsrc in rows:
+            rts = float(rts)
+            j = bisect_right(ots, rts, i, n)
+            if j > i:
+                ts.extend(ots[i:j]); lat.extend(olat[i:j]); lon.extend(olon[i:j]); src.extend(osrc[i:j])
+                i = j
+            placed.append(len(ts))
+            ts.append(rts); lat.append(float(rlat)); lon.append(float(rlon)); src.append(SOURCE_CODES[rsrc])
+        ts.extend(ots[i:n]); lat.extend(olat[i:n]); lon.extend(olon[i:n]); src.extend(osrc[i:n])
+        self._cols = (ts, lat, lon, src)
+        return placed
+
+    def retain(self, keep, stop):
+        """Keep rows `keep` (sorted indices below `stop`) and every row from `stop` on,
+        dropping the others; built as new columns and swapped in, like merge_sorted."""
+        cols = self._cols
+        n = len(cols[3])
+        self._cols = tuple(array(col.typecode, [col[i] for i in keep]) + col[stop:n] for col in cols)
+
+    def rank(self, timestamp, inclusive=False):
+        """Number of rows with a timestamp before `timestamp` (or equal to it, when inclusive)."""
+        cols = self._cols
+        return (bisect_right if inclusive else bisect_left)(cols[0], float(timestamp), 0, len(cols[3]))
+
+    def range_indices(self, start, end):
+        """Return (i, j) such that rows [i, j) have start <= timestamp <= end."""
+        cols = self._cols
+        ts, n = cols[0], len(cols[3])
+        return bisect_left(ts, float(start), 0, n), bisect_right(ts, float(end), 0, n)
+
+    def slice(self, start=0, stop=None):
+        cols = self._cols
+        n = len(cols[3])
+        stop = n if stop is None else min(stop, n)
+        return TimelineSlice(cols, start, stop)
+
+    def search_range(self, start, end):
+        """Zero-copy view of the rows with start <= timestamp <= end, taken from one snapshot."""
+        cols = self._cols
+        ts, n = cols[0], len(cols[3])
+        return TimelineSlice(cols, bisect_left(ts, float(start), 0, n), bisect_right(ts, float(end), 0, n))
+
+    def point(self, i):
+        """Row `i` as a dict."""
+        ts, lat, lon, src = self._cols
+        return {"timestamp": ts[i], "lat": lat[i], "lon": lon[i], "source": SOURCES[src[i]]}
+
+    def points(self, indices):
+        """The rows at `indices` as dicts, in the order given."""
+        ts, lat, lon, src = self._cols
+        return [{"timestamp": ts[i], "lat": lat[i], "lon": lon[i], "source": SOURCES[src[i]]} for i in indices]
+
+    def rows(self, start=0, stop=None):
+        stop = len(self.ts) if stop is None else stop
+        for i in range(start, stop):
+            yield self.ts[i], self.lat[i], self.lon[i], SOURCES[self.src[i]]
+
+    def to_list(self):
+        with self.slice() as view:
+            return view.to_list()
+
+    def nbytes(self):
+        return sum(col.itemsize * len(col) for col in (self.ts, self.lat, self.lon, self.src))
+
+    def __len__(self):
+        return len(self.src)
+
+    def clear(self):
+        self._cols = (array("d"), array("d"), array("d"), array("B"))
+
+
+class RangeBounds:
+    """Bounding boxes of row ranges of a ColumnarTimeline, from the lat/lon minima and
+    maxima of fixed blocks of `block` rows. Only whole blocks are summarized, and those
+    from the first changed row on are dropped by invalidate_from() and recomputed by the
+    next query, so appends cost nothing and a query is O(block + rows / block).
+    """
+    def __init__(self, timeline, block=BOUNDS_BLOCK):
+        self.timeline = timeline
+        self.block = block
+        self._blocks = (array("d"), array("d"), array("d"), array("d"))  # min lat, min lon, max lat, max lon
+
+    def invalidate_from(self, row):
+        """Forget the blocks holding rows `row` and later (they changed or moved)."""
+        for col in self._blocks:
+            del col[row // self.block:]
+
+    def _summarize(self, stop):
+        min_lat, min_lon, max_lat, max_lon = self._blocks
+        tl, b = self.timeline, self.block
+        for k in range(len(min_lat), stop):
+            lats, lons = tl.lat[k * b:(k + 1) * b], tl.lon[k * b:(k + 1) * b]
+            min_lat.append(min(lats)); min_lon.append(min(lons))
+            max_lat.append(max(lats)); max_lon.append(max(lons))
+
+    def bbox(self, i, j):
+        """(min_lat, min_lon, max_lat, max_lon) of rows [i, j), or None if the range is empty."""
+        if j <= i:
+            return None
+        tl, b = self.timeline, self.block
+        lo, hi = -(-i // b), j // b  # the whole blocks inside the range
+        if lo >= hi:
+            lats, lons = tl.lat[i:j], tl.lon[i:j]
+            return min(lats), min(lons), max(lats), max(lons)
+        self._summarize(hi)
+        min_lat, min_lon, max_lat, max_lon = self._blocks
+        box = [min(min_lat[lo:hi]), min(min_lon[lo:hi]), max(max_lat[lo:hi]), max(max_lon[lo:hi])]
+        for start, stop in ((i, lo * b), (hi * b, j)):
+            if start < stop:
+                lats, lons = tl.lat[start:stop], tl.lon[start:stop]
+                box = [min(box[0], min(lats)), min(box[1], min(lons)), max(box[2], max(lats)), max(box[3], max(lons))]
+        return tuple(box)
@@ -0,0 +1,28 @@
+"""Convert a store to binary timeline segments.
+
+Usage (from the repository root):
+    python -m GeoVerse.data_structures.convert_segments [path/to/storage.json]
+
+Handles both an old storage.json that embeds every timeline and per-user JSON
+segments next to it; users already in binary form are left alone.
+"""
+import os
+import sys
+import json
+from .user_store import UserStore, STORAGE_FILE
+
+
+def convert_storage(storage_file):
+    """Rewrite every user of the store at `storage_file` as a binary segment; returns the count."""
+    if not os.path.exists(storage_file):
+        raise FileNotFoundError(storage_file)
+    store = UserStore(storage_file=storage_file, memory_budget=None)
+    try:
+        return store.convert_segments()
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    target = sys.argv[1] if len(sys.argv) > 1 else STORAGE_FILE
+    print(json.dumps({'storage': target, 'converted_users': convert_storage(target)}))
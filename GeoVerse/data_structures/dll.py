@@ -1,6 +1,9 @@
+import math
 import time
 
 class DLLNode:
+    __slots__ = ("timestamp", "lat", "lon", "source", "prev", "next")
+
     def __init__(self, timestamp, lat, lon, source="online"):
         self.timestamp = float(timestamp)
         self.lat = float(lat)
@@ -38,8 +41,8 @@ class DoublyLinkedList:
                 node.prev = self.tail
                 self.tail = node
             else:
-                # fallback to sorted insert
-                self.insert_sorted(node)
+                # fallback to sorted insert (which counts the node itself)
+                return self.insert_sorted(node)
         self.size += 1
         return node
 
@@ -65,8 +68,9 @@ class DoublyLinkedList:
             self.size += 1
             return node
 
-        # fast path: insert before head
-        if node.timestamp <= self.head.timestamp:
+        # fast path: insert before head (a tie goes after existing equal timestamps,
+        # as in ColumnarTimeline.insert)
+        if node.timestamp < self.head.timestamp:
             node.next = self.head
             self.head.prev = node
             self.head = node
@@ -90,6 +94,93 @@ class DoublyLinkedList:
         self.size += 1
         return node
 
+    def merge_sorted(self, entries, source="synced"):
+        """Merge (timestamp, lat, lon) entries sorted by timestamp in one linear pass.
+        Walks back from the tail once to the oldest entry's position, then splices the
+        entries in while moving forward: O(k + m) for m entries landing among the last
+        k nodes, instead of one backwards scan per entry. Returns the new nodes in order.
+        """
+        inserted = []
+        if not entries:
+            return inserted
+        first_ts = float(entries[0][0])
+        # cur = last node with timestamp <= first entry (None: insert before head)
+        cur = self.tail
+        while cur and cur.timestamp > first_ts:
+            cur = cur.prev
+        for ts, lat, lon in entries:
+            node = DLLNode(ts, lat, lon, source)
+            if cur is None:
+                if self.head and self.head.timestamp <= node.timestamp:
+                    cur = self.head
+                else:
+                    node.next = self.head
+                    if self.head:
+                        self.head.prev = node
+                    else:
+                        self.tail = node
+                    self.head = node
+                    cur = node
+                    inserted.append(node)
+                    continue
+            while cur.next and cur.next.timestamp <= node.timestamp:
+                cur = cur.next
+            nxt = cur.next
+            cur.next = node
+            node.prev = cur
+            node.next = nxt
+            if nxt:
+                nxt.prev = node
+            else:
+                self.tail = node
+            cur = node
+            inserted.append(node)
+        self.size += len(inserted)
+        return inserted
+
+    def last(self, count):
+        """Return the newest `count` nodes as dicts (oldest first), walking back from the tail."""
+        out = []
+        cur = self.tail
+        while cur and len(out) < count:
+            out.append(cur.to_dict())
+            cur = cur.prev
+        out.reverse()
+        return out
+
+    def k_nearest(self, anchor, timestamp, k, max_distance=None):
+        """Return the `k` nodes nearest in time to `timestamp` (oldest first), skipping any
+        further than `max_distance` seconds away. `anchor` is a node with the smallest
+        timestamp >= `timestamp` (None if there is none), e.g. from an AVL ceiling lookup;
+        two cursors then walk outwards from it, so the cost is O(k) after the lookup.
+        """
+        right = anchor
+        # equal timestamps may sit on either side of the anchor; start from the first
+        while right is not None and right.prev is not None and right.prev.timestamp >= timestamp:
+            right = right.prev
+        left = right.prev if right is not None else self.tail
+        before, after = [], []
+        while len(before) + len(after) < k:
+            dl = timestamp - left.timestamp if left else math.inf
+            dr = right.timestamp - timestamp if right else math.inf
+            d = min(dl, dr)
+            if d == math.inf or (max_distance is not None and d > max_distance):
+                break
+            if dl <= dr:
+                before.append(left)
+                left = left.prev
+            else:
+                after.append(right)
+                right = right.next
+        before.reverse()
+        return before + after
+
+    def __iter__(self):
+        cur = self.head
+        while cur:
+            yield cur
+            cur = cur.next
+
     def to_list(self):
         out = []
         cur = self.head
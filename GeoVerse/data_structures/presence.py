@@ -0,0 +1,289 @@
+import os
+import math
+import struct
+from bisect import bisect_left, bisect_right
+from .spatial import haversine_km, radius_bbox, KM_PER_DEG_LAT
+
+# keys are hour-long time buckets on a grid of 0.01 degree cells (about 1.1 km north-south)
+PRESENCE_BUCKET = 3600
+PRESENCE_CELL_DEG = 0.01
+# per-user sidecar next to the segment: header magic, format version, log_seq of the segment
+# it matches, then (bucket, cell x, cell y, count, first_ts, last_ts) rows
+PRESENCE_EXT = '.presence'
+PRESENCE_MAGIC = b'GVPR'
+PRESENCE_HEADER = struct.Struct('<4sIQ')
+PRESENCE_ROW = struct.Struct('<qiiIdd')
+
+
+def write_presence(path, log_seq, rows):
+    """Atomically write a user's presence rows (see PresenceIndex.rows) to `path`."""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(PRESENCE_HEADER.pack(PRESENCE_MAGIC, 1, log_seq))
+        f.write(b''.join(PRESENCE_ROW.pack(*row) for row in rows))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_presence(path):
+    """Return (log_seq, rows) from a sidecar, or None if it is missing or unreadable."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, log_seq = PRESENCE_HEADER.unpack_from(data, 0)
+        if magic != PRESENCE_MAGIC or version != 1:
+            return None
+        return log_seq, list(PRESENCE_ROW.iter_unpack(data[PRESENCE_HEADER.size:]))
+    except (OSError, struct.error):
+        return None
+
+
+class Box:
+    """Query region for PresenceIndex.search(); min_lon > max_lon wraps across the antimeridian."""
+    def __init__(self, min_lat, min_lon, max_lat, max_lon):
+        self.min_lat, self.min_lon, self.max_lat, self.max_lon = min_lat, min_lon, max_lat, max_lon
+        if min_lon > max_lon:
+            self.lons = [(min_lon, 180.0), (-180.0, max_lon)]
+        else:
+            self.lons = [(min_lon, max_lon)]
+
+    def bbox(self):
+        return self.min_lat, self.min_lon, self.max_lat, self.max_lon
+
+    def contains(self, lat, lon):
+        return self.min_lat <= lat <= self.max_lat and any(lo <= lon <= hi for lo, hi in self.lons)
+
+    def covers(self, min_lat, min_lon, max_lat, max_lon):
+        return (self.min_lat <= min_lat and max_lat <= self.max_lat
+                and any(lo <= min_lon and max_lon <= hi for lo, hi in self.lons))
+
+
+class Circle:
+    """Query region of every point within `radius_km` of (lat, lon)."""
+    def __init__(self, lat, lon, radius_km):
+        self.lat, self.lon, self.radius_km = lat, lon, radius_km
+
+    def bbox(self):
+        return radius_bbox(self.lat, self.lon, self.radius_km)
+
+    def contains(self, lat, lon):
+        return haversine_km(self.lat, self.lon, lat, lon) <= self.radius_km
+
+    def covers(self, min_lat, min_lon, max_lat, max_lon):
+        # every point of the cell is within one cell height of its centre
+        d = haversine_km(self.lat, self.lon, (min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
+        return d + KM_PER_DEG_LAT * max(max_lat - min_lat, max_lon - min_lon) <= self.radius_km
+
+
+class PresenceIndex:
+    """Store-wide index of which users were where, and when.
+
+    Keys are (time bucket, cell x, cell y): epoch-aligned buckets of `bucket` seconds
+    on the lat/lon grid GridIndex uses. Each key holds userid -> [count, first_ts,
+    last_ts] for that user's points in it, so a cross-user query visits the occupied
+    keys it overlaps instead of every user's history. A cell that lies inside the
+    query region, with its points' time span inside the window, is answered from the
+    counts; the users of the other overlapping cells still have their points checked.
+    """
+    def __init__(self, bucket=PRESENCE_BUCKET, cell_deg=PRESENCE_CELL_DEG):
+        self.bucket = bucket
+        self.cell_deg = cell_deg
+        self.buckets = {}  # bucket -> {(ix, iy): {userid: [count, first, last]}}
+        self.by_user = {}  # userid -> set of (bucket, ix, iy)
+        self.entries = 0   # (key, user) pairs, for memory accounting
+
+    def key(self, ts, lat, lon):
+        return (math.floor(ts / self.bucket), math.floor(lon / self.cell_deg), math.floor(lat / self.cell_deg))
+
+    def add(self, userid, ts, lat, lon):
+        k = self.key(ts, lat, lon)
+        users = self.buckets.setdefault(k[0], {}).setdefault(k[1:], {})
+        stat = users.get(userid)
+        if stat is None:
+            users[userid] = [1, ts, ts]
+            self.by_user.setdefault(userid, set()).add(k)
+            self.entries += 1
+        else:
+            stat[0] += 1
+            stat[1] = min(stat[1], ts)
+            stat[2] = max(stat[2], ts)
+
+    def add_many(self, userid, rows):
+        """Add (timestamp, lat, lon) rows."""
+        for ts, lat, lon in rows:
+            self.add(userid, ts, lat, lon)
+
+    def remove_user(self, userid):
+        keys = self.by_user.pop(userid, ())
+        self.entries -= len(keys)
+        for b, ix, iy in keys:
+            cells = self.buckets[b]
+            users = cells[ix, iy]
+            del users[userid]
+            if not users:
+                del cells[ix, iy]
+                if not cells:
+                    del self.buckets[b]
+
+    def keys(self, userid, start=None, end=None):
+        """The user's keys, optionally only those whose bucket overlaps start..end."""
+        lo = -math.inf if start is None else math.floor(start / self.bucket)
+        hi = math.inf if end is None else math.floor(end / self.bucket)
+        return sorted(k for k in self.by_user.get(userid, ()) if lo <= k[0] <= hi)
+
+    def rows(self, userid):
+        """The user's entries as (bucket, cell x, cell y, count, first_ts, last_ts) tuples."""
+        return [(b, ix, iy, *self.buckets[b][ix, iy][userid]) for b, ix, iy in self.by_user.get(userid, ())]
+
+    def load_rows(self, userid, rows):
+        """Replace the user's entries with rows from rows()."""
+        self.remove_user(userid)
+        keys = self.by_user[userid] = set()
+        for b, ix, iy, count, first, last in rows:
+            self.buckets.setdefault(b, {}).setdefault((ix, iy), {})[userid] = [count, first, last]
+            keys.add((b, ix, iy))
+        self.entries += len(keys)
+
+    def spans(self, userid, keys):
+        """Merged (first_ts, last_ts) spans covering the user's points in `keys`."""
+        out = []
+        for first, last in sorted(self.buckets[b][ix, iy][userid][1:] for b, ix, iy in keys
+                                  if (b, ix, iy) in self.by_user.get(userid, ())):
+            if out and first <= out[-1][1]:
+                out[-1][1] = max(out[-1][1], last)
+            else:
+                out.append([first, last])
+        return out
+
+    def cell_bounds(self, ix, iy):
+        d = self.cell_deg
+        return iy * d, ix * d, (iy + 1) * d, (ix + 1) * d
+
+    def _buckets_in(self, start, end):
+        lo = -math.inf if start is None else math.floor(start / self.bucket)
+        hi = math.inf if end is None else math.floor(end / self.bucket)
+        if hi - lo + 1 > len(self.buckets):
+            # open or long window over few buckets: cheaper to filter the occupied ones
+            return [b for b in self.buckets if lo <= b <= hi]
+        return [b for b in range(lo, hi + 1) if b in self.buckets]
+
+    def _cells_in(self, cells, min_lat, min_lon, max_lat, max_lon):
+        d = self.cell_deg
+        x0, x1 = math.floor(min_lon / d), math.floor(max_lon / d)
+        y0, y1 = math.floor(min_lat / d), math.floor(max_lat / d)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(cells):
+            return [k for k in cells if x0 <= k[0] <= x1 and y0 <= k[1] <= y1]
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) if (x, y) in cells]
+
+    def search(self, region, start=None, end=None):
+        """Users with points in `region` (a Box or Circle) between start and end.
+
+        Returns (exact, partial): exact maps userid -> [count, first_ts, last_ts] summed
+        over keys wholly inside the query; partial maps userid -> keys whose points
+        still have to be checked against the region and window.
+        """
+        min_lat, min_lon, max_lat, max_lon = region.bbox()
+        lons = [(min_lon, 180.0), (-180.0, max_lon)] if min_lon > max_lon else [(min_lon, max_lon)]
+        exact, partial = {}, {}
+        for b in self._buckets_in(start, end):
+            cells = self.buckets[b]
+            seen = set()
+            for lo, hi in lons:
+                for cell in self._cells_in(cells, min_lat, lo, max_lat, hi):
+                    if cell in seen:
+                        continue
+                    seen.add(cell)
+                    covered = region.covers(*self.cell_bounds(*cell))
+                    for uid, (count, first, last) in cells[cell].items():
+                        if (start is not None and last < start) or (end is not None and first > end):
+                            continue
+                        if covered and (start is None or start <= first) and (end is None or last <= end):
+                            acc = exact.get(uid)
+                            if acc is None:
+                                exact[uid] = [count, first, last]
+                            else:
+                                acc[0] += count
+                                acc[1] = min(acc[1], first)
+                                acc[2] = max(acc[2], last)
+                        else:
+                            partial.setdefault(uid, []).append((b, *cell))
+        return exact, partial
+
+    def __len__(self):
+        return sum(len(cells) for cells in self.buckets.values())
+
+
+def near_keys(index_keys, other_keys, max_distance_km, max_gap_s,
+              bucket=PRESENCE_BUCKET, cell_deg=PRESENCE_CELL_DEG):
+    """Keys of two users that could hold points within `max_distance_km` and `max_gap_s`
+    of each other: pairs in neighbouring cells and buckets. Returns (mine, theirs)."""
+    mine, theirs = set(index_keys), set(other_keys)
+    swap = len(mine) > len(theirs)
+    if swap:
+        mine, theirs = theirs, mine
+    wrap = round(360 / cell_deg)
+    rb = math.ceil(max_gap_s / bucket)
+    ry = math.ceil(max_distance_km / (KM_PER_DEG_LAT * cell_deg))
+    hit_mine, hit_theirs = set(), set()
+    for b, ix, iy in mine:
+        # cells narrow towards the poles: widen the x reach for the row furthest from the equator
+        edge = min(89.9, max(abs(iy - ry), abs(iy + ry + 1)) * cell_deg)
+        rx = min(wrap // 2, math.ceil(max_distance_km / (KM_PER_DEG_LAT * math.cos(math.radians(edge)) * cell_deg)))
+        found = False
+        for db in range(-rb, rb + 1):
+            for dx in range(-rx, rx + 1):
+                x = (ix + dx + wrap // 2) % wrap - wrap // 2
+                for dy in range(-ry, ry + 1):
+                    k = (b + db, x, iy + dy)
+                    if k in theirs:
+                        hit_theirs.add(k)
+                        found = True
+        if found:
+            hit_mine.add((b, ix, iy))
+    return (hit_theirs, hit_mine) if swap else (hit_mine, hit_theirs)
+
+
+def match_points(points, others, max_distance_km, max_gap_s):
+    """Group the points (dicts sorted by timestamp) that have one of `others` within
+    `max_distance_km` and `max_gap_s` into episodes, split where consecutive matches
+    are more than `max_gap_s` apart."""
+    other_ts = [p['timestamp'] for p in others]
+    episodes = []
+    for p in points:
+        best = None
+        lo = bisect_left(other_ts, p['timestamp'] - max_gap_s)
+        hi = bisect_right(other_ts, p['timestamp'] + max_gap_s)
+        for q in others[lo:hi]:
+            d = haversine_km(p['lat'], p['lon'], q['lat'], q['lon'])
+            if d <= max_distance_km and (best is None or d < best[0]):
+                best = (d, q)
+        if best is None:
+            continue
+        ep = episodes[-1] if episodes else None
+        if ep is None or p['timestamp'] - ep['end'] > max_gap_s:
+            ep = {'start': p['timestamp'], 'end': p['timestamp'], 'matches': 0, 'min_distance_km': math.inf}
+            episodes.append(ep)
+        ep['end'] = p['timestamp']
+        ep['matches'] += 1
+        if best[0] < ep['min_distance_km']:
+            ep['min_distance_km'] = best[0]
+            ep['closest'] = [p, best[1]]
+    return episodes
+
+
+def co_location(store, userid, other, max_distance_km, max_gap_s, start_ts=None, end_ts=None):
+    """Episodes in which `userid` had a point within `max_distance_km` and `max_gap_s`
+    of one of `other`'s. Only the two users' points in neighbouring presence keys are
+    read. `store` is a UserStore or a ShardRouter (the users may live on different shards).
+    """
+    # a match can lie up to max_gap_s outside the window; keys outside that are never probed
+    lo = None if start_ts is None else start_ts - max_gap_s
+    hi = None if end_ts is None else end_ts + max_gap_s
+    mine, theirs = near_keys(store.presence_keys(userid, lo, hi), store.presence_keys(other, lo, hi),
+                             max_distance_km, max_gap_s)
+    if not mine:
+        return []
+    points = store.presence_points(userid, sorted(mine), start_ts, end_ts)
+    others = store.presence_points(other, sorted(theirs), lo, hi)
+    return match_points(points, others, max_distance_km, max_gap_s)
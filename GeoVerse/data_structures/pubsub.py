@@ -0,0 +1,65 @@
+import queue
+import threading
+
+
+class Subscription:
+    """One subscriber's bounded event buffer.
+    `closed` is set when the broker drops the subscriber for falling behind.
+    """
+    def __init__(self, key, maxsize):
+        self.key = key
+        self.events = queue.Queue(maxsize)
+        self.closed = False
+
+    def get(self, timeout=None):
+        """Return the next event, or None on timeout or once the subscription is closed."""
+        if self.closed and self.events.empty():
+            return None
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """Per-key publish/subscribe fan-out with bounded subscriber buffers.
+    Publishing never blocks: a subscriber whose buffer is full is dropped (and
+    sees `closed`), so one slow client cannot stall ingest.
+    """
+    def __init__(self, buffer_size=256):
+        self.buffer_size = buffer_size
+        self._subs = {}  # key -> set of Subscription
+        self._lock = threading.Lock()
+
+    def subscribe(self, key):
+        sub = Subscription(key, self.buffer_size)
+        with self._lock:
+            self._subs.setdefault(key, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.closed = True
+        with self._lock:
+            subs = self._subs.get(sub.key)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.key]
+
+    def publish(self, key, event):
+        with self._lock:
+            subs = list(self._subs.get(key, ()))
+        for sub in subs:
+            try:
+                sub.events.put_nowait(event)
+            except queue.Full:
+                self.unsubscribe(sub)
+
+    def has_subscribers(self, key):
+        return key in self._subs
+
+    def subscriber_count(self, key=None):
+        with self._lock:
+            if key is not None:
+                return len(self._subs.get(key, ()))
+            return sum(len(s) for s in self._subs.values())
@@ -1,22 +1,145 @@
+import os
+import struct
 from collections import deque
 
+# entries held in memory per queue; later ones are spilled to disk
+QUEUE_WINDOW = 1024
+# what enqueue() does at capacity: drop the oldest entry, or refuse the new one
+POLICIES = ('drop_oldest', 'reject')
+# (timestamp, lat, lon) of one spilled entry
+SPILL_RECORD = struct.Struct('<ddd')
+
+
+class QueueFull(Exception):
+    """Raised by enqueue() on a full queue whose policy is 'reject'."""
+
+
 class QueueDS:
-    def __init__(self):
-        self._dq = deque()
+    """FIFO of offline entries ({timestamp, lat, lon, source}).
+
+    At most `window` entries (the oldest ones) are kept in memory. Once a
+    `spill_path` is set, later entries are appended to that file as fixed-size
+    records and read back a window at a time as the head drains. Once the
+    consumed prefix of the file is larger than what is left in it, the live tail
+    is copied down and the file truncated, so a queue held at capacity keeps a
+    file of at most about twice its size. Enqueue is therefore amortized O(1)
+    and both memory and disk stay bounded however long a device is offline.
+    The spill file is only a cache: durability comes from the owner's log and
+    segments. With a `capacity`, a full queue either drops its oldest entry
+    (counted in `dropped`) or raises QueueFull, depending on `policy`; push()
+    bypasses the policy, for rebuilding a queue from its log.
+    """
+    def __init__(self, capacity=None, policy='drop_oldest', spill_path=None, window=QUEUE_WINDOW):
+        if policy not in POLICIES:
+            raise ValueError(f'queue policy must be one of {", ".join(POLICIES)}')
+        self.capacity = capacity
+        self.policy = policy
+        self.spill_path = spill_path
+        self.window = window
+        self._dq = deque()     # oldest entries; everything spilled is newer
+        self._spill = None     # open spill file, created on first overflow
+        self._spill_read = 0   # byte offset of the oldest spilled entry
+        self._spilled = 0      # entries in the spill file not read back yet
+        self.dropped = 0
 
     def enqueue(self, entry):
-        self._dq.append(entry)
+        """Append `entry`, applying the capacity policy; returns how many entries were dropped."""
+        dropped = 0
+        if self.capacity is not None and len(self) >= self.capacity:
+            if self.policy == 'reject':
+                raise QueueFull(f'offline queue is full ({self.capacity} entries)')
+            # a queue loaded under a larger capacity shrinks to this one here
+            dropped = self.discard(len(self) - self.capacity + 1)
+        self.push(entry)
+        return dropped
+
+    def push(self, entry):
+        """Append `entry` whatever the capacity."""
+        if self.spill_path is None or (not self._spilled and len(self._dq) < self.window):
+            self._dq.append(entry)
+            return
+        if self._spill is None:
+            os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+            self._spill = open(self.spill_path, 'w+b')
+        self._spill.seek(0, os.SEEK_END)
+        self._spill.write(SPILL_RECORD.pack(float(entry['timestamp']), float(entry['lat']), float(entry['lon'])))
+        self._spilled += 1
+
+    def _read_spilled(self, offset, count):
+        self._spill.seek(offset)
+        return [{'timestamp': ts, 'lat': lat, 'lon': lon, 'source': 'offline'}
+                for ts, lat, lon in SPILL_RECORD.iter_unpack(self._spill.read(count * SPILL_RECORD.size))]
+
+    def _refill(self):
+        n = min(self.window, self._spilled)
+        self._dq.extend(self._read_spilled(self._spill_read, n))
+        self._spill_read += n * SPILL_RECORD.size
+        self._spilled -= n
+        if self._spill_read >= max(self._spilled, self.window) * SPILL_RECORD.size or not self._spilled:
+            self._compact_spill()
+
+    def _compact_spill(self):
+        # move the unread records to the start of the file, a window at a time
+        read, end, write = self._spill_read, self._spill_read + self._spilled * SPILL_RECORD.size, 0
+        while read < end:
+            self._spill.seek(read)
+            data = self._spill.read(min(self.window * SPILL_RECORD.size, end - read))
+            self._spill.seek(write)
+            self._spill.write(data)
+            read += len(data)
+            write += len(data)
+        self._spill.truncate(write)
+        self._spill_read = 0
 
     def dequeue(self):
+        if not self._dq and self._spilled:
+            self._refill()
         return self._dq.popleft()
 
+    def discard(self, count):
+        """Drop up to `count` of the oldest entries, counting them in `dropped`."""
+        n = len(self.take(count))
+        self.dropped += n
+        return n
+
     def is_empty(self):
-        return len(self._dq) == 0
+        return len(self) == 0
+
+    def take(self, count):
+        """Remove and return up to `count` of the oldest entries."""
+        out = []
+        while len(out) < count and len(self):
+            if not self._dq:
+                self._refill()
+            out.extend(self._dq.popleft() for _ in range(min(count - len(out), len(self._dq))))
+        return out
+
+    def drain(self, chunk=QUEUE_WINDOW):
+        """Remove and yield the entries as lists of at most `chunk`, oldest first."""
+        while len(self):
+            yield self.take(chunk)
 
     def get_all_and_clear(self):
-        items = list(self._dq)
-        self._dq.clear()
-        return items
+        return [e for batch in self.drain() for e in batch]
+
+    def __iter__(self):
+        # non-consuming walk: the window, then the spill file a window at a time
+        yield from list(self._dq)
+        offset, left = self._spill_read, self._spilled
+        while left:
+            n = min(self.window, left)
+            yield from self._read_spilled(offset, n)
+            offset += n * SPILL_RECORD.size
+            left -= n
 
     def __len__(self):
-        return len(self._dq)
+        return len(self._dq) + self._spilled
+
+    def close(self):
+        """Drop the spill file (the queue's contents are persisted elsewhere)."""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+            os.remove(self.spill_path)
+        self._dq.clear()
+        self._spilled = self._spill_read = 0
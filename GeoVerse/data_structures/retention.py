@@ -0,0 +1,77 @@
+import math
+import re
+from bisect import bisect_right
+
+# suggested tiers (GEOVERSE_RETENTION='7d:1m,90d:1h'): full resolution for 7 days, one point
+# per minute up to 90 days, one per hour after that; nothing is downsampled unless tiers are set
+DEFAULT_RETENTION = ((7 * 86400, 60), (90 * 86400, 3600))
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def _seconds(text):
+    m = re.fullmatch(r'(\d+(?:\.\d+)?)([smhdw]?)', text.strip())
+    if not m:
+        raise ValueError(f'bad duration {text!r}')
+    return float(m.group(1)) * UNITS[m.group(2) or 's']
+
+
+def parse_retention(spec):
+    """Parse 'AGE:RESOLUTION,...' (e.g. '7d:1m,90d:1h') into ((age_s, resolution_s), ...).
+    'none' or an empty spec keeps everything (returns ()). Tiers must get older and
+    coarser in order, so a later pass never keeps a point an earlier one dropped.
+    """
+    if not spec or spec.strip().lower() == 'none':
+        return ()
+    tiers = []
+    for part in spec.split(','):
+        age, sep, res = part.partition(':')
+        if not sep:
+            raise ValueError(f'bad retention tier {part!r}, expected AGE:RESOLUTION')
+        tiers.append((_seconds(age), _seconds(res)))
+    validate(tiers)
+    return tuple(tiers)
+
+
+def validate(tiers):
+    for (age, res), (next_age, next_res) in zip(tiers, tiers[1:]):
+        if next_age <= age or next_res <= res or next_res % res:
+            raise ValueError('retention tiers must have increasing ages and coarser resolutions, '
+                             'each a multiple of the previous')
+    if any(res <= 0 for _, res in tiers):
+        raise ValueError('retention resolution must be positive')
+
+
+def plan(timestamps, now, tiers):
+    """Decide which points survive downsampling at time `now`.
+
+    Points at least `age` seconds old keep one point (the earliest) per
+    `resolution`-second bucket of the oldest tier they fall in; buckets are aligned
+    to the epoch, so repeated passes are stable. `timestamps` is sorted; returns
+    (keep, stop): the indices kept among the first `stop` points, which are all the
+    points old enough to be affected.
+    """
+    if not tiers:
+        return [], 0
+    # tier boundaries as timestamps, oldest tier first
+    bounds = [(now - age, res) for age, res in reversed(tiers)]
+    stop = bisect_right(timestamps, bounds[-1][0])
+    keep, last, t = [], None, 0
+    for i in range(stop):
+        ts = timestamps[i]
+        while ts > bounds[t][0]:
+            t += 1
+        res = bounds[t][1]
+        key = (res, math.floor(ts / res))
+        if key != last:
+            keep.append(i)
+            last = key
+    return keep, stop
+
+
+def downsample(timeline, now, tiers):
+    """Apply plan() to a ColumnarTimeline in place; returns the number of points removed."""
+    keep, stop = plan(timeline.ts, now, tiers)
+    if len(keep) == stop:
+        return 0
+    timeline.retain(keep, stop)
+    return stop - len(keep)
@@ -0,0 +1,107 @@
+import math
+from bisect import bisect_left, bisect_right
+from .spatial import haversine_km
+
+# bucket widths in seconds; buckets are aligned to the epoch (UTC)
+GRANULARITIES = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class Bucket:
+    __slots__ = ('count', 'distance_km', 'min_lat', 'min_lon', 'max_lat', 'max_lon')
+
+    def __init__(self):
+        self.count = 0
+        self.distance_km = 0.0
+        self.min_lat = self.min_lon = math.inf
+        self.max_lat = self.max_lon = -math.inf
+
+    def to_dict(self, start, width, first, last):
+        return {
+            'start': start, 'end': start + width, 'count': self.count,
+            'first': first, 'last': last,
+            'distance_km': max(0.0, self.distance_km),
+            'bbox': [self.min_lat, self.min_lon, self.max_lat, self.max_lon],
+        }
+
+
+class RollupLevel:
+    """Buckets of one width: dict for O(1) updates plus sorted keys for range reads."""
+    def __init__(self, width):
+        self.width = width
+        self.buckets = {}  # bucket start -> Bucket
+        self.keys = []     # sorted bucket starts
+
+    def key(self, ts):
+        return math.floor(ts / self.width) * self.width
+
+    def bucket(self, ts):
+        k = self.key(ts)
+        b = self.buckets.get(k)
+        if b is None:
+            b = self.buckets[k] = Bucket()
+            if not self.keys or k > self.keys[-1]:
+                self.keys.append(k)
+            else:
+                self.keys.insert(bisect_left(self.keys, k), k)
+        return b
+
+    def query(self, timeline, start, end):
+        """Buckets overlapping [start, end], oldest first; O((log B + buckets returned) log n).
+        A bucket's first and last points are the timeline rows at its edges."""
+        i = bisect_left(self.keys, self.key(start)) if start is not None else 0
+        j = bisect_right(self.keys, end) if end is not None else len(self.keys)
+        out = []
+        for k in self.keys[i:j]:
+            first, stop = timeline.rank(k), timeline.rank(k + self.width)
+            out.append(self.buckets[k].to_dict(k, self.width, timeline.point(first), timeline.point(stop - 1)))
+        return out
+
+
+class RollupIndex:
+    """Per-user count / first & last point / distance travelled / bounding box for
+    minute, hour and day buckets of a ColumnarTimeline, kept up to date as rows land.
+
+    The leg between two consecutive points is credited to the bucket of the later
+    one. Rows are added once they are in the timeline, so their neighbours show where
+    they landed: a late point splits the leg it fell into (that leg is removed from
+    its bucket and the two new legs added). A batch costs O(m) regardless of how far
+    back it lands.
+    """
+    def __init__(self, timeline, granularities=GRANULARITIES):
+        self.timeline = timeline
+        self.levels = {name: RollupLevel(width) for name, width in granularities.items()}
+
+    @classmethod
+    def build(cls, timeline):
+        index = cls(timeline)
+        index.add_rows(range(len(timeline)))
+        return index
+
+    def add_rows(self, rows):
+        """Account for the timeline rows `rows` (sorted, already in the timeline)."""
+        tl = self.timeline
+        ts, lat, lon, n = tl.ts, tl.lat, tl.lon, len(tl)
+        run = 0  # first row of the run of new rows the current one belongs to
+        for idx, r in enumerate(rows):
+            if idx == 0 or rows[idx - 1] != r - 1:
+                run = r
+            legs = []
+            if r > 0:
+                legs.append((ts[r], haversine_km(lat[r - 1], lon[r - 1], lat[r], lon[r])))
+            q = r + 1
+            if q < n and (idx + 1 == len(rows) or rows[idx + 1] != q):
+                legs.append((ts[q], haversine_km(lat[r], lon[r], lat[q], lon[q])))
+                # the leg q used to have started at the row before this run
+                if run > 0:
+                    legs.append((ts[q], -haversine_km(lat[run - 1], lon[run - 1], lat[q], lon[q])))
+            t, la, lo = ts[r], lat[r], lon[r]
+            for level in self.levels.values():
+                b = level.bucket(t)
+                b.count += 1
+                b.min_lat, b.max_lat = min(b.min_lat, la), max(b.max_lat, la)
+                b.min_lon, b.max_lon = min(b.min_lon, lo), max(b.max_lon, lo)
+                for end, d in legs:
+                    level.bucket(end).distance_km += d
+
+    def query(self, granularity, start=None, end=None):
+        return self.levels[granularity].query(self.timeline, start, end)
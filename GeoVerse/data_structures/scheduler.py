@@ -0,0 +1,161 @@
+import heapq
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# recent dispatch lags kept for the percentile metrics
+LAG_WINDOW = 1024
+
+
+class Scheduler:
+    """Runs `job(keys)` for keys that come due, each on its own interval.
+
+    Keys sit in a min-heap ordered by next-due time, so finding due work is
+    O(log n) per key regardless of how many keys are idle. Due keys are popped
+    in batches of up to `batch_size` and handed to a worker pool; at most
+    `2 * workers` batches are in flight, so a slow job makes lag grow (and
+    show up in metrics()) instead of queueing unbounded work. The next due
+    time is computed from the previous one, not from when the job finished,
+    so every key keeps its rate however many keys there are; ticks that are
+    already a full interval late are skipped rather than replayed in a burst.
+    """
+    def __init__(self, job, workers=4, batch_size=64, clock=time.monotonic):
+        self.job = job
+        self.batch_size = batch_size
+        self.clock = clock
+        self._heap = []     # (due, seq, key); entries of removed/rescheduled keys are skipped lazily
+        self._entries = {}  # key -> [interval, jitter, seq]
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._slots = threading.Semaphore(2 * workers)
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='scheduler')
+        self._thread = None
+        self._stopped = False
+        self._lags = deque(maxlen=LAG_WINDOW)
+        self.dispatched = 0
+        self.batches = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def add(self, key, interval, jitter=0.0, first_due=None):
+        """Schedule `key` every `interval` +/- `jitter` seconds; the first run defaults to a
+        random point within one interval, so keys added together do not fire together."""
+        with self._cond:
+            if first_due is None:
+                first_due = self.clock() + random.uniform(0, interval)
+            self._seq += 1
+            self._entries[key] = [interval, jitter, self._seq]
+            heapq.heappush(self._heap, (first_due, self._seq, key))
+            self._cond.notify()
+
+    def remove(self, key):
+        with self._cond:
+            self._entries.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self._pool.shutdown(wait=True)
+
+    def tick(self):
+        """Run every key due at clock() on the calling thread, a batch at a time, and return
+        how many runs there were. Drives the scheduler by hand (e.g. with an injected clock
+        in tests) instead of start()."""
+        ran = 0
+        while True:
+            with self._cond:
+                batch = self._pop_due(self.clock())
+            if not batch:
+                return ran
+            self._slots.acquire()
+            self._run_batch(batch)
+            ran += len(batch)
+
+    def _pop_due(self, now):
+        # caller holds self._cond
+        batch = []
+        while self._heap and len(batch) < self.batch_size:
+            due, seq, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is None or entry[2] != seq:
+                heapq.heappop(self._heap)  # removed or superseded
+                continue
+            if due > now:
+                break
+            heapq.heappop(self._heap)
+            interval, jitter, _ = entry
+            nxt = due + interval + (random.uniform(-jitter, jitter) if jitter else 0.0)
+            if nxt <= now - interval:
+                self.skipped += int((now - nxt) // interval)
+                nxt = now + (random.uniform(0, jitter) if jitter else 0.0)
+            self._seq += 1
+            entry[2] = self._seq
+            heapq.heappush(self._heap, (nxt, self._seq, key))
+            batch.append((key, due))
+        return batch
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            with self._cond:
+                while not self._stopped:
+                    now = self.clock()
+                    batch = self._pop_due(now)
+                    if batch:
+                        break
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    self._slots.release()
+                    return
+            self._pool.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        try:
+            started = self.clock()
+            with self._cond:
+                self._lags.extend(started - due for _, due in batch)
+                self.dispatched += len(batch)
+                self.batches += 1
+            self.job([key for key, _ in batch])
+        except Exception:
+            with self._cond:
+                self.errors += 1
+        finally:
+            self._slots.release()
+
+    def metrics(self):
+        """Scheduling lag (seconds between a key's due time and its job starting) and counters."""
+        with self._cond:
+            lags = sorted(self._lags)
+            now = self.clock()
+            overdue = 0.0
+            if self._heap:
+                # heap top may be a stale entry; good enough as an upper bound on queued lag
+                overdue = max(0.0, now - self._heap[0][0])
+            return {
+                'keys': len(self._entries),
+                'dispatched': self.dispatched,
+                'batches': self.batches,
+                'skipped_ticks': self.skipped,
+                'errors': self.errors,
+                'lag_avg': sum(lags) / len(lags) if lags else 0.0,
+                'lag_p95': lags[int(0.95 * (len(lags) - 1))] if lags else 0.0,
+                'lag_max': lags[-1] if lags else 0.0,
+                'overdue': overdue,
+            }
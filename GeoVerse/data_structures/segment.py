@@ -0,0 +1,130 @@
+"""Fixed-width binary timeline segments, read through mmap.
+
+Layout (little-endian):
+    header  magic b'GVSG', format version u32, log_seq u64, points u64, queued u64
+    points  `points` records of (timestamp f64, lat f64, lon f64, source u8), sorted by timestamp
+    queue   `queued` records of the same shape holding the offline queue, in arrival order
+
+A point costs 25 bytes on disk, and a time range is found by binary search over
+the mapped records, so reading a window never parses the rest of the file.
+"""
+import os
+import sys
+import mmap
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from .columnar import SOURCES, SOURCE_CODES
+
+MAGIC = b'GVSG'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sIQQQ')
+RECORD = struct.Struct('<dddB')
+SEGMENT_EXT = '.seg'
+
+
+def write_segment(path, log_seq, timeline, queue):
+    """Atomically write a ColumnarTimeline and queue entries (dicts) to `path`."""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, log_seq, len(timeline), len(queue)))
+        with timeline.slice() as view:
+            f.write(b''.join(map(RECORD.pack, view.timestamps, view.lats, view.lons, view.sources)))
+        offline = SOURCE_CODES['offline']
+        f.write(b''.join(RECORD.pack(float(e['timestamp']), float(e['lat']), float(e['lon']), offline)
+                         for e in queue))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class _Timestamps:
+    # sequence view of the mapped timestamp column, so bisect can search it in place
+    __slots__ = ('seg',)
+
+    def __init__(self, seg):
+        self.seg = seg
+
+    def __len__(self):
+        return self.seg.points
+
+    def __getitem__(self, i):
+        return self.seg.timestamp_at(i)
+
+
+class MappedSegment:
+    """Read-only, memory-mapped view of a segment file. Use as a context manager."""
+    def __init__(self, path):
+        self._f = open(path, 'rb')
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.log_seq, self.points, self.queued = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f'{path}: not a version {FORMAT_VERSION} timeline segment')
+
+    def _offset(self, i):
+        return HEADER.size + i * RECORD.size
+
+    def timestamp_at(self, i):
+        return struct.unpack_from('<d', self._mm, self._offset(i))[0]
+
+    def range_indices(self, start, end):
+        """Return (i, j) such that records [i, j) have start <= timestamp <= end."""
+        ts = _Timestamps(self)
+        return bisect_left(ts, float(start)), bisect_right(ts, float(end))
+
+    def records(self, i=0, j=None):
+        """Yield (timestamp, lat, lon, source code) for points [i, j)."""
+        j = self.points if j is None else j
+        return RECORD.iter_unpack(self._mm[self._offset(i):self._offset(j)])
+
+    def search_range(self, start, end):
+        i, j = self.range_indices(start, end)
+        return [{'timestamp': ts, 'lat': lat, 'lon': lon, 'source': SOURCES[src]}
+                for ts, lat, lon, src in self.records(i, j)]
+
+    def to_list(self):
+        return [{'timestamp': ts, 'lat': lat, 'lon': lon, 'source': SOURCES[src]}
+                for ts, lat, lon, src in self.records()]
+
+    def columns(self, i=0, j=None):
+        """Decode points [i, j) into (timestamps, lats, lons, sources) typed arrays.
+        Each column is gathered from the interleaved records with strided byte copies
+        and loaded with array.frombytes, so no per-point Python objects are created."""
+        j = self.points if j is None else j
+        raw = memoryview(self._mm)[self._offset(i):self._offset(j)]
+        try:
+            out = []
+            for field in range(3):
+                buf = bytearray(8 * (j - i))
+                for b in range(8):
+                    buf[b::8] = raw[field * 8 + b::RECORD.size]
+                col = array('d')
+                col.frombytes(buf)
+                if sys.byteorder != 'little':
+                    col.byteswap()
+                out.append(col)
+            out.append(array('B', raw[24::RECORD.size]))
+            return tuple(out)
+        finally:
+            raw.release()
+
+    def iter_queue(self):
+        """Yield the queued entries as dicts without decoding them all up front."""
+        start = self._offset(self.points)
+        for i in range(self.queued):
+            ts, lat, lon, _ = RECORD.unpack_from(self._mm, start + i * RECORD.size)
+            yield {'timestamp': ts, 'lat': lat, 'lon': lon, 'source': 'offline'}
+
+    def queue(self):
+        return list(self.iter_queue())
+
+    def close(self):
+        self._mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,182 @@
+import hmac
+import time
+import heapq
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+SESSION_TTL = 12 * 3600
+# verified tokens / recent logins kept in memory
+CACHE_SIZE = 10000
+
+
+class LoginBusy(Exception):
+    """Raised when the password-check pool already has its maximum of logins waiting."""
+
+
+class TTLCache:
+    """Bounded LRU map whose entries also expire `ttl` seconds after they were set."""
+    def __init__(self, maxsize, ttl, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._items = OrderedDict()  # key -> (expires, value), least recently used first
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] <= self.clock():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, expires=None):
+        with self._lock:
+            self._items[key] = (self.clock() + self.ttl if expires is None else expires, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            return item[1] if item else None
+
+    def discard_values(self, value):
+        with self._lock:
+            for key in [k for k, (_, v) in self._items.items() if v == value]:
+                del self._items[key]
+
+    def __len__(self):
+        return len(self._items)
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+class SessionManager:
+    """Signed session tokens and a bounded, cached password-check path.
+
+    A token is `<userid>.<expiry>.<HMAC-SHA256 of both>`, so checking one needs no
+    store lookup, and tokens seen recently are answered from a TTL/LRU cache.
+    Password checks (scrypt, tens of ms of CPU each) run on `workers` threads
+    with at most `max_pending` logins queued; beyond that login() raises
+    LoginBusy instead of tying up request threads. A successful login is
+    remembered for `login_ttl` seconds under a keyed digest of the credentials
+    (never the password itself), so a repeat login skips scrypt.
+    """
+    def __init__(self, secret, ttl=SESSION_TTL, cache_size=CACHE_SIZE, workers=2, max_pending=32,
+                 login_ttl=300, clock=time.time):
+        self.secret = secret if isinstance(secret, bytes) else secret.encode('utf-8')
+        self.ttl = ttl
+        self.clock = clock
+        self._verified = TTLCache(cache_size, ttl, clock)
+        self._logins = TTLCache(cache_size, login_ttl, clock)
+        # revoked token -> expiry; never evicted early, only pruned once the token has expired
+        self._revoked = {}
+        self._revoked_expiry = []  # heap of (expires, token)
+        self._revoked_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='password-check')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self.rejected = 0
+
+    def _sign(self, payload):
+        return _b64(hmac.new(self.secret, payload.encode('utf-8'), hashlib.sha256).digest())
+
+    def issue(self, userid):
+        """Return a new token for `userid`, valid for `ttl` seconds."""
+        expires = int(self.clock() + self.ttl)
+        payload = f'{userid}.{expires}'
+        token = f'{payload}.{self._sign(payload)}'
+        self._verified.set(token, userid, expires)
+        return token
+
+    def verify(self, token):
+        """Return the token's userid, or None if it is malformed, forged, expired or revoked."""
+        if not token:
+            return None
+        userid = self._verified.get(token)
+        if userid is not None:
+            return userid
+        checked = self._check(token)
+        if checked is None:
+            return None
+        userid, expires = checked
+        # checked and cached under the revocation lock, so a concurrent revoke() cannot
+        # drop the token from the cache before it is put there
+        with self._revoked_lock:
+            if token in self._revoked:
+                return None
+            self._verified.set(token, userid, expires)
+        return userid
+
+    def _check(self, token):
+        # (userid, expires) of a well-formed, correctly signed, unexpired token, else None
+        payload, _, sig = token.rpartition('.')
+        userid, _, expires = payload.rpartition('.')
+        try:
+            expires = int(expires)
+        except ValueError:
+            return None
+        if not userid or expires <= self.clock() or not hmac.compare_digest(sig, self._sign(payload)):
+            return None
+        return userid, expires
+
+    def revoke(self, token):
+        checked = self._check(token) if token else None
+        if checked is None:
+            return
+        with self._revoked_lock:
+            now = self.clock()
+            while self._revoked_expiry and self._revoked_expiry[0][0] <= now:
+                self._revoked.pop(heapq.heappop(self._revoked_expiry)[1], None)
+            if token not in self._revoked:
+                self._revoked[token] = checked[1]
+                heapq.heappush(self._revoked_expiry, (checked[1], token))
+            self._verified.pop(token)
+
+    def login(self, authenticate, login, password, timeout=None):
+        """Return `authenticate(login, password)` (a userid or None), running it on the
+        password-check pool unless the same credentials succeeded recently."""
+        key = hmac.new(self.secret, f'{login}\0{password}'.encode('utf-8'), hashlib.sha256).digest()
+        userid = self._logins.get(key)
+        if userid is not None:
+            return userid
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise LoginBusy('too many logins in progress')
+        try:
+            userid = self._pool.submit(authenticate, login, password).result(timeout)
+        finally:
+            self._slots.release()
+        if userid is not None:
+            self._logins.set(key, userid)
+        return userid
+
+    def forget_user(self, userid):
+        """Drop cached logins for `userid` (call when its password changes)."""
+        self._logins.discard_values(userid)
+
+    def stats(self):
+        return {
+            'verified_cached': len(self._verified),
+            'verify_hits': self._verified.hits,
+            'verify_misses': self._verified.misses,
+            'login_hits': self._logins.hits,
+            'login_misses': self._logins.misses,
+            'logins_rejected': self.rejected,
+            'revoked': len(self._revoked),
+        }
+
+    def close(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,283 @@
+import os
+import sys
+import uuid
+import atexit
+import hashlib
+import itertools
+import subprocess
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+from .pubsub import EventBroker
+from .user_store import UserStore
+from .presence import co_location
+
+AUTHKEY_ENV = 'GEOVERSE_SHARD_AUTHKEY'
+# UserStore methods whose first argument is the userid that picks the shard
+USER_METHODS = frozenset({
+    'insert_location', 'insert_many', 'sync_queue', 'timeline', 'page', 'version',
+    'queue_version', 'queue_state', 'changes_since', 'latest', 'search_range',
+    'search_nearest', 'search_k_nearest', 'search_nearest_many', 'count_range',
+    'range_summary', 'kth_in_range', 'rank', 'simplified', 'search_bbox', 'search_radius', 'rollup',
+    'compact_history', 'presence_keys', 'presence_points', 'set_password_for_user', 'evict',
+})
+
+
+def shard_for(userid, shards):
+    """Stable shard index for a userid (the builtin hash() is salted per process)."""
+    digest = hashlib.blake2b(userid.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
+
+
+class _ForwardingBroker(EventBroker):
+    """Shard-side broker: events for users the router has subscribers for go up the pipe."""
+    def __init__(self, send):
+        super().__init__()
+        self._send = send
+        self._forwarded = set()
+
+    def forward(self, key):
+        self._forwarded.add(key)
+
+    def unforward(self, key):
+        self._forwarded.discard(key)
+
+    def has_subscribers(self, key):
+        return key in self._forwarded
+
+    def publish(self, key, event):
+        if key in self._forwarded:
+            self._send((None, key, event))
+
+
+def shard_main(address, index, storage_file, store_kwargs):
+    """Worker process loop: serve requests for one shard's UserStore in arrival order."""
+    conn = Client(address, authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+    send_lock = threading.Lock()
+
+    def send(msg):
+        with send_lock:
+            conn.send(msg)
+
+    os.makedirs(os.path.dirname(storage_file), exist_ok=True)
+    store = UserStore(storage_file=storage_file, **store_kwargs)
+    store.events = _ForwardingBroker(send)
+    send(index)
+    while True:
+        try:
+            req_id, method, args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            break
+        if method == 'close':
+            store.close()
+            send((req_id, True, None))
+            break
+        try:
+            if method in ('forward', 'unforward'):
+                result = getattr(store.events, method)(*args)
+            else:
+                result = getattr(store, method)(*args, **kwargs)
+            send((req_id, True, result))
+        except Exception as e:
+            send((req_id, False, e))
+    store.close()
+
+
+class _ShardClient:
+    """Router-side end of one shard's connection.
+    Requests are pipelined: submit() sends and returns a Future immediately, and a
+    reader thread resolves futures by request id as responses arrive.
+    """
+    def __init__(self, conn, proc, on_event):
+        self.conn = conn
+        self.proc = proc
+        self._on_event = on_event
+        self._ids = itertools.count(1)
+        self._futures = {}
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def submit(self, method, *args, **kwargs):
+        fut = Future()
+        with self._send_lock:
+            req_id = next(self._ids)
+            self._futures[req_id] = fut
+            try:
+                self.conn.send((req_id, method, args, kwargs))
+            except (OSError, ValueError) as e:
+                self._futures.pop(req_id, None)
+                fut.set_exception(ConnectionError(f'shard unavailable: {e}'))
+        return fut
+
+    def _read_loop(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            req_id, ok, payload = msg
+            if req_id is None:
+                self._on_event(ok, payload)  # (None, userid, event)
+                continue
+            fut = self._futures.pop(req_id, None)
+            if fut is None:
+                continue
+            if ok:
+                fut.set_result(payload)
+            else:
+                fut.set_exception(payload)
+        for fut in list(self._futures.values()):
+            fut.set_exception(ConnectionError('shard process exited'))
+        self._futures.clear()
+
+
+class _RoutedBroker(EventBroker):
+    """Router-side broker; tells a shard to forward a user's events while anyone listens."""
+    def __init__(self, router):
+        super().__init__()
+        self._router = router
+        self._fwd_lock = threading.Lock()
+
+    def subscribe(self, key):
+        with self._fwd_lock:
+            first = not self.has_subscribers(key)
+            sub = super().subscribe(key)
+            if first:
+                self._router._shard(key).submit('forward', key)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._fwd_lock:
+            super().unsubscribe(sub)
+            if not self.has_subscribers(sub.key):
+                self._router._shard(sub.key).submit('unforward', sub.key)
+
+
+class ShardRouter:
+    """Spreads users over `shards` worker processes, each owning a UserStore (its own
+    timelines, queues, log and segments under `storage_dir/shard-<i>/`).
+
+    Per-user calls (see USER_METHODS) go to shard_for(userid) and can be pipelined
+    with submit(); account lookups by phone are broadcast. The router exposes the
+    same methods the app uses on a UserStore, so it can stand in for one.
+    """
+    def __init__(self, shards, storage_dir, **store_kwargs):
+        self.storage_dir = storage_dir
+        authkey = os.urandom(32)
+        listener = Listener(authkey=authkey)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+        env[AUTHKEY_ENV] = authkey.hex()
+        procs = []
+        for i in range(shards):
+            storage_file = os.path.join(storage_dir, f'shard-{i}', 'storage.json')
+            code = (f'from {__name__} import shard_main; '
+                    f'shard_main({listener.address!r}, {i}, {storage_file!r}, {store_kwargs!r})')
+            procs.append(subprocess.Popen([sys.executable, '-c', code], env=env))
+        conns = {}
+        for _ in range(shards):
+            conn = listener.accept()
+            conns[conn.recv()] = conn
+        listener.close()
+        self.events = _RoutedBroker(self)
+        self._shards = [_ShardClient(conns[i], procs[i], self.events.publish) for i in range(shards)]
+        self._accounts = threading.Lock()
+        self._known = set()
+        for ids in self._broadcast('userids'):
+            self._known.update(ids)
+        self._closed = False
+        atexit.register(self.close)
+
+    def _shard(self, userid):
+        return self._shards[shard_for(userid, len(self._shards))]
+
+    def submit(self, userid, method, *args, **kwargs):
+        """Send `method(userid, *args)` to the user's shard without waiting; returns a Future."""
+        return self._shard(userid).submit(method, userid, *args, **kwargs)
+
+    def _broadcast(self, method, *args):
+        futures = [shard.submit(method, *args) for shard in self._shards]
+        return [f.result() for f in futures]
+
+    def __getattr__(self, name):
+        if name in USER_METHODS:
+            def call(userid, *args, **kwargs):
+                return self.submit(userid, name, *args, **kwargs).result()
+            call.__name__ = name
+            return call
+        raise AttributeError(name)
+
+    def userids(self):
+        return [uid for ids in self._broadcast('userids') for uid in ids]
+
+    def userid_exists(self, userid):
+        # users are never deleted, so a positive answer can be cached
+        if userid in self._known:
+            return True
+        if self._shard(userid).submit('userid_exists', userid).result():
+            self._known.add(userid)
+            return True
+        return False
+
+    def phone_to_userid(self, phone):
+        return next((uid for uid in self._broadcast('phone_to_userid', phone) if uid), None)
+
+    def _new_account(self, method, phone, *args):
+        with self._accounts:
+            if self.phone_to_userid(phone) is not None:
+                raise ValueError('Phone already registered')
+            userid = str(uuid.uuid4())
+            self._shard(userid).submit(method, phone, *args, userid=userid).result()
+            self._known.add(userid)
+            return userid
+
+    def reserve_user(self, phone):
+        return self._new_account('reserve_user', phone)
+
+    def create_user(self, phone, password):
+        return self._new_account('create_user', phone, password)
+
+    def authenticate(self, login, password):
+        userid = login if self.userid_exists(login) else self.phone_to_userid(login)
+        if userid is None:
+            return None
+        return self._shard(userid).submit('authenticate', login, password).result()
+
+    def publish(self, userid, event_type, **fields):
+        # status events do not touch stored data; fan them out locally
+        fields['type'] = event_type
+        self.events.publish(userid, fields)
+
+    def cache_stats(self):
+        per_shard = self._broadcast('cache_stats')
+        total = {k: sum(s[k] or 0 for s in per_shard) for k in per_shard[0]}
+        total['shards'] = per_shard
+        return total
+
+    def apply_retention(self, now=None):
+        return sum(self._broadcast('apply_retention', now))
+
+    def nearby_users(self, region, start_ts=None, end_ts=None):
+        # every user lives on one shard, so the per-shard answers only need merging
+        out = [u for users in self._broadcast('nearby_users', region, start_ts, end_ts) for u in users]
+        out.sort(key=lambda u: (-u['count'], u['userid']))
+        return out
+
+    def co_location(self, userid, other, max_distance_km, max_gap_s, start_ts=None, end_ts=None):
+        return co_location(self, userid, other, max_distance_km, max_gap_s, start_ts, end_ts)
+
+    def flush(self):
+        self._broadcast('flush')
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        futures = [shard.submit('close') for shard in self._shards]
+        for shard, fut in zip(self._shards, futures):
+            try:
+                fut.result(timeout=30)
+            except Exception:
+                pass
+            shard.proc.wait(timeout=30)
+            shard.conn.close()
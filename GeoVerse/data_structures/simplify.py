@@ -0,0 +1,119 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+MAX_ZOOM = 22
+# kept points re-simplified behind the first change, so appended tails don't pile up anchors
+RESIMPLIFY_BACKTRACK = 2
+# most points one simplified response may hold, whatever the zoom and range
+MAX_POINTS = 5000
+
+
+def tolerance_for_zoom(zoom, pixels=1.0):
+    """Degrees covered by `pixels` screen pixels at a web-map zoom level (256px tiles)."""
+    return 360.0 / (256 * 2 ** zoom) * pixels
+
+
+def thin(points, max_points):
+    """At most `max_points` of `points`, evenly spaced by index, keeping both endpoints."""
+    n = len(points)
+    if n <= max_points:
+        return list(points)
+    if max_points < 2:
+        return list(points[-max_points:]) if max_points > 0 else []
+    step = (n - 1) / (max_points - 1)
+    return [points[round(i * step)] for i in range(max_points)]
+
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    # planar distance from p to segment ab in (lon, lat) degrees
+    dx, dy = bx - ax, by - ay
+    if dx == 0 and dy == 0:
+        return ((px - ax) ** 2 + (py - ay) ** 2) ** 0.5
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)))
+    cx, cy = ax + t * dx, ay + t * dy
+    return ((px - cx) ** 2 + (py - cy) ** 2) ** 0.5
+
+
+def douglas_peucker(lats, lons, tolerance):
+    """Return the indices of the points (parallel lat/lon sequences) kept by Douglas-Peucker,
+    in order. Iterative, so long tracks cannot exhaust the recursion limit. Endpoints are
+    always kept.
+    """
+    n = len(lats)
+    if n <= 2:
+        return list(range(n))
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        lo, hi = stack.pop()
+        ax, ay, bx, by = lons[lo], lats[lo], lons[hi], lats[hi]
+        best, best_i = -1.0, -1
+        for i in range(lo + 1, hi):
+            d = _segment_distance(lons[i], lats[i], ax, ay, bx, by)
+            if d > best:
+                best, best_i = d, i
+        if best > tolerance:
+            keep[best_i] = True
+            stack.append((lo, best_i))
+            stack.append((best_i, hi))
+    return [i for i, k in enumerate(keep) if k]
+
+
+class SimplificationCache:
+    """Simplified copies of a ColumnarTimeline, one per zoom level, as the kept row indices.
+    A change at row r only drops the kept rows from r on (plus a couple before it): rows
+    before r neither moved nor changed. The next read re-simplifies from the surviving
+    anchor to the end of the timeline, so an append costs work proportional to the new tail.
+    """
+    def __init__(self, timeline, pixel_tolerance=1.0):
+        self.timeline = timeline
+        self.pixel_tolerance = pixel_tolerance
+        self.levels = {}  # zoom -> array of kept rows, ascending
+        self.dirty = set()
+
+    def invalidate_from(self, row):
+        """Forget kept rows from `row` on, the first row inserted (or moved) by a change."""
+        for zoom, kept in self.levels.items():
+            del kept[max(0, bisect_left(kept, row) - RESIMPLIFY_BACKTRACK):]
+            self.dirty.add(zoom)
+
+    def clear(self):
+        self.levels.clear()
+        self.dirty.clear()
+
+    def get(self, zoom):
+        """Return the kept rows for `zoom`, (re)computing only the stale tail."""
+        zoom = max(0, min(MAX_ZOOM, int(zoom)))
+        kept = self.levels.get(zoom)
+        if kept is not None and zoom not in self.dirty:
+            return kept
+        if kept is None:
+            kept = array('q')
+        anchor = kept.pop() if kept else 0
+        tl = self.timeline
+        n = len(tl)
+        if anchor < n:
+            tail = douglas_peucker(tl.lat[anchor:n], tl.lon[anchor:n], tolerance_for_zoom(zoom, self.pixel_tolerance))
+            kept.extend(anchor + i for i in tail)
+        self.levels[zoom] = kept
+        self.dirty.discard(zoom)
+        return kept
+
+    def get_range(self, zoom, start, end):
+        kept = self.get(zoom)
+        ts = self.timeline.ts
+        i = bisect_left(kept, start, key=ts.__getitem__)
+        j = bisect_right(kept, end, key=ts.__getitem__)
+        return kept[i:j]
+
+    def get_capped(self, zoom, max_points=MAX_POINTS, start=None, end=None):
+        """Kept rows (within start..end if given) at the finest zoom up to `zoom` that has
+        at most `max_points` of them: each level down doubles the tolerance, and levels are
+        cached like any other. If even zoom 0 has too many, they are thinned evenly."""
+        zoom = max(0, min(MAX_ZOOM, int(zoom)))
+        for z in range(zoom, -1, -1):
+            rows = self.get(z) if start is None and end is None else self.get_range(z, start, end)
+            if len(rows) <= max_points:
+                return rows
+        return thin(rows, max_points)
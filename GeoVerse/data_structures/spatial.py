@@ -0,0 +1,137 @@
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres between two lat/lon points."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat, lon, radius_km):
+    """Return (min_lat, min_lon, max_lat, max_lon) enclosing a circle; spans all longitudes near the poles.
+    min_lon > max_lon means the box crosses the antimeridian.
+    """
+    dlat = radius_km / KM_PER_DEG_LAT
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+    dlon = dlat / max(math.cos(math.radians(max(abs(min_lat), abs(max_lat)))), 1e-12)
+    if dlon >= 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180.0:
+        min_lon += 360.0
+    if max_lon > 180.0:
+        max_lon -= 360.0
+    return min_lat, min_lon, max_lat, max_lon
+
+
+class GridCell:
+    __slots__ = ("keys",)
+
+    def __init__(self):
+        self.keys = array("d")  # timestamps of the cell's points, sorted
+
+
+class GridIndex:
+    """Spatial hash of a ColumnarTimeline's points on a fixed lat/lon grid.
+    Each cell keeps only the sorted timestamps of its points, so bounding-box and
+    radius queries only visit the cells they overlap and binary-search the optional
+    time window inside each cell; matches are read back from the timeline's columns.
+    Results are row indices into the timeline, valid until it next changes.
+    """
+    def __init__(self, timeline, cell_deg=0.5):
+        self.timeline = timeline
+        self.cell_deg = cell_deg
+        self.cells = {}  # (ix, iy) -> GridCell
+        self.size = 0
+
+    @classmethod
+    def build(cls, timeline, cell_deg=0.5):
+        index = cls(timeline, cell_deg)
+        index.add_rows(range(len(timeline)))
+        return index
+
+    def _cell_key(self, lat, lon):
+        return int(math.floor(lon / self.cell_deg)), int(math.floor(lat / self.cell_deg))
+
+    def insert(self, timestamp, lat, lon):
+        key = self._cell_key(lat, lon)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = GridCell()
+        if not cell.keys or timestamp >= cell.keys[-1]:
+            cell.keys.append(timestamp)
+        else:
+            cell.keys.insert(bisect_right(cell.keys, timestamp), timestamp)
+        self.size += 1
+
+    def add_rows(self, rows):
+        """Index the timeline rows `rows` (already in the timeline)."""
+        tl = self.timeline
+        ts, lat, lon = tl.ts, tl.lat, tl.lon
+        for i in rows:
+            self.insert(ts[i], lat[i], lon[i])
+
+    def _cells_in_box(self, min_lat, min_lon, max_lat, max_lon):
+        x0, y0 = self._cell_key(min_lat, min_lon)
+        x1, y1 = self._cell_key(max_lat, max_lon)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # sparse data under a large box: cheaper to filter occupied cells
+            return [(k, c) for k, c in self.cells.items() if x0 <= k[0] <= x1 and y0 <= k[1] <= y1]
+        out = []
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                cell = self.cells.get((x, y))
+                if cell is not None:
+                    out.append(((x, y), cell))
+        return out
+
+    def search_bbox(self, min_lat, min_lon, max_lat, max_lon, start=None, end=None):
+        """Return the rows inside the box (and time window), in timeline order.
+        A box with min_lon > max_lon wraps across the antimeridian.
+        """
+        if min_lon > max_lon:
+            boxes = [(min_lon, 180.0), (-180.0, max_lon)]
+        else:
+            boxes = [(min_lon, max_lon)]
+        tl = self.timeline
+        ts, lat, lon, n = tl.ts, tl.lat, tl.lon, len(tl)
+        out = []
+        for lo, hi in boxes:
+            for key, cell in self._cells_in_box(min_lat, lo, max_lat, hi):
+                i = 0 if start is None else bisect_left(cell.keys, start)
+                j = len(cell.keys) if end is None else bisect_right(cell.keys, end)
+                prev = None
+                for t in cell.keys[i:j]:
+                    if t == prev:
+                        continue
+                    prev = t
+                    # rows sharing a timestamp may sit in other cells; take this cell's
+                    for r in range(bisect_left(ts, t, 0, n), bisect_right(ts, t, 0, n)):
+                        if min_lat <= lat[r] <= max_lat and lo <= lon[r] <= hi and \
+                                self._cell_key(lat[r], lon[r]) == key:
+                            out.append(r)
+        out.sort()
+        return out
+
+    def search_radius(self, lat, lon, radius_km, start=None, end=None):
+        """Return (row, distance_km) pairs within `radius_km` of (lat, lon), in timeline order."""
+        tl = self.timeline
+        out = []
+        for r in self.search_bbox(*radius_bbox(lat, lon, radius_km), start=start, end=end):
+            d = haversine_km(lat, lon, tl.lat[r], tl.lon[r])
+            if d <= radius_km:
+                out.append((r, d))
+        return out
+
+    def __len__(self):
+        return self.size
@@ -1,29 +1,153 @@
 import os
 import json
+import math
+import time
 import uuid
+import heapq
 import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
 from werkzeug.security import generate_password_hash, check_password_hash
-from .dll import DoublyLinkedList
-from .avl import AVLTree
-from .queue_ds import QueueDS
+from .queue_ds import QueueDS, QueueFull
+from .columnar import ColumnarTimeline, RangeBounds
+from .wal import WriteAheadLog
+from .pubsub import EventBroker
+from .spatial import GridIndex
+from .simplify import SimplificationCache, MAX_POINTS as MAX_SIMPLIFIED_POINTS
+from .rollup import RollupIndex
+from .locks import RWLock
+from .segment import MappedSegment, write_segment, SEGMENT_EXT
+from .retention import downsample, validate as validate_retention
+from .presence import PresenceIndex, PRESENCE_EXT, write_presence, read_presence, co_location
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 STORAGE_FILE = os.path.join(ROOT, 'storage.json')
+# number of logged events after which the log is compacted into a new snapshot
+COMPACT_EVERY = 5000
+# default budget for resident per-user structures, and the measured cost of one resident
+# point: its columnar row plus grid, rollup and simplification entries. A walked track costs
+# ~50 bytes; points scattered one per grid cell ~260, which is what the budget assumes.
+MEMORY_BUDGET = 256 * 1024 * 1024
+RESIDENT_BYTES_PER_POINT = 256
+# measured cost of one (presence key, user) entry of the PresenceIndex, also counted in the budget
+PRESENCE_BYTES_PER_ENTRY = 560
+# users whose presence a nearby_users() query reads per store-lock acquisition
+PRESENCE_LOAD_BATCH = 64
+# offline entries merged per step when a queue is synced (and when a sync is replayed)
+SYNC_CHUNK = 4096
+# changes kept per resident user for changes_since(); older pollers are told to reset
+CHANGE_LOG_SIZE = 4096
+
+
+def parse_points(points):
+    """Validate a batch of location records in one pass.
+    Each record is a dict {timestamp, lat, lon[, online]} or a sequence
+    (timestamp, lat, lon[, online]); online defaults to True. Returns
+    (online, offline) lists of (timestamp, lat, lon) tuples, the online ones sorted.
+    Raises ValueError naming the first invalid record.
+    """
+    online, offline = [], []
+    for i, p in enumerate(points):
+        try:
+            if isinstance(p, dict):
+                ts, lat, lon, is_online = p['timestamp'], p['lat'], p['lon'], p.get('online', True)
+            else:
+                ts, lat, lon, is_online = (tuple(p) + (True,))[:4]
+            row = (float(ts), float(lat), float(lon))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'point {i}: expected timestamp, lat, lon and optional online')
+        if not all(math.isfinite(v) for v in row) or not -90.0 <= row[1] <= 90.0 or not -180.0 <= row[2] <= 180.0:
+            raise ValueError(f'point {i}: timestamp must be finite, lat within [-90, 90] and lon within [-180, 180]')
+        (online if is_online else offline).append(row)
+    online.sort()
+    return online, offline
 
 class UserStore:
     """Manages users and per-user data structures (in-memory).
-    Persistence: basic JSON file to store user ids and password hashes. The data structures are kept in memory.
+    Persistence: `storage.json` only holds the user/phone index. Each user's timeline and
+    offline queue live in their own segment file under `storage.segments/`, which is read
+    the first time the user is accessed. Location and queue events are appended to a
+    write-ahead log and replayed on load; the log is periodically compacted by rewriting
+    the segments it touched and a fresh index snapshot.
+
+    Concurrency: each user's structures are guarded by a readers/writer lock, and the
+    shared maps, the LRU, the change clock and all persistence by one store lock
+    (always taken after a user lock). A mutation applies its persisted row and appends
+    its log record under the store lock, so a compaction never sees one without the
+    other. timeline() and search_range() read the columnar timeline without locking.
+
+    Retention: `retention` is a tuple of (age_s, resolution_s) tiers (see retention.py);
+    apply_retention() downsamples history older than the first tier. Empty keeps everything.
+
+    Offline queues hold at most `queue_capacity` entries (None = unbounded); when full,
+    `queue_policy` 'drop_oldest' discards the oldest entry and 'reject' raises QueueFull.
+    Queues keep a window in memory and spill the rest next to the segments (see QueueDS).
+    Entries dropped to make room are logged, so replay does not depend on the capacity
+    the store is reopened with.
+
+    Cross-user queries (nearby_users(), co_location()) go through a PresenceIndex of
+    (time bucket, cell) -> per-user counts over every user's timeline, resident or not.
+    A user's entries are loaded on first need: with its segment, or for a query, from a
+    `.presence` sidecar next to the segment, plus its pending log events. Entries count
+    against the memory budget: they are dropped with the user's timeline on eviction,
+    and those of cold users loaded for a query are dropped least recently used first.
+    Whenever a
+    segment is written the user's rows are queued for its sidecar, and a background
+    writer saves them after the store lock is released (it takes its own io lock first).
+    A sidecar that does not match its segment's log seq is rebuilt from the timeline.
     """
-    def __init__(self):
+    def __init__(self, storage_file=None, compact_every=COMPACT_EVERY, memory_budget=MEMORY_BUDGET, retention=(),
+                 queue_capacity=None, queue_policy='drop_oldest'):
+        self.storage_file = storage_file or STORAGE_FILE
+        self.segment_dir = os.path.splitext(self.storage_file)[0] + '.segments'
+        self.compact_every = compact_every
+        validate_retention(retention)
+        self.retention = tuple(tuple(t) for t in retention)
+        QueueDS(policy=queue_policy)  # validates the policy
+        self.queue_capacity = queue_capacity
+        self.queue_policy = queue_policy
         self.users = {}        # userid -> {phone, password_hash}
         self.phone_map = {}    # phone -> userid
-        self.structs = {}      # userid -> {dll, avl, queue}
+        # userid -> {timeline, queue, indexes over its rows, version bookkeeping}, least recently used first;
+        # users beyond `memory_budget` bytes are evicted and reloaded lazily (None = no limit)
+        self.structs = OrderedDict()
+        self.memory_budget = memory_budget
+        self.resident_points = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.evictions = 0
+        # persisted state of users whose segment has been read:
+        self.timelines = {}    # userid -> ColumnarTimeline
+        self.queues = {}       # userid -> QueueDS of {timestamp, lat, lon, source:'offline'}; shared with structs
+        self._pending = {}     # userid -> logged events not yet applied to an unread segment
+        self._cold_queue_lengths = {}  # userid -> offline queue length of a user whose segment is unread
+        self._dirty = set()    # users whose segment is behind the log
+        # store-wide change clock; starts at the current time in microseconds so versions
+        # handed out by a previous process are never mistaken for current ones
+        self._clock = time.time_ns() // 1000
+        # live per-user event fan-out (new points, synced batches, status changes)
+        self.events = EventBroker()
+        self._lock = threading.RLock()
+        self._user_locks = {}  # userid -> RWLock
+        self._touched = set()  # users read lock-free since the LRU was last reordered
+        self._log = WriteAheadLog(os.path.splitext(self.storage_file)[0] + '.log')
+        self.presence = PresenceIndex()  # users whose timeline is loaded are always in it
+        self._presence_lru = OrderedDict()  # userids in self.presence, least recently used first
+        self._segment_seqs = {}  # userid -> log seq of the segment this process last wrote for it
+        self._presence_outbox = {}  # userid -> (log_seq, rows) waiting to be written to its sidecar
+        self._presence_io = threading.Lock()
+        self._presence_wanted = threading.Event()
         self._load()
+        threading.Thread(target=self._presence_loop, daemon=True).start()
 
     def _load(self):
-        if os.path.exists(STORAGE_FILE):
+        """Read the user index and the log; timelines stay on disk until first access."""
+        if os.path.exists(self.storage_file):
             try:
-                with open(STORAGE_FILE, 'r', encoding='utf-8') as f:
+                with open(self.storage_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
             except Exception:
                 data = {}
@@ -31,46 +155,312 @@ class UserStore:
             data = {}
         self.users = data.get('users', {})
         self.phone_map = data.get('phone_map', {})
-        # persisted timelines: userid -> [ {timestamp, lat, lon, source} ... ]
-        self.timelines = data.get('timelines', {})
-        # persisted offline queues: userid -> [ {timestamp, lat, lon, source:'offline'} ... ]
-        self.queues = data.get('queues', {})
+        # older snapshots embed every timeline and queue; load them once and split them into segments
+        legacy = 'timelines' in data or 'queues' in data
+        for uid, pts in data.get('timelines', {}).items():
+            self.timelines[uid] = ColumnarTimeline.from_dicts(pts)
+            self.queues[uid] = self._new_queue(uid)
+        for uid, items in data.get('queues', {}).items():
+            self.queues[uid] = self._new_queue(uid, items)
+            self.timelines.setdefault(uid, ColumnarTimeline())
+        if legacy:
+            self._dirty.update(self.timelines)
+        # apply events logged after the snapshot was written
+        for rec in self._log.replay(data.get('log_seq', 0)):
+            uid = rec['uid']
+            self._dirty.add(uid)
+            if uid in self.timelines:
+                self._apply_event(rec)
+            else:
+                self._pending.setdefault(uid, []).append(rec)
+        if legacy:
+            for uid in self.timelines:
+                self._rebuild_presence(uid)
+            self._save()
+
+    def _track_presence(self, rec):
+        # points a log record appends to the timeline, for users whose presence is loaded
+        if rec['uid'] not in self.presence.by_user:
+            return
+        if rec['op'] == 'loc':
+            self.presence.add(rec['uid'], rec['ts'], rec['lat'], rec['lon'])
+        elif rec['op'] == 'batch':
+            self.presence.add_many(rec['uid'], rec['pts'])
+
+    def _rebuild_presence(self, userid):
+        """Re-index the user's loaded timeline. Callers hold the store lock."""
+        tl = self.timelines[userid]
+        self.presence.load_rows(userid, ())
+        self.presence.add_many(userid, zip(tl.ts, tl.lat, tl.lon))
+        self._presence_lru[userid] = None
+        self._presence_lru.move_to_end(userid)
+
+    def _load_presence(self, userid, rows, pending=()):
+        # saved rows plus the points of the pending loc/batch events after them
+        self.presence.load_rows(userid, rows)
+        self._presence_lru[userid] = None
+        self._presence_lru.move_to_end(userid)
+        for rec in pending:
+            self._track_presence(rec)
+
+    def _drop_presence(self, userid):
+        self.presence.remove_user(userid)
+        self._presence_lru.pop(userid, None)
+
+    def _presence_path(self, userid):
+        return os.path.join(self.segment_dir, userid + PRESENCE_EXT)
+
+    def _presence_rows(self, userid, seg_seq):
+        # the user's saved presence rows if they match the segment, else None
+        entry = self._presence_outbox.get(userid) or read_presence(self._presence_path(userid))
+        return entry[1] if entry is not None and entry[0] == seg_seq else None
+
+    def _ensure_presence(self, userid):
+        """Load a user's presence entries if they are not yet: from its sidecar plus pending
+        events, or by reading its timeline when the sidecar is stale or the pending events
+        include a sync or retention pass (they do not carry their points). Callers hold the
+        store lock."""
+        if userid in self.presence.by_user:
+            self._presence_lru.move_to_end(userid)
+            return
+        seg_seq = self._segment_header(userid)[0]
+        rows = self._presence_rows(userid, seg_seq)
+        pending = [rec for rec in self._pending.get(userid, ()) if rec['seq'] > seg_seq]
+        if rows is None or any(rec['op'] in ('sync', 'retain') for rec in pending):
+            self._persisted_timeline(userid)  # indexes it (see _load_segment)
+            if userid not in self.structs:
+                rows = self.presence.rows(userid)
+                self._unload(userid)
+                self._load_presence(userid, rows)
+            return
+        self._load_presence(userid, rows, pending)
+
+    def _presence_loop(self):
+        while True:
+            self._presence_wanted.wait()
+            self._presence_wanted.clear()
+            self._flush_presence()
+
+    def _flush_presence(self):
+        """Write the queued presence sidecars. Never called with the store lock held: rows
+        are taken off the outbox only once written, so a reader never misses them."""
+        with self._presence_io:
+            with self._lock:
+                todo = list(self._presence_outbox.items())
+            for uid, entry in todo:
+                try:
+                    write_presence(self._presence_path(uid), *entry)
+                except OSError:
+                    pass  # a missing sidecar is rebuilt when it is needed
+            with self._lock:
+                for uid, entry in todo:
+                    if self._presence_outbox.get(uid) is entry:
+                        del self._presence_outbox[uid]
+
+    def _segment_path(self, userid):
+        return os.path.join(self.segment_dir, userid + SEGMENT_EXT)
+
+    def _new_queue(self, userid, entries=()):
+        # filled with push(): what was persisted is kept whatever the current capacity;
+        # a queue over it shrinks (logged) on its next enqueue
+        q = QueueDS(self.queue_capacity, self.queue_policy, os.path.join(self.segment_dir, userid + '.spill'))
+        for entry in entries:
+            q.push(entry)
+        return q
+
+    def _json_segment_path(self, userid):
+        # segments written before the binary format
+        return os.path.join(self.segment_dir, userid + '.json')
+
+    def _load_segment(self, userid):
+        """Materialize a user's persisted timeline and queue from its segment plus pending log events."""
+        path = self._segment_path(userid)
+        json_path = self._json_segment_path(userid)
+        seg_seq = 0
+        if os.path.exists(path):
+            with MappedSegment(path) as seg:
+                self.timelines[userid] = ColumnarTimeline.from_columns(*seg.columns())
+                self.queues[userid] = self._new_queue(userid, seg.iter_queue())
+                seg_seq = seg.log_seq
+        elif os.path.exists(json_path):
+            with open(json_path, 'r', encoding='utf-8') as f:
+                seg = json.load(f)
+            self.timelines[userid] = ColumnarTimeline.from_columns(seg['timestamp'], seg['lat'], seg['lon'], seg['source'])
+            self.queues[userid] = self._new_queue(userid, seg.get('queue', []))
+            seg_seq = seg.get('log_seq', 0)
+        else:
+            self.timelines[userid] = ColumnarTimeline()
+            self.queues[userid] = self._new_queue(userid)
+        self._cold_queue_lengths.pop(userid, None)
+        # the segment may already contain events from a compaction that did not finish
+        pending = [rec for rec in self._pending.pop(userid, []) if rec['seq'] > seg_seq]
+        for rec in pending:
+            self._apply_event(rec)
+        if userid not in self.presence.by_user:
+            rows = self._presence_rows(userid, seg_seq)
+            if rows is None or any(rec['op'] in ('sync', 'retain') for rec in pending):
+                self._rebuild_presence(userid)
+            else:
+                self._load_presence(userid, rows, pending)
+
+    def _segment_header(self, userid):
+        # (log_seq, queued entries) of the user's segment without reading its points; (0, 0) if none
+        path, json_path = self._segment_path(userid), self._json_segment_path(userid)
+        if os.path.exists(path):
+            with MappedSegment(path) as seg:
+                return seg.log_seq, seg.queued
+        if os.path.exists(json_path):
+            with open(json_path, 'r', encoding='utf-8') as f:
+                seg = json.load(f)
+            return seg.get('log_seq', 0), len(seg.get('queue', []))
+        return 0, 0
+
+    def _write_segment(self, userid, seq):
+        write_segment(self._segment_path(userid), seq, self.timelines[userid], self.queues.get(userid) or ())
+        self._segment_seqs[userid] = seq
+        json_path = self._json_segment_path(userid)
+        if os.path.exists(json_path):
+            os.remove(json_path)
+        if userid in self.presence.by_user:
+            # the sidecar is written by the presence writer once the store lock is released
+            self._presence_outbox[userid] = (seq, self.presence.rows(userid))
+            self._presence_wanted.set()
+
+    def convert_segments(self):
+        """Rewrite every user still stored as JSON (in a segment or an old snapshot) as a binary segment.
+        Returns the number of users converted.
+        """
+        with self._lock:
+            todo = [uid for uid in self.users if not os.path.exists(self._segment_path(uid))]
+            self._dirty.update(todo)
+            self._save()
+        return len(todo)
+
+    @staticmethod
+    def _atomic_write(path, data, indent=None):
+        # write to a temp file and rename over the target, so a crash never leaves it half-written
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _apply_event(self, rec):
+        uid = rec['uid']
+        if rec['op'] == 'loc':
+            self._persisted_timeline(uid).append(rec['ts'], rec['lat'], rec['lon'], rec['src'])
+        elif rec['op'] == 'enq':
+            # entries dropped to make room are logged, so replay matches whatever the capacity is now
+            q = self._persisted_queue(uid)
+            q.push({'timestamp': rec['ts'], 'lat': rec['lat'], 'lon': rec['lon'], 'source': 'offline'})
+            q.discard(rec.get('drop', 0))
+        elif rec['op'] == 'batch':
+            self._persisted_timeline(uid).merge_sorted((ts, lat, lon, 'online') for ts, lat, lon in rec['pts'])
+            q = self._persisted_queue(uid)
+            for ts, lat, lon in rec['enq']:
+                q.push({'timestamp': ts, 'lat': lat, 'lon': lon, 'source': 'offline'})
+            q.discard(rec.get('drop', 0))
+        elif rec['op'] == 'sync':
+            # one record per chunk of sync_queue; records without `n` drained the whole queue
+            tl = self._persisted_timeline(uid)
+            q = self._persisted_queue(uid)
+            for items in ([q.take(rec['n'])] if 'n' in rec else q.drain(SYNC_CHUNK)):
+                items.sort(key=lambda x: x['timestamp'])
+                tl.merge_sorted((it['timestamp'], it['lat'], it['lon'], 'synced') for it in items)
+        elif rec['op'] == 'retain':
+            # replays the same pass: same tiers and `now`, applied at the same point in the log
+            downsample(self._persisted_timeline(uid), rec['now'], rec['tiers'])
+
+    def _persisted_timeline(self, userid):
+        if userid not in self.timelines:
+            self._load_segment(userid)
+        return self.timelines[userid]
+
+    def _persisted_queue(self, userid):
+        self._persisted_timeline(userid)
+        return self.queues[userid]
+
+    def _log_event(self, op, userid, **fields):
+        """Persist one event in O(1); compacts the log into a snapshot every `compact_every` events.
+        Callers hold the store lock.
+        """
+        fields['op'] = op
+        fields['uid'] = userid
+        self._dirty.add(userid)
+        self._log.append(fields)
+        self._track_presence(fields)
+        if userid not in self.timelines:
+            # the user's segment is not loaded: keep the event until it is read or compacted
+            self._pending.setdefault(userid, []).append(fields)
+            if userid in self._cold_queue_lengths:
+                self._cold_queue_lengths[userid] = self._queue_length_after(self._cold_queue_lengths[userid], fields)
+        if self._log.records_since_checkpoint >= self.compact_every:
+            self._save()
 
     def _save(self):
-        data = {'users': self.users, 'phone_map': self.phone_map, 'timelines': getattr(self, 'timelines', {}), 'queues': getattr(self, 'queues', {})}
-        with open(STORAGE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
-
-    def create_user(self, phone, password):
-        if phone in self.phone_map:
-            raise ValueError('Phone already registered')
-        userid = str(uuid.uuid4())
+        """Compact the log: rewrite the segments of users it touched, then the index, then truncate it.
+        Every file is replaced atomically, and segments record the last log seq they contain,
+        so a crash at any point leaves a state that replays correctly.
+        """
+        def write_snapshot(seq):
+            os.makedirs(self.segment_dir, exist_ok=True)
+            for uid in list(self._dirty):
+                loaded, indexed = uid in self.timelines, uid in self.presence.by_user
+                if not loaded:
+                    self._load_segment(uid)
+                self._write_segment(uid, seq)
+                if not loaded and uid not in self.structs:
+                    # folded pending events only; keep the user cold
+                    del self.timelines[uid]
+                    self.queues.pop(uid).close()
+                    if not indexed:
+                        self._drop_presence(uid)
+            self._dirty.clear()
+            data = {'users': self.users, 'phone_map': self.phone_map, 'log_seq': seq}
+            self._atomic_write(self.storage_file, data, indent=2)
+        with self._lock:
+            self._log.checkpoint(write_snapshot)
+
+    def flush(self):
+        """Force buffered log records to disk."""
+        self._log.flush()
+
+    def close(self):
+        self._log.close()
+        self._flush_presence()
+
+    def create_user(self, phone, password, userid=None):
         pw_hash = generate_password_hash(password)
-        self.users[userid] = {'phone': phone, 'password_hash': pw_hash}
-        self.phone_map[phone] = userid
-        self._save()
-        # initialize in-memory structures
-        self.init_user_structures(userid)
+        with self._lock:
+            if phone in self.phone_map:
+                raise ValueError('Phone already registered')
+            userid = userid or str(uuid.uuid4())
+            self.users[userid] = {'phone': phone, 'password_hash': pw_hash}
+            self.phone_map[phone] = userid
+            self._save()
+            # initialize in-memory structures
+            self.init_user_structures(userid)
         return userid
 
-    def reserve_user(self, phone):
+    def reserve_user(self, phone, userid=None):
         """Reserve a userid for a phone number before password is set.
         This creates the phone->userid mapping and a user entry with empty password.
+        `userid` lets a caller (the shard router) choose the id; a new uuid by default.
         """
-        if phone in self.phone_map:
-            raise ValueError('Phone already registered')
-        userid = str(uuid.uuid4())
-        # empty password_hash signifies pending creation
-        self.users[userid] = {'phone': phone, 'password_hash': ''}
-        self.phone_map[phone] = userid
-        # initialize empty persisted timeline and queue
-        if not hasattr(self, 'timelines'):
-            self.timelines = {}
-        if not hasattr(self, 'queues'):
-            self.queues = {}
-        self.timelines[userid] = []
-        self.queues[userid] = []
-        self._save()
+        with self._lock:
+            if phone in self.phone_map:
+                raise ValueError('Phone already registered')
+            userid = userid or str(uuid.uuid4())
+            # empty password_hash signifies pending creation
+            self.users[userid] = {'phone': phone, 'password_hash': ''}
+            self.phone_map[phone] = userid
+            # initialize empty persisted timeline and queue
+            self.timelines[userid] = ColumnarTimeline()
+            self.queues[userid] = self._new_queue(userid)
+            self._load_presence(userid, ())
+            self._dirty.add(userid)
+            self._save()
         return userid
 
     def set_password_for_user(self, userid, password):
@@ -78,10 +468,11 @@ class UserStore:
         if userid not in self.users:
             raise ValueError('userid not found')
         pw_hash = generate_password_hash(password)
-        self.users[userid]['password_hash'] = pw_hash
-        self._save()
-        # initialize in-memory structures
-        self.init_user_structures(userid)
+        with self._user_lock(userid).write(), self._lock:
+            self.users[userid]['password_hash'] = pw_hash
+            self._save()
+            # initialize in-memory structures
+            self.init_user_structures(userid)
         return userid
 
     def authenticate(self, login, password):
@@ -99,102 +490,725 @@ class UserStore:
         return None
 
     def init_user_structures(self, userid):
-        dll = DoublyLinkedList()
-        avl = AVLTree()
-        queue = QueueDS()
-
-        # If we have a persisted timeline for this user, rebuild structures from it.
-        persisted = getattr(self, 'timelines', {}).get(userid)
-        if persisted and len(persisted) > 0:
-            # ensure sorted by timestamp
-            persisted = sorted(persisted, key=lambda x: x['timestamp'])
-            for entry in persisted:
-                node = dll.append(entry['timestamp'], entry.get('lat', 0.0), entry.get('lon', 0.0), source=entry.get('source', 'online'))
-                avl.insert(entry['timestamp'], node)
-        else:
+        """Build a user's resident indexes over its persisted timeline. Callers hold the store lock.
+        The columnar timeline is the only copy of the points: time lookups binary-search its
+        timestamp column, and the spatial grid, rollups, simplification cache and range
+        bounds refer to its rows, so a resident user costs little more than its columns.
+        """
+        timeline = self._persisted_timeline(userid)
+        if not len(timeline):
             # Insert a current location as initial entry (timestamp now)
-            import time
             now = time.time()
-            initial_node = dll.append(now, 0.0, 0.0, source='online')
-            avl.insert(now, initial_node)
-            # persist initial timeline
-            if not hasattr(self, 'timelines'):
-                self.timelines = {}
-            self.timelines[userid] = dll.to_list()
-            self._save()
+            timeline.append(now, 0.0, 0.0, 'online')
+            self._log_event('loc', userid, ts=now, lat=0.0, lon=0.0, src='online')
 
-        # rebuild queue from persisted queues if available
-        persisted_q = getattr(self, 'queues', {}).get(userid, [])
-        for it in persisted_q:
-            queue.enqueue(it)
-
-        self.structs[userid] = {'dll': dll, 'avl': avl, 'queue': queue}
+        base = self._tick()
+        self.structs[userid] = {
+            # the timeline and offline queue are shared with the persisted state rather than copied
+            'timeline': timeline, 'queue': self._persisted_queue(userid),
+            'spatial': GridIndex.build(timeline), 'rollups': RollupIndex.build(timeline),
+            'simplified': SimplificationCache(timeline), 'bounds': RangeBounds(timeline),
+            # timeline version and the points added after `changes_base`, in change order
+            'version': base, 'changes_base': base,
+            'change_versions': array('q'), 'change_points': [],
+            'queue_version': base,
+        }
         return self.structs[userid]
 
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _record_changes(self, s, points):
+        for point in points:
+            s['change_versions'].append(self._tick())
+            s['change_points'].append(point)
+        if points:
+            s['version'] = self._clock
+        excess = len(s['change_points']) - CHANGE_LOG_SIZE
+        if excess > 0:
+            # trim down to half the cap, so trimming is amortized over many changes
+            drop = excess + CHANGE_LOG_SIZE // 2
+            s['changes_base'] = s['change_versions'][drop - 1]
+            del s['change_versions'][:drop]
+            del s['change_points'][:drop]
+
+    def _user_lock(self, userid):
+        lock = self._user_locks.get(userid)
+        if lock is None:
+            with self._lock:
+                lock = self._user_locks.setdefault(userid, RWLock())
+        return lock
+
+    @contextmanager
+    def _reading(self, userid):
+        """Hold the user's read lock and yield its resident structures."""
+        with self._user_lock(userid).read():
+            with self._lock:
+                s = self.get_structs(userid)
+            yield s
+
+    @contextmanager
+    def _writing(self, userid):
+        with self._user_lock(userid).write():
+            with self._lock:
+                s = self.get_structs(userid)
+            yield s
+
     def get_structs(self, userid):
-        if userid not in self.structs:
-            return self.init_user_structures(userid)
-        return self.structs[userid]
+        """Return the user's resident structures, loading them on a miss.
+        Callers must hold the user's lock for as long as they use the result; a locked
+        user is never evicted.
+        """
+        with self._lock:
+            s = self.structs.get(userid)
+            if s is not None:
+                self.cache_hits += 1
+                self.structs.move_to_end(userid)
+                return s
+            self.cache_misses += 1
+            s = self.init_user_structures(userid)
+            self.resident_points += len(s['timeline'])
+            self._enforce_budget()
+            return s
 
-    def insert_location(self, userid, timestamp, lat, lon, online=True):
-        s = self.get_structs(userid)
+    def _memory_used(self):
+        return self.resident_points * RESIDENT_BYTES_PER_POINT + self.presence.entries * PRESENCE_BYTES_PER_ENTRY
+
+    def _enforce_budget(self):
+        """Drop presence entries of cold users, then evict least recently used users, until
+        resident structures and the presence index fit the memory budget. Users that another
+        thread has locked are skipped. Callers hold the store lock.
+        """
+        if self.memory_budget is None:
+            return
+        for uid in list(self._touched):
+            self._touched.discard(uid)
+            if uid in self.structs:
+                self.structs.move_to_end(uid)
+        for uid in list(self._presence_lru):
+            if self._memory_used() <= self.memory_budget:
+                break
+            if uid not in self.timelines:
+                # reloaded from its sidecar when a query needs it again
+                self._drop_presence(uid)
+        for uid in list(self.structs):
+            if len(self.structs) <= 1 or self._memory_used() <= self.memory_budget:
+                break
+            lock = self._user_lock(uid)
+            if lock.acquire_write(blocking=False):
+                try:
+                    self._evict(uid)
+                finally:
+                    lock.release_write()
+
+    def evict(self, userid):
+        """Drop a user's in-memory structures, writing its segment first if the log is ahead of it."""
+        with self._user_lock(userid).write(), self._lock:
+            self._evict(userid)
+
+    def _evict(self, userid):
+        s = self.structs.pop(userid, None)
+        if s is None:
+            return
+        self.resident_points -= len(s['timeline'])
+        self._unload(userid)
+        self.evictions += 1
+
+    def _unload(self, userid):
+        # drop the persisted timeline/queue from memory, writing the segment first if the log is ahead of it
+        if userid in self._dirty:
+            self._log.flush()
+            os.makedirs(self.segment_dir, exist_ok=True)
+            self._write_segment(userid, self._log.seq)
+            self._dirty.discard(userid)
+        self.timelines.pop(userid, None)
+        q = self.queues.pop(userid, None)
+        if q is not None:
+            q.close()
+        self._drop_presence(userid)
+
+    def _check_queue_room(self, userid, count):
+        """Raise QueueFull if `count` more entries would overflow a rejecting queue; otherwise
+        return how many entries a bounded queue drops to take them (they are logged). Checked
+        before anything is applied or logged. Callers hold the store lock."""
+        if not count or self.queue_capacity is None:
+            return 0
+        n = self._queue_length(userid)
+        if self.queue_policy == 'reject' and n + count > self.queue_capacity:
+            raise QueueFull(f'offline queue is full ({self.queue_capacity} entries)')
+        # drop_oldest keeps the newest `capacity` entries, whatever order they are pushed in
+        return max(0, n + count - self.queue_capacity)
+
+    def _queue_length(self, userid):
+        """Length of the user's offline queue. A cold user's is read from its segment header
+        and pending events, then kept up to date, so its timeline is never loaded for it.
+        Callers hold the store lock."""
+        q = self.queues.get(userid)
+        if q is not None:
+            return len(q)
+        n = self._cold_queue_lengths.get(userid)
+        if n is None:
+            seg_seq, n = self._segment_header(userid)
+            for rec in self._pending.get(userid, ()):
+                if rec['seq'] > seg_seq:
+                    n = self._queue_length_after(n, rec)
+            self._cold_queue_lengths[userid] = n
+        return n
+
+    @staticmethod
+    def _queue_length_after(n, rec):
+        # queue length once a logged event is applied (mirrors _apply_event)
+        if rec['op'] == 'enq':
+            return n + 1 - rec.get('drop', 0)
+        if rec['op'] == 'batch':
+            return n + len(rec['enq']) - rec.get('drop', 0)
+        if rec['op'] == 'sync':
+            return max(0, n - rec['n']) if 'n' in rec else 0
+        return n
+
+    def cache_stats(self):
+        with self._lock:
+            return {
+                'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'evictions': self.evictions,
+                'resident_users': len(self.structs),
+                'resident_points': self.resident_points,
+                'estimated_bytes': self._memory_used(),
+                'budget_bytes': self.memory_budget,
+                'presence_cells': len(self.presence),
+                'presence_entries': self.presence.entries,
+            }
+
+    def _insert_cold(self, userid, timestamp, lat, lon, online):
+        """Write-behind insert for a user whose structures are not resident.
+        The event is logged (and applied to the columnar timeline if that is loaded)
+        without building the user's indexes; it is picked up on the next load.
+        """
+        timestamp, lat, lon = float(timestamp), float(lat), float(lon)
         if online:
-            node = s['dll'].append(timestamp, lat, lon, source='online')
-            s['avl'].insert(timestamp, node)
-            # persist timeline
-            if not hasattr(self, 'timelines'):
-                self.timelines = {}
-            self.timelines[userid] = s['dll'].to_list()
-            self._save()
-            return node
-        else:
-            # enqueue offline entry
-            s['queue'].enqueue({'timestamp': float(timestamp), 'lat': float(lat), 'lon': float(lon), 'source': 'offline'})
-            # persist queue
-            if not hasattr(self, 'queues'):
-                self.queues = {}
-            # store as list of dicts
-            self.queues[userid] = list(s['queue']._dq)
-            self._save()
-            return None
+            if userid in self.timelines:
+                self.timelines[userid].append(timestamp, lat, lon, 'online')
+            self._log_event('loc', userid, ts=timestamp, lat=lat, lon=lon, src='online')
+            return {'timestamp': timestamp, 'lat': lat, 'lon': lon, 'source': 'online'}
+        dropped = self._check_queue_room(userid, 1)
+        if userid in self.queues:
+            dropped = self.queues[userid].enqueue({'timestamp': timestamp, 'lat': lat, 'lon': lon, 'source': 'offline'})
+        self._log_event('enq', userid, ts=timestamp, lat=lat, lon=lon, drop=dropped)
+        return None
+
+    def insert_location(self, userid, timestamp, lat, lon, online=True):
+        """Insert one point; returns it as a dict if it went to the timeline, None if it was queued."""
+        with self._user_lock(userid).write():
+            with self._lock:
+                if userid not in self.structs and not self.events.has_subscribers(userid):
+                    return self._insert_cold(userid, timestamp, lat, lon, online)
+                s = self.get_structs(userid)
+            if online:
+                point = {'timestamp': float(timestamp), 'lat': float(lat), 'lon': float(lon), 'source': 'online'}
+                with self._lock:
+                    # the timeline row is the persisted state, so it lands together with its log record
+                    row = s['timeline'].append(point['timestamp'], point['lat'], point['lon'], 'online')
+                    self._log_event('loc', userid, ts=point['timestamp'], lat=point['lat'], lon=point['lon'],
+                                    src='online')
+                    self._index_rows(s, [row])
+                    self.resident_points += 1
+                    self._record_changes(s, [point])
+                    self._enforce_budget()
+                if self.events.has_subscribers(userid):
+                    self.publish(userid, 'location', point=point, version=s['version'])
+                return point
+            else:
+                # enqueue offline entry
+                entry = {'timestamp': float(timestamp), 'lat': float(lat), 'lon': float(lon), 'source': 'offline'}
+                with self._lock:
+                    # the queue is persisted state as well, so it changes together with the log
+                    dropped = s['queue'].enqueue(entry)
+                    s['queue_version'] = self._tick()
+                    self._log_event('enq', userid, ts=entry['timestamp'], lat=entry['lat'], lon=entry['lon'],
+                                    drop=dropped)
+                if self.events.has_subscribers(userid):
+                    self.publish(userid, 'queue', count=len(s['queue']), queue_version=s['queue_version'])
+                return None
 
     def sync_queue(self, userid):
-        s = self.get_structs(userid)
-        items = s['queue'].get_all_and_clear()
-        # sort items by timestamp and insert into dll and avl as 'synced'
-        items.sort(key=lambda x: x['timestamp'])
-        inserted = []
-        for it in items:
-            node = s['dll'].insert_sorted(it['timestamp'], it['lat'], it['lon'], source='synced')
-            s['avl'].insert(it['timestamp'], node)
-            inserted.append(node)
-        # persist timeline and clear persisted queue
-        if not hasattr(self, 'timelines'):
-            self.timelines = {}
-        self.timelines[userid] = s['dll'].to_list()
-        if not hasattr(self, 'queues'):
-            self.queues = {}
-        self.queues[userid] = []
-        self._save()
-        return inserted
+        """Merge the offline queue into the timeline, SYNC_CHUNK entries at a time.
+        Each chunk is taken off the queue, merged into the timeline and logged as one
+        step under the store lock, then indexed; a long backlog streams through in
+        bounded memory and never holds the store lock for the whole sync. Returns the
+        synced points as dicts, oldest first within each chunk.
+        """
+        with self._writing(userid) as s:
+            inserted = []
+            while True:
+                with self._lock:
+                    items = s['queue'].take(SYNC_CHUNK)
+                    if not items:
+                        break
+                    items.sort(key=lambda x: x['timestamp'])
+                    rows = s['timeline'].merge_sorted(
+                        (it['timestamp'], it['lat'], it['lon'], 'synced') for it in items)
+                    self.presence.add_many(userid, ((it['timestamp'], it['lat'], it['lon']) for it in items))
+                    self._log_event('sync', userid, n=len(items))
+                # rows move when the next chunk is merged, so they are used up here
+                self._index_rows(s, rows)
+                inserted.extend(s['timeline'].points(rows))
+            with self._lock:
+                self.resident_points += len(inserted)
+                self._record_changes(s, inserted)
+                if inserted:
+                    s['queue_version'] = self._tick()
+                self._enforce_budget()
+            if inserted and self.events.has_subscribers(userid):
+                self.publish(userid, 'sync', points=inserted, version=s['version'],
+                             count=len(s['queue']), queue_version=s['queue_version'])
+            return inserted
+
+    def insert_many(self, userid, points):
+        """Insert a batch of location records (see parse_points) as one operation.
+        The batch is validated up front, so a bad record rejects all of it. Online points
+        are sorted, merged into the timeline in one pass and indexed together; offline
+        points go to the queue. The batch is logged as a single record.
+        Returns (inserted, queued) counts.
+        """
+        online, offline = parse_points(points)
+        entries = [{'timestamp': ts, 'lat': lat, 'lon': lon, 'source': 'offline'} for ts, lat, lon in offline]
+        with self._user_lock(userid).write():
+            with self._lock:
+                dropped = self._check_queue_room(userid, len(entries))
+                if userid not in self.structs and not self.events.has_subscribers(userid):
+                    # write-behind, as in _insert_cold
+                    self._persist_batch(userid, online, entries, dropped)
+                    return len(online), len(entries)
+                s = self.get_structs(userid)
+                rows = self._persist_batch(userid, online, entries)
+            self._index_rows(s, rows)
+            added = s['timeline'].points(rows)
+            with self._lock:
+                self.resident_points += len(added)
+                self._record_changes(s, added)
+                if entries:
+                    s['queue_version'] = self._tick()
+                self._enforce_budget()
+            if self.events.has_subscribers(userid):
+                if added:
+                    self.publish(userid, 'sync', points=added, version=s['version'],
+                                 count=len(s['queue']), queue_version=s['queue_version'])
+                elif entries:
+                    self.publish(userid, 'queue', count=len(s['queue']), queue_version=s['queue_version'])
+            return len(added), len(entries)
+
+    def _persist_batch(self, userid, online, entries, dropped=0):
+        # apply to whichever persisted state is loaded (the queue is shared with the
+        # resident structures), then log the batch once; `dropped` is what an unloaded
+        # queue drops to take the entries (see _check_queue_room). Returns the timeline
+        # rows the online points landed at (none if the timeline is not loaded).
+        rows = []
+        if userid in self.timelines:
+            rows = self.timelines[userid].merge_sorted((ts, lat, lon, 'online') for ts, lat, lon in online)
+        if userid in self.queues:
+            dropped = 0
+            for entry in entries:
+                dropped += self.queues[userid].enqueue(entry)
+        self._log_event('batch', userid, pts=[list(r) for r in online],
+                        enq=[[e['timestamp'], e['lat'], e['lon']] for e in entries], drop=dropped)
+        return rows
+
+    def publish(self, userid, event_type, **fields):
+        """Push an event to the user's live subscribers (see EventBroker)."""
+        fields['type'] = event_type
+        self.events.publish(userid, fields)
+
+    @staticmethod
+    def _index_rows(s, rows):
+        """Add timeline rows that just landed (sorted) to the user's indexes. Rows after
+        the first one moved, so the row-based caches are cut back to it."""
+        if not rows:
+            return
+        s['spatial'].add_rows(rows)
+        s['rollups'].add_rows(rows)
+        s['simplified'].invalidate_from(rows[0])
+        s['bounds'].invalidate_from(rows[0])
+
+    def compact_history(self, userid, now=None):
+        """Downsample the user's history per the retention tiers; returns the points removed.
+        The pass is logged (with its tiers and `now`) so replay repeats it exactly. A
+        resident user's spatial index, rollups, simplification cache and range bounds are
+        rebuilt over the downsampled timeline, which also resets its version, so delta
+        pollers refetch. A cold user's segment is rewritten and unloaded again.
+        """
+        if not self.retention:
+            return 0
+        now = time.time() if now is None else float(now)
+        s = None
+        with self._user_lock(userid).write(), self._lock:
+            loaded = userid in self.timelines
+            timeline = self._persisted_timeline(userid)
+            before = len(timeline)
+            removed = downsample(timeline, now, self.retention)
+            if removed:
+                self._log_event('retain', userid, now=now, tiers=[list(t) for t in self.retention])
+                self._rebuild_presence(userid)
+            if userid in self.structs:
+                if removed:
+                    del self.structs[userid]
+                    s = self.init_user_structures(userid)
+                    self.resident_points += len(timeline) - before
+            elif not loaded:
+                self._unload(userid)
+        if s is not None and self.events.has_subscribers(userid):
+            self.publish(userid, 'reset', version=s['version'])
+        return removed
+
+    def apply_retention(self, now=None):
+        """Run compact_history for every user (the background compactor's job).
+        Returns the total number of points removed."""
+        now = time.time() if now is None else now
+        return sum(self.compact_history(uid, now) for uid in list(self.users))
+
+    def _read_persisted(self, userid, start_ts=None, end_ts=None):
+        """Points of the user's persisted timeline (all, or start_ts..end_ts) as dicts.
+        Resident users are read from a snapshot of their columnar timeline without taking
+        any lock (the LRU position is updated lazily, on the next budget check). A user
+        whose binary segment exists is answered from the mapped file without loading
+        anything, with pending point events merged in (see _pending_points) and decoding
+        done after the locks are released; other users are loaded first.
+        """
+        tl = self.timelines.get(userid)
+        seg = extra = None
+        if tl is not None and userid in self.structs:
+            self._touched.add(userid)
+        else:
+            with self._user_lock(userid).read(), self._lock:
+                tl = self.timelines.get(userid)
+                path = self._segment_path(userid)
+                if tl is None and os.path.exists(path):
+                    seg = MappedSegment(path)
+                    extra = self._pending_points(userid, seg.log_seq)
+                    if extra is None or not (seg.points or extra):
+                        seg.close()
+                        seg = None
+                if seg is None:
+                    self.get_structs(userid)
+                    tl = self.timelines[userid]
+        if seg is not None:
+            # decoded outside the locks: the mapping stays valid even if a compaction
+            # replaces the file meanwhile
+            with seg:
+                points = seg.to_list() if start_ts is None else seg.search_range(start_ts, end_ts)
+            if extra:
+                if start_ts is not None:
+                    extra = [p for p in extra if start_ts <= p['timestamp'] <= end_ts]
+                # merge is stable, so logged points land after equal timestamps, as on replay
+                points = list(heapq.merge(points, extra, key=lambda p: p['timestamp']))
+            return points
+        with (tl.slice() if start_ts is None else tl.search_range(start_ts, end_ts)) as view:
+            return view.to_list()
+
+    def _pending_points(self, userid, seg_seq):
+        """Points the user's pending events add on top of a segment at `seg_seq`, sorted by
+        timestamp, or None if they include a sync or retention pass (those depend on the
+        timeline and queue contents, so the user has to be loaded). Callers hold the store lock."""
+        points = []
+        for rec in self._pending.get(userid, ()):
+            if rec['seq'] <= seg_seq:
+                continue
+            if rec['op'] == 'loc':
+                points.append({'timestamp': float(rec['ts']), 'lat': float(rec['lat']),
+                               'lon': float(rec['lon']), 'source': rec['src']})
+            elif rec['op'] == 'batch':
+                points.extend({'timestamp': float(ts), 'lat': float(lat), 'lon': float(lon), 'source': 'online'}
+                              for ts, lat, lon in rec['pts'])
+            elif rec['op'] in ('sync', 'retain'):
+                return None
+        points.sort(key=lambda p: p['timestamp'])
+        return points
 
     def timeline(self, userid):
-        s = self.get_structs(userid)
-        return s['dll'].to_list()
+        return self._read_persisted(userid)
+
+    def page(self, userid, after=None, before=None, limit=None, reverse=False):
+        """Walk the timeline between the exclusive cursors `after` and `before`.
+        The first row is found by binary search on the timestamp column, so the cost
+        is O(log n + limit) rather than O(n). Returns (points, next_cursor): points
+        are in walk order (newest first when reverse) and next_cursor is the
+        timestamp to pass as `after` (or `before` when reverse) for the next page, or
+        None at the end. A page never splits points sharing a timestamp.
+        """
+        with self._reading(userid) as s:
+            tl = s['timeline']
+            ts = tl.ts
+            lo = 0 if after is None else tl.rank(after, inclusive=True)
+            hi = len(tl) if before is None else tl.rank(before)
+            out, more = [], False
+            for row in (range(hi - 1, lo - 1, -1) if reverse else range(lo, hi)):
+                if limit is not None and len(out) >= limit and ts[row] != out[-1]['timestamp']:
+                    more = True
+                    break
+                out.append(tl.point(row))
+        next_cursor = out[-1]['timestamp'] if more else None
+        return out, next_cursor
+
+    def version(self, userid):
+        """Current timeline version; changes whenever points are inserted or synced."""
+        with self._reading(userid) as s:
+            return s['version']
+
+    def queue_version(self, userid):
+        with self._reading(userid) as s:
+            return s['queue_version']
+
+    def queue_state(self, userid):
+        """Return (queued entry count, queue_version), read together."""
+        with self._reading(userid) as s:
+            return len(s['queue']), s['queue_version']
+
+    def changes_since(self, userid, since):
+        """Return (points, version, reset) for points added or merged after version `since`.
+        Late synced points are included even though their timestamps are old. If
+        `since` predates the last CHANGE_LOG_SIZE or so changes this process tracked
+        (restart, unknown version, long gap), reset is True and points is empty: the
+        caller reloads the timeline.
+        """
+        with self._reading(userid) as s:
+            if since < s['changes_base'] or since > s['version']:
+                return [], s['version'], True
+            i = bisect_right(s['change_versions'], since)
+            points = sorted(s['change_points'][i:], key=lambda p: p['timestamp'])
+            return [dict(p) for p in points], s['version'], False
+
+    def latest(self, userid, count):
+        """The newest `count` points (oldest first)."""
+        with self._reading(userid) as s:
+            tl = s['timeline']
+            with tl.slice(max(0, len(tl) - count)) as view:
+                return view.to_list()
 
     def search_range(self, userid, start_ts, end_ts):
-        s = self.get_structs(userid)
-        results = s['avl'].search_range(start_ts, end_ts)
-        # results are DLLNode references; convert to dict
-        return [r.to_dict() for r in results]
+        # binary search over a columnar snapshot, or over the mapped segment of a cold user
+        return self._read_persisted(userid, start_ts, end_ts)
 
     def search_nearest(self, userid, ts):
-        s = self.get_structs(userid)
-        results = s['avl'].find_nearest(ts)
-        return [r.to_dict() for r in results]
+        """The point(s) at the timestamp nearest to `ts` (the earlier one on a tie), or []."""
+        ts = float(ts)
+        with self._reading(userid) as s:
+            tl = s['timeline']
+            col, n = tl.ts, len(tl)
+            if not n:
+                return []
+            i = tl.rank(ts)
+            key = col[i] if i < n and (i == 0 or col[i] - ts < ts - col[i - 1]) else col[i - 1]
+            return tl.points(range(*tl.range_indices(key, key)))
+
+    @staticmethod
+    def _k_nearest(tl, right, ts, k, max_distance):
+        # the k rows nearest to ts grow outwards from `right`, the first row at or after it;
+        # they are always contiguous, [lo, hi)
+        col, n = tl.ts, len(tl)
+        lo = hi = right
+        while hi - lo < k:
+            dl = ts - col[lo - 1] if lo > 0 else math.inf
+            dr = col[hi] - ts if hi < n else math.inf
+            d = min(dl, dr)
+            if d == math.inf or (max_distance is not None and d > max_distance):
+                break
+            if dl <= dr:
+                lo -= 1
+            else:
+                hi += 1
+        return tl.points(range(lo, hi))
+
+    def search_k_nearest(self, userid, ts, k=1, max_distance=None):
+        """The k points nearest in time to `ts` (oldest first), at most `max_distance` seconds away."""
+        ts = float(ts)
+        with self._reading(userid) as s:
+            tl = s['timeline']
+            return self._k_nearest(tl, tl.rank(ts), ts, k, max_distance)
+
+    def search_nearest_many(self, userid, timestamps, k=1, max_distance=None):
+        """search_k_nearest for each of `timestamps` (non-decreasing), in one merged pass:
+        each lookup binary-searches only the part of the timestamp column past the previous one.
+        """
+        out = []
+        with self._reading(userid) as s:
+            tl = s['timeline']
+            col, n = tl.ts, len(tl)
+            right, prev = 0, None
+            for ts in timestamps:
+                ts = float(ts)
+                if prev is not None and ts < prev:
+                    raise ValueError('timestamps must be sorted')
+                prev = ts
+                right = bisect_left(col, ts, right, n)
+                out.append(self._k_nearest(tl, right, ts, k, max_distance))
+        return out
+
+    def count_range(self, userid, start_ts, end_ts):
+        """Number of points with start_ts <= timestamp <= end_ts, in O(log n)."""
+        with self._reading(userid) as s:
+            i, j = s['timeline'].range_indices(start_ts, end_ts)
+            return max(0, j - i)
+
+    def range_summary(self, userid, start_ts, end_ts):
+        """Count, first and last point and bounding box of a time window. The window is
+        found by binary search and its box combined from per-block bounds (see RangeBounds),
+        without materializing the points in between."""
+        with self._reading(userid) as s:
+            tl = s['timeline']
+            lo, hi = tl.range_indices(start_ts, end_ts)
+            if hi <= lo:
+                return {'count': 0, 'first': None, 'last': None, 'bbox': None}
+            return {'count': hi - lo, 'first': tl.point(lo), 'last': tl.point(hi - 1),
+                    'bbox': list(s['bounds'].bbox(lo, hi))}
+
+    def kth_in_range(self, userid, start_ts, end_ts, k):
+        """The k-th point (0-based; negative counts from the end) of a time window, or None."""
+        with self._reading(userid) as s:
+            tl = s['timeline']
+            lo, hi = tl.range_indices(start_ts, end_ts)
+            count = max(0, hi - lo)
+            if k < 0:
+                k += count
+            if not 0 <= k < count:
+                return None
+            return tl.point(lo + k)
+
+    def rank(self, userid, ts):
+        """Number of points with a timestamp before `ts`."""
+        with self._reading(userid) as s:
+            return s['timeline'].rank(ts)
+
+    def simplified(self, userid, zoom, start_ts=None, end_ts=None, max_points=MAX_SIMPLIFIED_POINTS):
+        """Timeline simplified for a map at `zoom` (cached per zoom level), optionally limited to a
+        time range, and coarsened further if needed to return at most `max_points` points."""
+        # refreshing the cache mutates it, so this takes the writer side
+        with self._writing(userid) as s:
+            if start_ts is not None or end_ts is not None:
+                start_ts = float('-inf') if start_ts is None else start_ts
+                end_ts = float('inf') if end_ts is None else end_ts
+            rows = s['simplified'].get_capped(zoom, max_points, start_ts, end_ts)
+            return s['timeline'].points(rows)
+
+    def rollup(self, userid, granularity, start_ts=None, end_ts=None):
+        """Aggregates for the `granularity` ('minute', 'hour' or 'day') buckets overlapping start..end."""
+        with self._reading(userid) as s:
+            return s['rollups'].query(granularity, start_ts, end_ts)
+
+    def search_bbox(self, userid, min_lat, min_lon, max_lat, max_lon, start_ts=None, end_ts=None):
+        with self._reading(userid) as s:
+            rows = s['spatial'].search_bbox(min_lat, min_lon, max_lat, max_lon, start_ts, end_ts)
+            return s['timeline'].points(rows)
+
+    def search_radius(self, userid, lat, lon, radius_km, start_ts=None, end_ts=None):
+        with self._reading(userid) as s:
+            out = []
+            for row, dist in s['spatial'].search_radius(lat, lon, radius_km, start_ts, end_ts):
+                d = s['timeline'].point(row)
+                d['distance_km'] = dist
+                out.append(d)
+            return out
+
+    def nearby_users(self, region, start_ts=None, end_ts=None):
+        """Users with points inside `region` (a presence.Box or Circle) between start and end,
+        as [{userid, count, first, last}], most points first. Cost follows the presence keys
+        the query overlaps; only users in cells on its edge have points read. Users whose
+        entries are not loaded are read PRESENCE_LOAD_BATCH at a time (see _presence_batch)
+        and searched in a per-batch index, without holding the store lock over the reads.
+        """
+        with self._lock:
+            found, partial = self.presence.search(region, start_ts, end_ts)
+            missing = [uid for uid in self.users if uid not in self.presence.by_user]
+        for uid, keys in partial.items():
+            self._count_in_region(found, uid, self.presence_points(uid, keys, start_ts, end_ts), region)
+        for i in range(0, len(missing), PRESENCE_LOAD_BATCH):
+            index = self._presence_batch(missing[i:i + PRESENCE_LOAD_BATCH])
+            batch_found, batch_partial = index.search(region, start_ts, end_ts)
+            found.update(batch_found)
+            for uid, keys in batch_partial.items():
+                points = self._points_in_keys(uid, set(keys), index.spans(uid, set(keys)), start_ts, end_ts)
+                self._count_in_region(found, uid, points, region)
+        out = [{'userid': uid, 'count': c, 'first': first, 'last': last} for uid, (c, first, last) in found.items()]
+        out.sort(key=lambda u: (-u['count'], u['userid']))
+        return out
+
+    @staticmethod
+    def _count_in_region(found, uid, points, region):
+        for p in points:
+            if not region.contains(p['lat'], p['lon']):
+                continue
+            acc = found.get(uid)
+            if acc is None:
+                found[uid] = [1, p['timestamp'], p['timestamp']]
+            else:
+                acc[0] += 1
+                acc[1] = min(acc[1], p['timestamp'])
+                acc[2] = max(acc[2], p['timestamp'])
+
+    def _presence_batch(self, userids):
+        """A PresenceIndex holding the given users' entries. Sidecars and segment headers are
+        read before the store lock is taken; under it each user is checked against its segment
+        (not rewritten meanwhile) and pending events, and kept in the store's index as well.
+        Users whose sidecar is stale are rebuilt one at a time, releasing the lock in between.
+        """
+        reads = [(uid, self._segment_header(uid)[0], read_presence(self._presence_path(uid))) for uid in userids]
+        index, stale = PresenceIndex(), []
+        with self._lock:
+            for uid, seg_seq, saved in reads:
+                if uid not in self.presence.by_user:
+                    saved = self._presence_outbox.get(uid) or saved
+                    pending = [rec for rec in self._pending.get(uid, ()) if rec['seq'] > seg_seq]
+                    if (saved is None or saved[0] != seg_seq or self._segment_seqs.get(uid, seg_seq) != seg_seq
+                            or any(rec['op'] in ('sync', 'retain') for rec in pending)):
+                        stale.append(uid)
+                        continue
+                    self._load_presence(uid, saved[1], pending)
+                index.load_rows(uid, self.presence.rows(uid))
+            self._enforce_budget()
+        for uid in stale:
+            with self._lock:
+                self._ensure_presence(uid)
+                index.load_rows(uid, self.presence.rows(uid))
+                self._enforce_budget()
+        return index
+
+    def _read_spans(self, userid, spans, start_ts=None, end_ts=None):
+        # persisted points in the given [first, last] spans, clipped to the window
+        for first, last in spans:
+            first = first if start_ts is None else max(first, start_ts)
+            last = last if end_ts is None else min(last, end_ts)
+            if first <= last:
+                yield from self._read_persisted(userid, first, last)
+
+    def presence_keys(self, userid, start_ts=None, end_ts=None):
+        """The (bucket, cell x, cell y) presence keys the user has points in, optionally
+        only those whose bucket overlaps start..end."""
+        with self._lock:
+            self._ensure_presence(userid)
+            return self.presence.keys(userid, start_ts, end_ts)
+
+    def presence_points(self, userid, keys, start_ts=None, end_ts=None):
+        """The user's points that fall in `keys` (and start..end), oldest first."""
+        keys = set(map(tuple, keys))
+        with self._lock:
+            self._ensure_presence(userid)
+            spans = self.presence.spans(userid, keys)
+        return self._points_in_keys(userid, keys, spans, start_ts, end_ts)
+
+    def _points_in_keys(self, userid, keys, spans, start_ts=None, end_ts=None):
+        key = self.presence.key
+        return [p for p in self._read_spans(userid, spans, start_ts, end_ts)
+                if key(p['timestamp'], p['lat'], p['lon']) in keys]
+
+    def co_location(self, userid, other, max_distance_km, max_gap_s, start_ts=None, end_ts=None):
+        """See presence.co_location()."""
+        return co_location(self, userid, other, max_distance_km, max_gap_s, start_ts, end_ts)
 
     def phone_to_userid(self, phone):
         return self.phone_map.get(phone)
 
     def userid_exists(self, userid):
         return userid in self.users
+
+    def userids(self):
+        return list(self.users)
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import atexit
+import threading
+
+
+class WriteAheadLog:
+    """Append-only JSON-lines log of store events with group commit.
+
+    Records are buffered and written + fsynced together, either once
+    `batch_size` records are pending or after `flush_interval` seconds, so a
+    burst of inserts costs one fsync instead of one per point. Every record
+    gets a monotonically increasing `seq`; snapshots remember the last seq they
+    contain so replay can skip records that were already compacted.
+    append() only buffers: the background flusher is the single thread that
+    writes records, so callers never wait on disk I/O while holding store locks.
+    """
+    def __init__(self, path, batch_size=64, flush_interval=0.05):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.seq = 0
+        self.records_since_checkpoint = 0
+        self._buf = []
+        self._f = None
+        self._lock = threading.Lock()
+        self._pending = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def replay(self, after_seq=0):
+        """Yield logged records with seq > after_seq, oldest first.
+        A torn final line (crash mid-write) ends the replay and is cut off the
+        file so later appends start on a clean line.
+        """
+        if not os.path.exists(self.path):
+            return
+        good_end = 0
+        with open(self.path, 'rb') as f:
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                try:
+                    rec = json.loads(raw)
+                except ValueError:
+                    break
+                good_end += len(raw)
+                self.seq = max(self.seq, rec.get('seq', 0))
+                self.records_since_checkpoint += 1
+                if rec.get('seq', 0) > after_seq:
+                    yield rec
+        if good_end < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_end)
+        self.seq = max(self.seq, after_seq)
+
+    def append(self, record):
+        with self._lock:
+            self.seq += 1
+            record['seq'] = self.seq
+            self._buf.append(json.dumps(record, separators=(',', ':')))
+            self.records_since_checkpoint += 1
+            self._pending.set()
+            return self.seq
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buf:
+            return
+        if self._f is None:
+            self._f = open(self.path, 'a', encoding='utf-8')
+        self._f.write('\n'.join(self._buf) + '\n')
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._buf.clear()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._pending.wait()
+            self._pending.clear()
+            if len(self._buf) < self.batch_size:
+                # let concurrent writers join this commit group
+                time.sleep(self.flush_interval)
+            self.flush()
+
+    def checkpoint(self, write_snapshot):
+        """Flush, let `write_snapshot(seq)` persist state up to `seq`, then truncate the log.
+        Appends from other threads wait until the checkpoint is done.
+        """
+        with self._lock:
+            self._flush_locked()
+            write_snapshot(self.seq)
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+            with open(self.path, 'w', encoding='utf-8'):
+                pass
+            self.records_since_checkpoint = 0
+
+    def close(self):
+        self.flush()
+        self._closed = True
+        self._pending.set()
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
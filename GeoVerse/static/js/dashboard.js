@@ -1,6 +1,8 @@
 // Dashboard polling and UI wiring
 const USERID = window.USERID || (window.USERID = document.getElementById('dashboard-root')?.dataset?.userid);
 const POLL_INTERVAL = 5000; // 5s
+let latestVersion = null;
+let streamOpen = false; // while the SSE stream is up, timers only act as a fallback
 
 function el(id){ return document.getElementById(id); }
 
@@ -8,6 +10,9 @@ async function fetchLatest(){
   const res = await fetch(`/api/latest-location?userid=${USERID}&count=5`);
   const j = await res.json();
   if(j.error){ console.error(j.error); return; }
+  // a 304 revalidation hands back the cached body; skip re-rendering it
+  if(j.version != null && j.version === latestVersion) return;
+  latestVersion = j.version;
   const latest = j.latest || [];
   if(latest.length>0){
     const cur = latest[latest.length-1];
@@ -97,6 +102,25 @@ function setStatusIndicator(online){
   }
 }
 
+// Subscribe to /api/stream; pushed events replace the polling round trips.
+function startStream(){
+  if(!window.EventSource) return;
+  const es = new EventSource(`/api/stream?userid=${USERID}`);
+  es.addEventListener('open', ()=>{ streamOpen = true; });
+  es.addEventListener('error', ()=>{ streamOpen = false; });
+  es.addEventListener('hello', ()=>{ fetchLatest(); fetchQueue(); fetchStatus(); });
+  es.addEventListener('location', ()=>{ fetchLatest(); });
+  es.addEventListener('queue', (ev)=>{
+    const j = JSON.parse(ev.data);
+    el('queue-count').textContent = j.count;
+    fetchQueue();
+  });
+  es.addEventListener('sync', ()=>{ fetchLatest(); fetchQueue(); });
+  // history was rewritten (retention downsampling): re-render even if the version looks familiar
+  es.addEventListener('reset', ()=>{ latestVersion = null; fetchLatest(); });
+  es.addEventListener('status', ()=>{ fetchStatus(); });
+}
+
 function init(){
   // wire buttons
   el('sync-btn').addEventListener('click', syncOffline);
@@ -116,7 +140,8 @@ function init(){
   }
   // initial load
   fetchLatest(); fetchQueue(); fetchStatus();
-  setInterval(()=>{ fetchLatest(); fetchQueue(); fetchStatus(); }, POLL_INTERVAL);
+  startStream();
+  setInterval(()=>{ if(!streamOpen){ fetchLatest(); fetchQueue(); fetchStatus(); } }, POLL_INTERVAL);
 }
 
 window.addEventListener('DOMContentLoaded', init);
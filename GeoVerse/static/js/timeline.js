@@ -1,9 +1,18 @@
 // timeline.js
 // Renders a timeline map using Leaflet and the /api/timeline endpoint.
 const TIMELINE_POLL = 5000;
+const TIMELINE_PAGE = 500; // newest points fetched per poll; older pages load on demand
+const MAX_MARKERS = 500; // only the newest points get a marker; the path still covers all of them
+const TRACK_REFRESH = 30000; // new points extend the path at once; the simplified track is refetched at most this often
 const USERID = window.USERID || document.getElementById('timeline-root')?.dataset?.userid;
 
 let map, markersLayer, polyline, markers = [], currentData = [];
+let olderPoints = [], olderCursor = null;
+let loadedPoints = [], timelineVersion = null;
+let streamOpen = false;
+let trackLatLngs = null; // server-simplified path for the current zoom level
+let trackEnd = -Infinity, trackTimer = null; // newest timestamp on the track; pending refetch
+let showingHistory = false; // false while search results are on the map
 
 function fmtTime(ts){ return new Date(ts*1000).toLocaleString(); }
 
@@ -39,6 +48,7 @@ function buildList(timeline){
       // find marker by timestamp and focus
       const m = markers.find(x=>x.ts == p.timestamp && x.lat == p.lat && x.lon == p.lon);
       if(m){ map.setView([m.lat, m.lon], 15, {animate:true}); m.leaflet.openPopup(); }
+      else map.setView([p.lat, p.lon], 15, {animate:true});
     });
     // keyboard accessibility: Enter/Space to activate, arrows to move
     li.addEventListener('keydown', (ev)=>{
@@ -59,23 +69,23 @@ function showToast(msg, timeout=2500){
   setTimeout(()=>{ t.style.display = 'none'; t.classList.remove('toast-fade'); }, timeout+300);
 }
 
-function renderTimeline(timeline){
+function renderTimeline(timeline, isHistory=false){
   clearMap();
+  showingHistory = isHistory;
   if(!timeline || timeline.length===0) return;
   // ensure chronological order (oldest->newest)
   timeline.sort((a,b)=>a.timestamp - b.timestamp);
   currentData = timeline;
-  const latlngs = [];
-  for(const p of timeline){
+  const latlngs = timeline.map(p => [p.lat, p.lon]);
+  for(const p of timeline.slice(-MAX_MARKERS)){
     const color = colorForSource(p.source);
     const marker = L.circleMarker([p.lat, p.lon], {radius:6, color:color, fillColor:color, fillOpacity:0.9});
     marker.bindPopup(`<b>${fmtTime(p.timestamp)}</b><br/>${Number(p.lat).toFixed(6)}, ${Number(p.lon).toFixed(6)}<br/>status: ${p.source}`);
     marker.ts = p.timestamp; marker.lat = p.lat; marker.lon = p.lon;
     marker.addTo(markersLayer);
     markers.push({ts:p.timestamp, lat:p.lat, lon:p.lon, leaflet:marker});
-    latlngs.push([p.lat, p.lon]);
   }
-  polyline = L.polyline(latlngs, {color:'#3b82f6', weight:3, opacity:0.8}).addTo(map);
+  polyline = L.polyline((isHistory && trackLatLngs) || latlngs, {color:'#3b82f6', weight:3, opacity:0.8}).addTo(map);
   // highlight latest
   const last = timeline[timeline.length-1];
   if(last){
@@ -106,14 +116,91 @@ function renderFullTimeline(timeline){
 
 async function loadTimeline(){
   try{
-    const res = await fetch(`/api/timeline?userid=${USERID}`);
+    // newest page, walked back from the DLL tail
+    const res = await fetch(`/api/timeline?userid=${USERID}&order=desc&limit=${TIMELINE_PAGE}`);
     const j = await res.json();
     if(j.error) return;
-    renderTimeline(j.timeline || []);
-    renderFullTimeline(j.timeline || []);
+    const recent = (j.timeline || []).slice().reverse();
+    if(olderPoints.length === 0) olderCursor = j.next_cursor;
+    const cutoff = recent.length ? recent[0].timestamp : Infinity;
+    const all = olderPoints.filter(p => p.timestamp < cutoff).concat(recent);
+    loadedPoints = all;
+    timelineVersion = j.version;
+    renderTimeline(all, true);
+    renderFullTimeline(all);
+    const olderBtn = document.getElementById('older-btn');
+    if(olderBtn) olderBtn.style.display = olderCursor == null ? 'none' : 'inline-block';
   }catch(e){ console.error('loadTimeline', e); }
 }
 
+// Fetch the whole history simplified for the current zoom and redraw the path with it.
+async function loadTrack(){
+  try{
+    const res = await fetch(`/api/timeline?userid=${USERID}&zoom=${map.getZoom()}`);
+    const j = await res.json();
+    if(j.error) return;
+    const track = j.timeline || [];
+    trackLatLngs = track.map(p => [p.lat, p.lon]);
+    trackEnd = track.length ? track[track.length-1].timestamp : -Infinity;
+    if(polyline && showingHistory) polyline.setLatLngs(trackLatLngs);
+  }catch(e){ console.error('loadTrack', e); }
+}
+
+// Refetch the simplified track once, TRACK_REFRESH from now, however many points arrive meanwhile.
+function scheduleTrack(){
+  if(trackTimer) return;
+  trackTimer = setTimeout(()=>{ trackTimer = null; loadTrack(); }, TRACK_REFRESH);
+}
+
+// The history was rewritten (e.g. downsampled by the retention compactor): drop every
+// cached page and reload from the newest one.
+function resetTimeline(){
+  olderPoints = [];
+  olderCursor = null;
+  timelineVersion = null;
+  loadTrack();
+  return loadTimeline();
+}
+
+function pointKey(p){ return `${p.timestamp}|${p.lat}|${p.lon}`; }
+
+// Poll only the points added or synced since the last version we rendered.
+// Unchanged timelines answer 304 and are not re-rendered.
+async function pollTimeline(){
+  if(timelineVersion == null) return loadTimeline();
+  try{
+    const res = await fetch(`/api/timeline?userid=${USERID}&since=${timelineVersion}`);
+    const j = await res.json();
+    if(j.error) return;
+    if(j.reset) return resetTimeline();
+    if(j.version === timelineVersion) return;
+    timelineVersion = j.version;
+    const known = new Set(loadedPoints.map(pointKey));
+    const fresh = (j.timeline || []).filter(p => !known.has(pointKey(p)));
+    if(fresh.length === 0) return;
+    // points past the end of the track extend it now; late (synced) ones wait for the refetch
+    if(trackLatLngs){
+      for(const p of fresh.slice().sort((a,b)=>a.timestamp - b.timestamp)){
+        if(p.timestamp > trackEnd){ trackLatLngs.push([p.lat, p.lon]); trackEnd = p.timestamp; }
+      }
+    }
+    scheduleTrack();
+    loadedPoints = loadedPoints.concat(fresh).sort((a,b)=>a.timestamp - b.timestamp);
+    renderTimeline(loadedPoints, true);
+    renderFullTimeline(loadedPoints);
+  }catch(e){ console.error('pollTimeline', e); }
+}
+
+async function loadOlder(){
+  if(olderCursor == null) return;
+  const res = await fetch(`/api/timeline?userid=${USERID}&order=desc&limit=${TIMELINE_PAGE}&before=${olderCursor}`);
+  const j = await res.json();
+  if(j.error) return;
+  olderPoints = (j.timeline || []).slice().reverse().concat(olderPoints);
+  olderCursor = j.next_cursor;
+  await loadTimeline();
+}
+
 function parseInputToEpoch(v){
   if(!v) return NaN;
   v = v.trim();
@@ -197,12 +284,16 @@ function initMap(){
   map = L.map('map').setView([17.3850,78.4867], 12);
   L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {maxZoom:19}).addTo(map);
   markersLayer = L.layerGroup().addTo(map);
+  map.on('zoomend', loadTrack);
 }
 
 function init(){
   initMap();
   loadTimeline();
+  loadTrack();
   document.getElementById('refresh-btn').addEventListener('click', loadTimeline);
+  const olderBtn = document.getElementById('older-btn');
+  if(olderBtn) olderBtn.addEventListener('click', loadOlder);
   document.getElementById('search-btn').addEventListener('click', doSearch);
   document.getElementById('nearest-btn').addEventListener('click', async ()=>{
     const raw = document.getElementById('search-ts').value.trim();
@@ -217,7 +308,16 @@ function init(){
     renderTimeline(j.results || []);
     showToast('Nearest result shown');
   });
-  setInterval(loadTimeline, TIMELINE_POLL);
+  if(window.EventSource){
+    // new and synced points are pushed; fall back to polling while the stream is down
+    const es = new EventSource(`/api/stream?userid=${USERID}`);
+    es.addEventListener('open', ()=>{ streamOpen = true; });
+    es.addEventListener('error', ()=>{ streamOpen = false; });
+    es.addEventListener('location', pollTimeline);
+    es.addEventListener('sync', pollTimeline);
+    es.addEventListener('reset', resetTimeline);
+  }
+  setInterval(()=>{ if(!streamOpen) pollTimeline(); }, TIMELINE_POLL);
 }
 
 window.addEventListener('DOMContentLoaded', init);
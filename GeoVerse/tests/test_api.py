@@ -0,0 +1,236 @@
+import os
+import sys
+import pytest
+
+GEOVERSE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    os.environ['GEOVERSE_STORAGE'] = str(tmp_path_factory.mktemp('store') / 'storage.json')
+    os.environ['GEOVERSE_GENERATOR'] = '0'
+    os.environ['GEOVERSE_COMPACTOR'] = '0'
+    # most tests use the legacy ?userid= access; test_sessions_are_required_by_default covers the default
+    os.environ['GEOVERSE_REQUIRE_SESSION'] = '0'
+    sys.path.insert(0, GEOVERSE_DIR)
+    import app as app_module
+    app_module.app.config['TESTING'] = True
+    yield app_module.app.test_client()
+    app_module.store.close()
+
+
+@pytest.fixture(scope='module')
+def userid(client):
+    import app as app_module
+    uid = app_module.store.reserve_user('+19990001')
+    for i in range(30):
+        app_module.store.insert_location(uid, 1e10 + i, float(i % 5), float(i), online=True)
+    return uid
+
+
+def test_timeline_pages_forward_and_backward(client, userid):
+    full = client.get(f'/api/timeline?userid={userid}').get_json()['timeline']
+    seen, cursor = [], None
+    while True:
+        url = f'/api/timeline?userid={userid}&limit=7'
+        if cursor is not None:
+            url += f'&after={cursor}'
+        body = client.get(url).get_json()
+        assert len(body['timeline']) <= 7
+        seen += body['timeline']
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert seen == full
+
+    newest = client.get(f'/api/timeline?userid={userid}&limit=3&order=desc').get_json()
+    assert newest['timeline'] == full[::-1][:3]
+    older = client.get(f'/api/timeline?userid={userid}&limit=3&order=desc&before={newest["next_cursor"]}').get_json()
+    assert older['timeline'] == full[::-1][3:6]
+
+
+def test_search_limit_and_latest(client, userid):
+    body = client.get(f'/api/search?userid={userid}&start={1e10 + 5}&end={1e10 + 20}&limit=4').get_json()
+    assert [p['timestamp'] for p in body['results']] == [1e10 + 5, 1e10 + 6, 1e10 + 7, 1e10 + 8]
+    assert body['next_cursor'] == 1e10 + 8
+    latest = client.get(f'/api/latest-location?userid={userid}&count=2').get_json()['latest']
+    assert [p['timestamp'] for p in latest] == [1e10 + 28, 1e10 + 29]
+    assert client.get(f'/api/timeline?userid={userid}&limit=0').status_code == 400
+
+
+def test_since_delta_and_etag_revalidation(client, userid):
+    import app as app_module
+    first = client.get(f'/api/timeline?userid={userid}')
+    etag = first.headers['ETag']
+    version = first.get_json()['version']
+    assert client.get(f'/api/timeline?userid={userid}', headers={'If-None-Match': etag}).status_code == 304
+    unchanged = client.get(f'/api/timeline?userid={userid}&since={version}').get_json()
+    assert unchanged['timeline'] == [] and not unchanged['reset']
+
+    app_module.store.insert_location(userid, 1e10 + 100, 1.0, 1.0)
+    app_module.store.insert_location(userid, 1e10 - 100, 2.0, 2.0, online=False)
+    app_module.store.sync_queue(userid)
+    assert client.get(f'/api/timeline?userid={userid}', headers={'If-None-Match': etag}).status_code == 200
+    delta = client.get(f'/api/timeline?userid={userid}&since={version}').get_json()
+    assert [p['timestamp'] for p in delta['timeline']] == [1e10 - 100, 1e10 + 100]
+    assert delta['version'] > version
+    assert client.get(f'/api/timeline?userid={userid}&since=1').get_json()['reset']
+
+    q = client.get(f'/api/offline-queue-count?userid={userid}')
+    assert client.get(f'/api/offline-queue-count?userid={userid}',
+                      headers={'If-None-Match': q.headers['ETag']}).status_code == 304
+
+
+def test_stream_pushes_new_points_and_status(client, userid):
+    import json
+    import app as app_module
+    resp = client.get(f'/api/stream?userid={userid}', buffered=False)
+    chunks = (c.decode() for c in resp.response)
+    assert next(chunks).startswith('event: hello')
+    app_module.store.insert_location(userid, 1e10 + 200, 3.0, 4.0)
+    event = next(chunks)
+    assert event.startswith('event: location')
+    assert json.loads(event.split('data: ', 1)[1])['point']['timestamp'] == 1e10 + 200
+    client.post('/api/set-online', json={'userid': userid, 'online': False})
+    assert next(chunks).startswith('event: status')
+    resp.close()
+    assert app_module.store.events.subscriber_count(userid) == 0
+
+
+def test_search_bbox_and_radius_endpoints(client, userid):
+    body = client.get(f'/api/search-bbox?userid={userid}&min_lat=0&min_lon=0&max_lat=2&max_lon=3').get_json()
+    assert body['results'] and all(0 <= p['lat'] <= 2 and 0 <= p['lon'] <= 3 for p in body['results'])
+    body = client.get(f'/api/search-radius?userid={userid}&lat=0&lon=0&radius_km=200&start={1e10}').get_json()
+    assert body['results'] and all(p['distance_km'] <= 200 and p['timestamp'] >= 1e10 for p in body['results'])
+    assert client.get(f'/api/search-radius?userid={userid}&lat=0&lon=0').status_code == 400
+
+
+def test_zoom_returns_simplified_track(client, userid):
+    full = client.get(f'/api/timeline?userid={userid}').get_json()['timeline']
+    coarse = client.get(f'/api/timeline?userid={userid}&zoom=0').get_json()
+    assert coarse['zoom'] == 0 and 2 <= len(coarse['timeline']) < len(full)
+    assert coarse['timeline'][0] == full[0] and coarse['timeline'][-1] == full[-1]
+    found = client.get(f'/api/search?userid={userid}&start={1e10}&end={1e10 + 29}&zoom=0').get_json()['results']
+    assert all(1e10 <= p['timestamp'] <= 1e10 + 29 for p in found)
+
+
+def test_ingest_applies_batch_and_rejects_bad_records(client):
+    import app as app_module
+    uid = app_module.store.reserve_user('+19990002')
+    points = [{'timestamp': 2e10 + i, 'lat': 1.0, 'lon': 2.0, 'online': i % 4 != 0} for i in range(200)][::-1]
+    body = client.post('/api/ingest', json={'userid': uid, 'points': points}).get_json()
+    assert (body['inserted'], body['queued']) == (150, 50)
+    ts = [p['timestamp'] for p in client.get(f'/api/timeline?userid={uid}').get_json()['timeline']]
+    assert ts == sorted(ts) and len(ts) == 150
+    assert client.get(f'/api/offline-queue-count?userid={uid}').get_json()['count'] == 50
+    bad = client.post('/api/ingest', json={'userid': uid, 'points': [[2e10, 'x', 0.0]]})
+    assert bad.status_code == 400 and 'point 0' in bad.get_json()['error']
+    assert client.post('/api/ingest', json={'userid': uid, 'points': {}}).status_code == 400
+
+
+def test_rollup_endpoint(client, userid):
+    body = client.get(f'/api/rollup?userid={userid}&granularity=minute&start=1e10').get_json()
+    points = client.get(f'/api/timeline?userid={userid}').get_json()['timeline']
+    assert sum(b['count'] for b in body['buckets']) == len([p for p in points if p['timestamp'] >= 1e10])
+    assert all(b['end'] - b['start'] == 60 for b in body['buckets'])
+    assert client.get(f'/api/rollup?userid={userid}&granularity=week').status_code == 400
+
+
+def test_search_aggregate_modes(client, userid):
+    base = f'/api/search?userid={userid}&start={1e10 + 5}&end={1e10 + 20}'
+    assert client.get(base + '&mode=count').get_json() == {'count': 16}
+    summary = client.get(base + '&mode=summary').get_json()
+    assert summary['count'] == 16
+    assert (summary['first']['timestamp'], summary['last']['timestamp']) == (1e10 + 5, 1e10 + 20)
+    assert summary['bbox'] == [0.0, 5.0, 4.0, 20.0]
+    assert client.get(base + '&mode=kth&k=3').get_json()['result']['timestamp'] == 1e10 + 8
+    assert client.get(base + '&mode=kth&k=-1').get_json()['result']['timestamp'] == 1e10 + 20
+    assert client.get(base + '&mode=kth&k=16').get_json()['result'] is None
+    assert client.get(base + f'&mode=rank&ts={1e10 + 9}').get_json()['rank'] == 4
+    assert client.get(base + '&mode=median').status_code == 400
+
+
+def test_k_nearest_and_batch_endpoint(client, userid):
+    body = client.get(f'/api/search-nearest?userid={userid}&ts={1e10 + 10.4}&k=3').get_json()
+    assert [p['timestamp'] for p in body['results']] == [1e10 + 9, 1e10 + 10, 1e10 + 11]
+    body = client.get(f'/api/search-nearest?userid={userid}&ts={1e10 + 10.4}&k=3&max_distance=0.5').get_json()
+    assert [p['timestamp'] for p in body['results']] == [1e10 + 10]
+    body = client.post('/api/search-nearest/batch',
+                       json={'userid': userid, 'timestamps': [1e10 + 2.2, 1e10 + 17.6], 'k': 2}).get_json()
+    assert [[p['timestamp'] for p in r] for r in body['results']] == [[1e10 + 2, 1e10 + 3], [1e10 + 17, 1e10 + 18]]
+    unsorted = client.post('/api/search-nearest/batch', json={'userid': userid, 'timestamps': [1e10 + 5, 1e10]})
+    assert unsorted.status_code == 400
+    assert client.get(f'/api/search-nearest?userid={userid}&ts=1e10&k=0').status_code == 400
+
+
+def test_login_sets_session_used_instead_of_userid(client):
+    import app as app_module
+    uid = app_module.store.create_user('+19990003', 'secret-pw')
+    assert client.post('/login', data={'login': '+19990003', 'password': 'nope'}).status_code == 401
+    resp = client.post('/login', data={'login': '+19990003', 'password': 'secret-pw'})
+    assert resp.status_code == 302 and resp.headers['Location'].endswith('/dashboard')
+    # the cookie alone identifies the user; naming someone else is refused
+    assert client.get('/api/user-status').status_code == 200
+    assert client.get(f'/api/user-status?userid={uid}').status_code == 200
+    assert client.get('/api/user-status?userid=someone-else').status_code == 400
+    client.post('/logout')
+    assert client.get('/api/user-status').status_code == 400
+
+    token = client.post('/api/session', json={'login': uid, 'password': 'secret-pw'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/timeline', headers=headers).status_code == 200
+    assert client.get('/api/timeline', headers={'Authorization': 'Bearer ' + token[:-2]}).status_code == 400
+
+
+def test_sessions_are_required_by_default(client, userid, monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, 'REQUIRE_SESSION', True)
+    assert client.get(f'/api/timeline?userid={userid}').status_code == 400
+    assert client.get('/api/store-stats').status_code == 401
+    uid = app_module.store.create_user('+19990004', 'stats-pw')
+    token = client.post('/api/session', json={'login': uid, 'password': 'stats-pw'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get(f'/api/timeline?userid={uid}', headers=headers).status_code == 200
+    assert 'sessions' in client.get('/api/store-stats', headers=headers).get_json()
+
+
+def test_export_streams_each_format(client, userid, monkeypatch):
+    import csv
+    import json
+    import app as app_module
+    monkeypatch.setattr(app_module, 'EXPORT_CHUNK', 4)
+    window = f'&start={1e10 + 3}&end={1e10 + 20}'
+    expected = client.get(f'/api/search?userid={userid}{window}').get_json()['results']
+    assert len(expected) == 18
+
+    resp = client.get(f'/api/export?userid={userid}&format=ndjson{window}')
+    assert resp.mimetype == 'application/x-ndjson' and resp.is_streamed
+    assert [json.loads(line) for line in resp.get_data(as_text=True).splitlines()] == expected
+
+    rows = list(csv.DictReader(client.get(f'/api/export?userid={userid}&format=csv{window}').get_data(as_text=True).splitlines()))
+    assert [(float(r['timestamp']), float(r['lat']), float(r['lon']), r['source']) for r in rows] == \
+        [(p['timestamp'], p['lat'], p['lon'], p['source']) for p in expected]
+
+    fc = json.loads(client.get(f'/api/export?userid={userid}&format=geojson{window}').get_data())
+    assert [f['geometry']['coordinates'] for f in fc['features']] == [[p['lon'], p['lat']] for p in expected]
+    empty = json.loads(client.get(f'/api/export?userid={userid}&format=geojson&start=0&end=1').get_data())
+    assert empty == {'type': 'FeatureCollection', 'features': []}
+    assert client.get(f'/api/export?userid={userid}&format=xml').status_code == 400
+
+
+def test_nearby_users_and_co_location_endpoints(client, userid):
+    import app as app_module
+    other = app_module.store.reserve_user('+19990077')
+    for i in range(10):
+        app_module.store.insert_location(other, 1e10 + i + 0.5, float(i % 5), float(i) + 0.0001, online=True)
+    body = client.get(f'/api/nearby-users?userid={userid}&min_lat=-1&min_lon=-1&max_lat=5&max_lon=5'
+                      f'&start={1e10}&end={1e10 + 100}').get_json()
+    assert body['users'] == [{'userid': other, 'count': 5, 'first': 1e10 + 0.5, 'last': 1e10 + 4.5}]
+    near = client.get(f'/api/nearby-users?userid={other}&lat=0&lon=0&radius_km=1&start={1e10}').get_json()
+    assert [u['userid'] for u in near['users']] == [userid]
+    assert client.get(f'/api/nearby-users?userid={userid}&lat=0').status_code == 400
+
+    eps = client.get(f'/api/co-location?userid={userid}&other={other}&max_distance_km=0.1&max_gap_s=1').get_json()
+    assert [(e['start'], e['end'], e['matches']) for e in eps['episodes']] == [(1e10, 1e10 + 9, 10)]
+    assert client.get(f'/api/co-location?userid={userid}&other=nobody').status_code == 400
+    assert client.get(f'/api/co-location?userid={userid}&other={other}&max_gap_s=1e9').status_code == 400
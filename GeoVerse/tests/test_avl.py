@@ -0,0 +1,82 @@
+import random
+from GeoVerse.data_structures.avl import AVLTree
+
+
+def check_balanced(node):
+    if node is None:
+        return 0
+    lh, rh = check_balanced(node.left), check_balanced(node.right)
+    assert abs(lh - rh) <= 1
+    assert node.height == 1 + max(lh, rh)
+    return node.height
+
+
+def test_iterative_insert_keeps_tree_balanced_and_ordered():
+    tree = AVLTree()
+    keys = [random.randint(0, 500) for _ in range(2000)]
+    for k in keys:
+        tree.insert(k, k)
+    check_balanced(tree.root)
+    assert [v for k, vs in ((n.key, n.values) for n in tree._inorder()) for v in vs] == sorted(keys)
+    assert tree.search_range(100, 200) == sorted(k for k in keys if 100 <= k <= 200)
+
+
+def test_sorted_inserts_do_not_hit_recursion_limit():
+    tree = AVLTree()
+    for i in range(20000):
+        tree.insert(i, i)
+    check_balanced(tree.root)
+    assert tree.root.height <= 16
+
+
+def test_build_sorted_matches_incremental_inserts():
+    keys = sorted(random.randint(0, 300) for _ in range(1000))
+    built = AVLTree.build_sorted((k, k) for k in keys)
+    check_balanced(built.root)
+    incremental = AVLTree()
+    for k in keys:
+        incremental.insert(k, k)
+    for start, end in [(0, 300), (10, 20), (299, 1000), (-5, -1)]:
+        assert built.search_range(start, end) == incremental.search_range(start, end)
+    assert built.find_nearest(150.4) == incremental.find_nearest(150.4)
+
+
+class Point:
+    def __init__(self, ts, lat, lon):
+        self.timestamp, self.lat, self.lon = ts, lat, lon
+
+
+def check_aggregates(node):
+    if node is None:
+        return 0
+    size = len(node.values) + check_aggregates(node.left) + check_aggregates(node.right)
+    assert node.size == size
+    return size
+
+
+def test_count_rank_kth_and_bbox_match_brute_force():
+    rng = random.Random(7)
+    points = [Point(rng.randint(0, 400), rng.uniform(-80, 80), rng.uniform(-170, 170)) for _ in range(1500)]
+    incremental = AVLTree(track_bbox=True)
+    for p in points:
+        incremental.insert(p.timestamp, p)
+    ordered = sorted(points, key=lambda p: p.timestamp)
+    built = AVLTree.build_sorted(((p.timestamp, p) for p in ordered), track_bbox=True)
+    for tree in (incremental, built):
+        check_balanced(tree.root)
+        assert check_aggregates(tree.root) == len(tree) == len(points)
+        keys = [v.timestamp for v in (tree.kth(i) for i in range(len(points)))]
+        assert keys == sorted(p.timestamp for p in points)
+        assert tree.kth(len(points)) is None and tree.kth(-1) is None
+        for _ in range(200):
+            start = rng.uniform(-20, 420)
+            end = start + rng.uniform(-10, 200)
+            inside = [p for p in points if start <= p.timestamp <= end]
+            assert tree.count_range(start, end) == len(inside)
+            assert tree.rank(start) == sum(p.timestamp < start for p in points)
+            box = tree.bbox_range(start, end)
+            if not inside:
+                assert box is None
+            else:
+                assert box == (min(p.lat for p in inside), min(p.lon for p in inside),
+                               max(p.lat for p in inside), max(p.lon for p in inside))
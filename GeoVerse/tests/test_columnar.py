@@ -0,0 +1,78 @@
+import random
+from GeoVerse.data_structures.columnar import ColumnarTimeline, RangeBounds
+from GeoVerse.data_structures.dll import DoublyLinkedList
+
+
+def test_append_insert_and_merge_stay_sorted():
+    rnd = random.Random(2)
+    tl = ColumnarTimeline()
+    dll = DoublyLinkedList()
+    for _ in range(200):
+        ts = rnd.uniform(0, 1000)
+        tl.append(ts, 1.0, 2.0, 'online')
+        dll.insert_sorted(ts, 1.0, 2.0, 'online')
+    late = sorted((rnd.uniform(0, 1000), 3.0, 4.0, 'synced') for _ in range(50))
+    rows = tl.merge_sorted(late)
+    for row in late:
+        dll.insert_sorted(*row)
+    assert tl.to_list() == dll.to_list()
+    # merge_sorted reports where each row landed
+    assert [(tl.ts[i], tl.src[i]) for i in rows] == [(row[0], 2) for row in late]
+
+
+def test_range_slice_is_zero_copy_and_survives_appends():
+    tl = ColumnarTimeline()
+    for i in range(10):
+        tl.append(float(i), i, -i)
+    view = tl.search_range(2, 5)
+    assert [p['timestamp'] for p in view.to_list()] == [2.0, 3.0, 4.0, 5.0]
+    assert view.timestamps.obj is tl.ts
+    # appending while a view is alive must not fail or disturb the view
+    tl.append(10.0, 0, 0)
+    tl.insert(2.5, 0, 0)
+    assert len(view) == 4 and len(tl) == 12
+    view.release()
+
+
+def test_footprint_is_25_bytes_per_point():
+    tl = ColumnarTimeline()
+    for i in range(1000):
+        tl.append(float(i), 0.0, 0.0)
+    assert tl.nbytes() == 25 * 1000
+
+
+def test_range_bounds_match_brute_force_through_late_points():
+    rnd = random.Random(4)
+    tl = ColumnarTimeline()
+    bounds = RangeBounds(tl, block=8)
+    for i in range(300):
+        row = tl.append(i + rnd.choice((0, 0, 0, -50)), rnd.uniform(-80, 80), rnd.uniform(-170, 170))
+        bounds.invalidate_from(row)
+        if i % 37 == 0:
+            rows = tl.merge_sorted(sorted((rnd.uniform(0, i), rnd.uniform(-80, 80), 0.0, 'synced') for _ in range(5)))
+            bounds.invalidate_from(rows[0])
+        lo = rnd.randrange(len(tl))
+        hi = rnd.randrange(lo, len(tl) + 1)
+        lats, lons = tl.lat[lo:hi], tl.lon[lo:hi]
+        expected = (min(lats), min(lons), max(lats), max(lons)) if hi > lo else None
+        assert bounds.bbox(lo, hi) == expected
+
+
+def test_dll_merge_sorted_matches_insert_sorted():
+    merged, reference = DoublyLinkedList(), DoublyLinkedList()
+    for i in range(0, 100, 2):
+        merged.append(float(i), 0.0, 0.0)
+        reference.append(float(i), 0.0, 0.0)
+    rnd = random.Random(3)
+    batch = sorted((rnd.uniform(-10, 110), 1.0, 1.0) for _ in range(40))
+    nodes = merged.merge_sorted(batch)
+    for ts, lat, lon in batch:
+        reference.insert_sorted(ts, lat, lon, 'synced')
+    assert merged.to_list() == reference.to_list()
+    assert len(merged) == len(reference) == 90
+    assert [n.timestamp for n in nodes] == [b[0] for b in batch]
+    back, cur = [], merged.tail
+    while cur:
+        back.append(cur.timestamp)
+        cur = cur.prev
+    assert back == sorted(back, reverse=True) and len(back) == 90
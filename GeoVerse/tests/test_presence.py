@@ -0,0 +1,154 @@
+import os
+import random
+import threading
+from GeoVerse.data_structures import user_store
+from GeoVerse.data_structures.user_store import UserStore, PRESENCE_BYTES_PER_ENTRY, RESIDENT_BYTES_PER_POINT
+from GeoVerse.data_structures.presence import Box, Circle, read_presence as user_store_read_presence
+from GeoVerse.data_structures.spatial import haversine_km
+
+T0 = 1e9
+
+
+def make_store(tmp_path):
+    return UserStore(storage_file=str(tmp_path / 'storage.json'))
+
+
+def populate(s, users=6, points=300, seed=3):
+    rnd = random.Random(seed)
+    uids = [s.reserve_user(f'+1300{i}') for i in range(users)]
+    for uid in uids:
+        for _ in range(points):
+            # a 0.05 degree square (5 x 5 presence cells) over about 5 hours
+            ts, lat, lon = T0 + rnd.uniform(0, 18000), 10 + rnd.uniform(0, 0.05), 20 + rnd.uniform(0, 0.05)
+            s.insert_location(uid, ts, lat, lon, online=rnd.random() < 0.8)
+        s.sync_queue(uid)
+    return uids
+
+
+def brute_nearby(s, region, start, end):
+    out = []
+    for uid in s.userids():
+        hits = [p['timestamp'] for p in s.timeline(uid)
+                if region.contains(p['lat'], p['lon']) and start <= p['timestamp'] <= end]
+        if hits:
+            out.append({'userid': uid, 'count': len(hits), 'first': min(hits), 'last': max(hits)})
+    return sorted(out, key=lambda u: (-u['count'], u['userid']))
+
+
+def brute_episodes(points, others, dist, gap):
+    episodes = []
+    for p in points:
+        ds = [haversine_km(p['lat'], p['lon'], q['lat'], q['lon']) for q in others
+              if abs(q['timestamp'] - p['timestamp']) <= gap]
+        ds = [d for d in ds if d <= dist]
+        if not ds:
+            continue
+        if not episodes or p['timestamp'] - episodes[-1][1] > gap:
+            episodes.append([p['timestamp'], p['timestamp'], 0, min(ds)])
+        ep = episodes[-1]
+        ep[1], ep[2], ep[3] = p['timestamp'], ep[2] + 1, min(ep[3], min(ds))
+    return episodes
+
+
+QUERIES = [
+    (Box(10.013, 20.007, 10.041, 20.036), T0 + 2000, T0 + 9000),
+    (Box(10.0, 20.0, 10.02, 20.03), T0, T0 + 7200),  # cell-aligned: answered from counts
+    (Circle(10.025, 20.025, 1.5), T0 + 3600, T0 + 14400),
+]
+
+
+def test_nearby_users_and_co_location_match_brute_force(tmp_path):
+    s = make_store(tmp_path)
+    uids = populate(s)
+    for region, start, end in QUERIES:
+        assert s.nearby_users(region, start, end) == brute_nearby(s, region, start, end)
+    assert s.nearby_users(Box(50, 50, 51, 51)) == []
+
+    a, b = uids[0], uids[1]
+    got = s.co_location(a, b, 0.3, 120, T0 + 1000, T0 + 15000)
+    window = [p for p in s.timeline(a) if T0 + 1000 <= p['timestamp'] <= T0 + 15000]
+    expected = brute_episodes(window, s.timeline(b), 0.3, 120)
+    assert got and [[e['start'], e['end'], e['matches'], e['min_distance_km']] for e in got] == expected
+    assert all(e['closest'][0]['timestamp'] - e['closest'][1]['timestamp'] <= 120 for e in got)
+    s.close()
+
+
+def test_presence_sidecars_are_loaded_lazily_and_rebuilt_when_missing(tmp_path):
+    s = make_store(tmp_path)
+    populate(s)
+    expected = [s.nearby_users(region, start, end) for region, start, end in QUERIES]
+    s.close()
+    sidecars = list((tmp_path / 'storage.segments').glob('*.presence'))
+    assert len(sidecars) == len(s.users)
+
+    # sidecars from the last compaction plus the replayed log (including syncs)
+    s2 = make_store(tmp_path)
+    assert not s2.presence.by_user
+    assert [s2.nearby_users(*q) for q in QUERIES] == expected
+    s2._save()
+    s2.close()
+    s3 = make_store(tmp_path)
+    a, b = s3.userids()[:2]
+    s3.presence_keys(a)
+    assert set(s3.presence.by_user) == {a}
+    assert [s3.nearby_users(*q) for q in QUERIES] == expected
+    assert not s3.structs
+    s3.close()
+
+    for path in sidecars:
+        os.remove(str(path))
+    s4 = make_store(tmp_path)
+    assert [s4.nearby_users(*q) for q in QUERIES] == expected
+    hour = int(T0 // 3600) + 1
+    assert s4.presence_keys(a, hour * 3600, hour * 3600 + 1) == [k for k in s4.presence_keys(a) if k[0] == hour]
+    assert not s4.structs
+    s4.close()
+
+
+def test_presence_is_dropped_on_eviction_and_counted_in_the_budget(tmp_path):
+    s = make_store(tmp_path)
+    uids = populate(s)
+    expected = [s.nearby_users(*q) for q in QUERIES]
+    entries = max(len(keys) for keys in s.presence.by_user.values())
+    points = max(len(s.timeline(uid)) for uid in uids)
+    s.close()
+
+    # room for one resident user with its presence, and half of another user's presence
+    budget = points * RESIDENT_BYTES_PER_POINT + int(1.5 * entries * PRESENCE_BYTES_PER_ENTRY)
+    s = UserStore(storage_file=str(tmp_path / 'storage.json'), memory_budget=budget)
+    s.presence_keys(uids[0])
+    assert set(s.presence.by_user) == {uids[0]}
+    s.get_structs(uids[1])
+    # a cold user's entries go first
+    assert set(s.presence.by_user) == {uids[1]} and s.cache_stats()['estimated_bytes'] <= budget
+    s.evict(uids[1])
+    assert not s.presence.by_user
+    s.get_structs(uids[1])
+    s.get_structs(uids[2])
+    assert list(s.structs) == [uids[2]] and set(s.presence.by_user) == {uids[2]}
+    assert [s.nearby_users(*q) for q in QUERIES] == expected
+    s.close()
+
+
+def test_first_nearby_query_reads_sidecars_outside_the_store_lock(tmp_path, monkeypatch):
+    s = make_store(tmp_path)
+    populate(s)
+    expected = [s.nearby_users(*q) for q in QUERIES]
+    s._save()
+    s.close()
+
+    s = make_store(tmp_path)
+    held = []
+
+    def read_presence(path):
+        # the store lock is reentrant, so try it from another thread
+        probe = threading.Thread(target=lambda: held.append(not s._lock.acquire(timeout=1) or s._lock.release()))
+        probe.start()
+        probe.join()
+        return user_store_read_presence(path)
+
+    monkeypatch.setattr(user_store, 'read_presence', read_presence)
+    monkeypatch.setattr(user_store, 'PRESENCE_LOAD_BATCH', 4)
+    assert [s.nearby_users(*q) for q in QUERIES] == expected
+    assert held and not any(held)
+    s.close()
@@ -0,0 +1,23 @@
+from GeoVerse.data_structures.pubsub import EventBroker
+
+
+def test_fan_out_to_all_subscribers_of_a_key():
+    broker = EventBroker()
+    a, b, other = broker.subscribe('u1'), broker.subscribe('u1'), broker.subscribe('u2')
+    broker.publish('u1', {'n': 1})
+    assert a.get(timeout=0.1) == {'n': 1}
+    assert b.get(timeout=0.1) == {'n': 1}
+    assert other.get(timeout=0.01) is None
+
+
+def test_slow_subscriber_is_dropped_without_blocking_publish():
+    broker = EventBroker(buffer_size=3)
+    slow, fast = broker.subscribe('u'), broker.subscribe('u')
+    for i in range(10):
+        broker.publish('u', {'n': i})
+        assert fast.get(timeout=0.1) == {'n': i}
+    assert slow.closed
+    assert broker.subscriber_count('u') == 1
+    # the dropped subscriber can still drain what it had buffered
+    assert [slow.get()['n'] for _ in range(3)] == [0, 1, 2]
+    assert slow.get(timeout=0.01) is None
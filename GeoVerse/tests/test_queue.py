@@ -0,0 +1,57 @@
+import os
+import pytest
+from GeoVerse.data_structures.queue_ds import QueueDS, QueueFull, SPILL_RECORD
+
+
+def entry(i):
+    return {'timestamp': float(i), 'lat': 1.0, 'lon': 2.0, 'source': 'offline'}
+
+
+def test_spills_past_window_and_drains_in_order(tmp_path):
+    path = str(tmp_path / 'u.spill')
+    q = QueueDS(spill_path=path, window=8)
+    for i in range(50):
+        q.enqueue(entry(i))
+    assert len(q) == 50 and len(q._dq) == 8 and os.path.getsize(path) > 0
+    assert [e['timestamp'] for e in q] == list(range(50))  # iterating does not consume
+    assert q.dequeue()['timestamp'] == 0
+    chunks = list(q.drain(20))
+    assert [len(c) for c in chunks] == [20, 20, 9]
+    assert [e['timestamp'] for c in chunks for e in c] == list(range(1, 50))
+    assert len(q) == 0 and os.path.getsize(path) == 0
+    q.enqueue(entry(7))
+    assert q.take(5) == [entry(7)]
+    q.close()
+    assert not os.path.exists(path)
+
+
+def test_capacity_policies(tmp_path):
+    q = QueueDS(capacity=10, spill_path=str(tmp_path / 'a.spill'), window=4)
+    for i in range(25):
+        q.enqueue(entry(i))
+    assert [e['timestamp'] for e in q] == list(range(15, 25)) and q.dropped == 15
+    q.capacity = 4  # e.g. reopened with a smaller capacity
+    assert q.enqueue(entry(25)) == 7 and [e['timestamp'] for e in q] == [22, 23, 24, 25]
+
+    q = QueueDS(capacity=3, policy='reject')
+    for i in range(3):
+        q.enqueue(entry(i))
+    with pytest.raises(QueueFull):
+        q.enqueue(entry(3))
+    assert len(q) == 3
+    with pytest.raises(ValueError):
+        QueueDS(policy='block')
+
+
+def test_spill_file_stays_bounded_at_capacity(tmp_path):
+    path = str(tmp_path / 'u.spill')
+    q = QueueDS(capacity=200, spill_path=path, window=16)
+    for i in range(20000):
+        q.enqueue(entry(i))
+        if q._spill is not None:
+            q._spill.flush()
+            assert os.path.getsize(path) <= 2 * 200 * SPILL_RECORD.size
+    assert q.dropped == 19800 and [e['timestamp'] for e in q] == list(range(19800, 20000))
+    assert [e['timestamp'] for c in q.drain(50) for e in c] == list(range(19800, 20000))
+    assert os.path.getsize(path) == 0
+    q.close()
@@ -0,0 +1,46 @@
+import random
+import pytest
+from GeoVerse.data_structures.columnar import ColumnarTimeline
+from GeoVerse.data_structures.rollup import RollupIndex
+from GeoVerse.data_structures.spatial import haversine_km
+
+
+def assert_same(a, b):
+    assert len(a) == len(b)
+    for x, y in zip(a, b):
+        assert x['distance_km'] == pytest.approx(y['distance_km'], abs=1e-6)
+        x, y = dict(x), dict(y)
+        del x['distance_km'], y['distance_km']
+        assert x == y
+
+
+def test_incremental_rollups_match_rebuild_with_late_points():
+    rnd = random.Random(7)
+    tl = ColumnarTimeline()
+    index = RollupIndex(tl)
+    for i in range(300):
+        index.add_rows([tl.append(1e9 + i * 37.0, rnd.uniform(-5, 5), rnd.uniform(-5, 5))])
+    for _ in range(40):  # single late points
+        index.add_rows([tl.append(1e9 + rnd.uniform(0, 300 * 37.0), rnd.uniform(-5, 5), rnd.uniform(-5, 5))])
+    for _ in range(5):  # synced batches, some landing before the head, some in runs
+        batch = sorted((1e9 + rnd.uniform(-3600, 300 * 37.0), rnd.uniform(-5, 5), rnd.uniform(-5, 5), 'synced')
+                       for _ in range(30))
+        index.add_rows(tl.merge_sorted(batch))
+    rebuilt = RollupIndex.build(tl)
+    for granularity in ('minute', 'hour', 'day'):
+        assert_same(index.query(granularity), rebuilt.query(granularity))
+    points = tl.to_list()
+    total = sum(haversine_km(a['lat'], a['lon'], b['lat'], b['lon']) for a, b in zip(points, points[1:]))
+    assert sum(b['distance_km'] for b in index.query('day')) == pytest.approx(total)
+    assert sum(b['count'] for b in index.query('hour')) == len(tl)
+
+
+def test_query_returns_overlapping_buckets_only():
+    tl = ColumnarTimeline()
+    index = RollupIndex(tl)
+    for ts in (3600.0, 3700.0, 7300.0, 90000.0):
+        index.add_rows([tl.append(ts, 1.0, 1.0)])
+    hours = index.query('hour', 3650.0, 7300.0)
+    assert [(b['start'], b['count']) for b in hours] == [(3600, 2), (7200, 1)]
+    assert hours[0]['first']['timestamp'] == 3600.0 and hours[0]['last']['timestamp'] == 3700.0
+    assert [b['count'] for b in index.query('day')] == [3, 1]
@@ -0,0 +1,58 @@
+import time
+import threading
+from collections import Counter
+from GeoVerse.data_structures.scheduler import Scheduler
+
+
+def test_due_keys_pop_in_order_in_batches_and_reschedule():
+    now = [100.0]
+    sched = Scheduler(lambda keys: None, batch_size=3, clock=lambda: now[0])
+    for i, key in enumerate('abcde'):
+        sched.add(key, interval=10.0, first_due=100.0 - i)
+    sched.add('later', interval=10.0, first_due=105.0)
+    assert [k for k, _ in sched._pop_due(now[0])] == ['e', 'd', 'c']
+    assert [k for k, _ in sched._pop_due(now[0])] == ['b', 'a']
+    assert sched._pop_due(now[0]) == []
+    sched.remove('later')
+    now[0] = 105.5
+    assert sched._pop_due(now[0]) == []
+    # a key far behind skips the missed ticks instead of firing them all
+    now[0] = 150.0
+    assert len(sched._pop_due(now[0])) == 3
+    assert sched.skipped > 0
+
+
+def test_rate_per_key_is_independent_of_key_count():
+    runs, now = Counter(), [0.0]
+    sched = Scheduler(runs.update, workers=2, batch_size=16, clock=lambda: now[0])
+    for i in range(200):
+        sched.add(i, interval=0.05, first_due=0.0)
+    for _ in range(10):
+        assert sched.tick() == 200
+        now[0] += 0.05
+    assert sched.tick() == 200
+    assert all(runs[i] == 11 for i in range(200))
+    # a tick a second late catches each key up once instead of replaying 20 missed intervals
+    now[0] += 1.0
+    assert sched.tick() == 400 and sched.skipped >= 200 * 15
+    m = sched.metrics()
+    assert m['dispatched'] == sum(runs.values()) == 2600 and m['keys'] == 200
+    assert 0 <= m['lag_avg'] <= m['lag_p95'] <= m['lag_max']
+    sched.stop()
+
+
+def test_started_scheduler_runs_due_keys():
+    runs, done = Counter(), threading.Event()
+
+    def job(keys):
+        runs.update(keys)
+        if runs['b']:
+            done.set()
+
+    sched = Scheduler(job, workers=1)
+    sched.add('a', interval=60.0, first_due=time.monotonic())
+    sched.add('b', interval=60.0, first_due=time.monotonic())
+    sched.start()
+    assert done.wait(5)
+    sched.stop()
+    assert runs == {'a': 1, 'b': 1}
@@ -0,0 +1,92 @@
+import time
+import threading
+import pytest
+from GeoVerse.data_structures.sessions import SessionManager, LoginBusy, TTLCache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_tokens_verify_expire_and_reject_tampering():
+    clock = Clock()
+    sm = SessionManager('secret', ttl=60, clock=clock)
+    token = sm.issue('u1')
+    assert sm.verify(token) == 'u1'
+    # a fresh manager has nothing cached, so this exercises the HMAC path
+    other = SessionManager('secret', ttl=60, clock=clock)
+    assert other.verify(token) == 'u1'
+    assert SessionManager('other-secret', clock=clock).verify(token) is None
+    payload, _, sig = token.rpartition('.')
+    assert other.verify(payload.replace('u1', 'u2') + '.' + sig) is None
+    assert other.verify('garbage') is None and other.verify('') is None
+    sm.revoke(token)
+    assert sm.verify(token) is None
+    clock.now += 61
+    assert other.verify(token) is None
+    sm.close()
+    other.close()
+
+
+def test_revocations_outlive_cache_eviction_until_expiry():
+    clock = Clock()
+    sm = SessionManager('secret', ttl=60, cache_size=3, clock=clock)
+    victim = sm.issue('victim')
+    sm.revoke(victim)
+    for i in range(10):
+        sm.revoke(sm.issue(f'u{i}'))
+    assert sm.verify(victim) is None
+    clock.now += 61
+    sm.revoke(sm.issue('late'))  # prunes the expired revocations
+    assert sm.stats()['revoked'] == 1 and sm.verify(victim) is None
+    sm.close()
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    clock = Clock()
+    cache = TTLCache(2, ttl=10, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1
+    clock.now += 11
+    assert cache.get('a') is None and cache.evictions == 1
+
+
+def test_login_caches_success_and_bounds_pending_checks():
+    calls = []
+    release = threading.Event()
+
+    def authenticate(login, password):
+        calls.append(login)
+        if login == 'slow':
+            release.wait()
+        return 'uid-' + login if password == 'pw' else None
+
+    sm = SessionManager('secret', workers=1, max_pending=1)
+    assert sm.login(authenticate, 'alice', 'pw') == 'uid-alice'
+    assert sm.login(authenticate, 'alice', 'pw') == 'uid-alice'
+    assert calls == ['alice']
+    assert sm.login(authenticate, 'alice', 'wrong') is None
+    sm.forget_user('uid-alice')
+    sm.login(authenticate, 'alice', 'pw')
+    assert calls.count('alice') == 3
+
+    # one login running and one queued fill the pool; a third is turned away
+    threads = [threading.Thread(target=sm.login, args=(authenticate, 'slow', 'pw')) for _ in range(2)]
+    for t in threads:
+        t.start()
+    while sm._slots._value:
+        time.sleep(0.001)
+    with pytest.raises(LoginBusy):
+        sm.login(authenticate, 'bob', 'pw')
+    release.set()
+    for t in threads:
+        t.join()
+    assert sm.login(authenticate, 'bob', 'pw') == 'uid-bob'
+    sm.close()
@@ -0,0 +1,55 @@
+import pytest
+from GeoVerse.data_structures.sharding import ShardRouter, shard_for
+
+
+@pytest.fixture
+def router(tmp_path):
+    r = ShardRouter(3, str(tmp_path), memory_budget=None)
+    yield r
+    r.close()
+
+
+def test_users_spread_over_shards_and_calls_pipeline(router):
+    uids = [router.reserve_user(f'+3{i:03d}') for i in range(12)]
+    assert len({shard_for(uid, 3) for uid in uids}) > 1
+    # pipelined: every request is in flight before the first result is read
+    futures = [router.submit(uid, 'insert_location', 1e10 + i, 1.0, 2.0) for i in range(50) for uid in uids]
+    points = [f.result() for f in futures]
+    assert [p['timestamp'] for p in points] == [1e10 + i for i in range(50) for _ in uids]
+    for uid in uids:
+        pts = router.timeline(uid)
+        assert [p['timestamp'] for p in pts] == [1e10 + i for i in range(50)]
+    assert router.cache_stats()['resident_points'] == 12 * 50
+    assert sorted(router.userids()) == sorted(uids)
+
+
+def test_accounts_are_unique_across_shards(router):
+    uid = router.reserve_user('+4000')
+    with pytest.raises(ValueError):
+        router.reserve_user('+4000')
+    router.set_password_for_user(uid, 'pw')
+    assert router.authenticate('+4000', 'pw') == uid
+    assert router.authenticate(uid, 'pw') == uid
+    assert router.authenticate('+4000', 'nope') is None
+    assert router.userid_exists(uid) and not router.userid_exists('missing')
+
+
+def test_events_are_forwarded_from_shards(router):
+    uid = router.reserve_user('+5000')
+    sub = router.events.subscribe(uid)
+    router.insert_location(uid, 1e10, 1.0, 1.0)
+    event = sub.get(timeout=5)
+    assert event['type'] == 'location' and event['point']['timestamp'] == 1e10
+    router.events.unsubscribe(sub)
+
+
+def test_shard_data_survives_restart(tmp_path):
+    r = ShardRouter(2, str(tmp_path))
+    uids = [r.reserve_user(f'+6{i:03d}') for i in range(6)]
+    for uid in uids:
+        r.insert_many(uid, [(1e10 + i, 0.0, 0.0) for i in range(20)])
+    expected = {uid: r.timeline(uid) for uid in uids}
+    r.close()
+    r = ShardRouter(2, str(tmp_path))
+    assert {uid: r.timeline(uid) for uid in uids} == expected
+    r.close()
@@ -0,0 +1,54 @@
+import math
+from GeoVerse.data_structures.columnar import ColumnarTimeline
+from GeoVerse.data_structures.simplify import SimplificationCache, douglas_peucker, tolerance_for_zoom, thin
+
+
+def zigzag(tl, start, n):
+    for i in range(start, start + n):
+        tl.append(float(i), math.sin(i / 5.0), i * 0.01)
+
+
+def test_douglas_peucker_keeps_endpoints_and_respects_tolerance():
+    lats = [0.0001 * (i % 2) for i in range(1000)]
+    lons = [i * 0.001 for i in range(1000)]
+    assert douglas_peucker(lats, lons, 0.001) == [0, 999]
+
+
+def test_cache_matches_full_recompute_after_appends_and_late_points():
+    tl = ColumnarTimeline()
+    zigzag(tl, 0, 300)
+    cache = SimplificationCache(tl)
+    tol = tolerance_for_zoom(8)
+    coarse = cache.get(8)
+    assert len(coarse) < len(tl)
+    zigzag(tl, 300, 50)
+    cache.invalidate_from(300)
+    kept = cache.get(8)
+    assert kept[-1] == len(tl) - 1
+    # incremental re-simplification stays close to a full recompute
+    full = douglas_peucker(tl.lat, tl.lon, tol)
+    assert abs(len(kept) - len(full)) <= 4
+    late = tl.merge_sorted([(10.5, 5.0, 5.0, 'synced')])
+    cache.invalidate_from(late[0])
+    assert late[0] in cache.get(8)
+    assert [tl.ts[r] for r in cache.get_range(8, 100, 200)] == \
+        [tl.ts[r] for r in cache.get(8) if 100 <= tl.ts[r] <= 200]
+
+
+def test_capped_output_coarsens_until_it_fits():
+    tl = ColumnarTimeline()
+    zigzag(tl, 0, 2000)
+    cache = SimplificationCache(tl)
+    last = len(tl) - 1
+    assert len(cache.get(18)) > 500
+    capped = cache.get_capped(18, 500)
+    assert 2 <= len(capped) <= 500 and capped[0] == 0 and capped[-1] == last
+    # the finest level that fits: the next finer one does not
+    z = next(z for z in range(18, -1, -1) if len(cache.get(z)) <= 500)
+    assert capped == cache.get(z) and len(cache.get(z + 1)) > 500
+    # past what even zoom 0 keeps, the points are thinned
+    few = cache.get_capped(18, 50)
+    assert len(few) == 50 and few[0] == 0 and few[-1] == last
+    ranged = cache.get_capped(18, 10, 500.0, 1500.0)
+    assert len(ranged) <= 10 and all(500 <= tl.ts[r] <= 1500 for r in ranged)
+    assert thin(list(range(10)), 4) == [0, 3, 6, 9] and thin([1, 2], 5) == [1, 2]
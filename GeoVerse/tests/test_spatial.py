@@ -0,0 +1,36 @@
+import random
+from GeoVerse.data_structures.columnar import ColumnarTimeline
+from GeoVerse.data_structures.spatial import GridIndex, haversine_km
+
+
+def build(n=2000, seed=7):
+    rnd = random.Random(seed)
+    tl = ColumnarTimeline()
+    for i in range(n):
+        # pairs of points share a timestamp, mostly in different cells
+        tl.append(float(i // 2), rnd.uniform(-80, 80), rnd.uniform(-180, 180))
+    return tl, GridIndex.build(tl, cell_deg=2.0)
+
+
+def test_bbox_matches_brute_force_including_antimeridian_and_window():
+    tl, index = build()
+    for box in [(-10, -20, 10, 20), (30, 170, 60, -170), (-80, -180, 80, 180)]:
+        min_lat, min_lon, max_lat, max_lon = box
+        def inside(p):
+            lon_ok = (min_lon <= p['lon'] <= max_lon) if min_lon <= max_lon else (p['lon'] >= min_lon or p['lon'] <= max_lon)
+            return min_lat <= p['lat'] <= max_lat and lon_ok and 100 <= p['timestamp'] <= 900
+        expected = [i for i, p in enumerate(tl.to_list()) if inside(p)]
+        assert index.search_bbox(*box, start=100, end=900) == expected
+
+
+def test_radius_matches_brute_force():
+    tl, index = build()
+    got = index.search_radius(45.0, 179.0, 1500.0)
+    expected = [i for i, p in enumerate(tl.to_list()) if haversine_km(45.0, 179.0, p['lat'], p['lon']) <= 1500.0]
+    assert [r for r, _ in got] == expected
+    assert all(d <= 1500.0 for _, d in got)
+
+
+def test_haversine_known_distance():
+    # Paris -> London is roughly 344 km
+    assert abs(haversine_km(48.8566, 2.3522, 51.5074, -0.1278) - 343.5) < 2
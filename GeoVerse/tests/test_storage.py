@@ -0,0 +1,403 @@
+import os
+import json
+import random
+import pytest
+from GeoVerse.data_structures import user_store
+from GeoVerse.data_structures.user_store import UserStore
+from GeoVerse.data_structures.segment import HEADER, RECORD
+from GeoVerse.data_structures.retention import parse_retention, DEFAULT_RETENTION
+
+
+def make_store(tmp_path, **kw):
+    return UserStore(storage_file=str(tmp_path / 'storage.json'), **kw)
+
+
+def test_log_replay_restores_timeline_and_queue(tmp_path):
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+1000')
+    s.insert_location(uid, 100.0, 1.0, 2.0, online=True)
+    s.insert_location(uid, 50.0, 3.0, 4.0, online=False)
+    s.insert_location(uid, 60.0, 5.0, 6.0, online=False)
+    s.sync_queue(uid)
+    s.insert_location(uid, 70.0, 7.0, 8.0, online=False)
+    expected = s.timeline(uid)
+    s.close()
+
+    s2 = make_store(tmp_path)
+    assert s2.timeline(uid) == expected
+    assert len(s2.get_structs(uid)['queue']) == 1
+    s2.close()
+
+
+def test_insert_does_not_rewrite_snapshot(tmp_path):
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+1001')
+    before = os.path.getmtime(tmp_path / 'storage.json')
+    size = os.path.getsize(tmp_path / 'storage.json')
+    for i in range(20):
+        s.insert_location(uid, 1000.0 + i, 0.0, 0.0)
+    s.flush()
+    assert os.path.getmtime(tmp_path / 'storage.json') == before
+    assert os.path.getsize(tmp_path / 'storage.json') == size
+    s.close()
+
+
+def test_torn_log_tail_is_ignored(tmp_path):
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+1002')
+    s.insert_location(uid, 1e10, 1.0, 1.0)
+    s.close()
+    with open(tmp_path / 'storage.log', 'a', encoding='utf-8') as f:
+        f.write('{"op":"loc","uid":"%s","ts":1' % uid)
+
+    s2 = make_store(tmp_path)
+    assert [p['timestamp'] for p in s2.timeline(uid)][-1] == 1e10
+    s2.insert_location(uid, 2e10, 2.0, 2.0)
+    s2.close()
+    s3 = make_store(tmp_path)
+    assert [p['timestamp'] for p in s3.timeline(uid)][-1] == 2e10
+    s3.close()
+
+
+def test_compaction_writes_snapshot_and_truncates_log(tmp_path):
+    s = make_store(tmp_path, compact_every=10)
+    uid = s.reserve_user('+1003')
+    for i in range(25):
+        s.insert_location(uid, 1000.0 + i, 0.0, 0.0)
+    s.close()
+    with open(tmp_path / 'storage.json', encoding='utf-8') as f:
+        snap = json.load(f)
+    assert snap['log_seq'] > 0
+    with open(tmp_path / 'storage.log', encoding='utf-8') as f:
+        assert len(f.readlines()) < 10
+
+    s2 = make_store(tmp_path)
+    # the user was never materialized, so no placeholder location was added
+    assert len(s2.timeline(uid)) == 25
+    s2.close()
+
+
+def test_sync_queue_merges_backlog_and_indexes_it(tmp_path):
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+1004')
+    for i in range(50):
+        s.insert_location(uid, 1e10 + i * 10, 0.0, 0.0)
+    for i in range(200):
+        s.insert_location(uid, 1e10 + i * 2.5 + 0.1, 1.0, 1.0, online=False)
+    synced = s.sync_queue(uid)
+    assert len(synced) == 200
+    ts = [p['timestamp'] for p in s.timeline(uid)]
+    assert ts == sorted(ts)
+    assert len(s.search_range(uid, 1e10, 1e10 + 1000)) == 250
+    s.close()
+
+
+def test_page_never_splits_equal_timestamps(tmp_path):
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+1005')
+    for ts in [1e10, 1e10 + 1, 1e10 + 1, 1e10 + 1, 1e10 + 2]:
+        s.insert_location(uid, ts, 0.0, 0.0)
+    points, cursor = s.page(uid, after=1e10 - 1, limit=2)
+    assert [p['timestamp'] for p in points] == [1e10, 1e10 + 1, 1e10 + 1, 1e10 + 1]
+    rest, end = s.page(uid, after=cursor, limit=2)
+    assert [p['timestamp'] for p in rest] == [1e10 + 2] and end is None
+    s.close()
+
+
+def test_startup_reads_only_the_index_and_loads_users_lazily(tmp_path):
+    s = make_store(tmp_path, compact_every=5)
+    uids = [s.reserve_user(f'+2000{i}') for i in range(3)]
+    for uid in uids:
+        for i in range(7):
+            s.insert_location(uid, 1e10 + i, 1.0, 2.0)
+    s.insert_location(uids[0], 1e10 - 5, 3.0, 4.0, online=False)
+    expected = {uid: s.timeline(uid) for uid in uids}
+    s.close()
+    with open(tmp_path / 'storage.json', encoding='utf-8') as f:
+        assert set(json.load(f)) == {'users', 'phone_map', 'log_seq'}
+
+    s2 = make_store(tmp_path)
+    assert s2.timelines == {} and s2.structs == {}
+    assert s2.timeline(uids[1]) == expected[uids[1]]
+    # a user whose segment is current is read from the mapped file; nothing is loaded
+    assert s2.search_range(uids[1], 1e10 + 2, 1e10 + 4) == expected[uids[1]][2:5]
+    assert s2.timelines == {} and s2.structs == {}
+    assert s2.timeline(uids[0]) == expected[uids[0]]
+    assert len(s2.get_structs(uids[0])['queue']) == 1
+    s2.close()
+
+
+def test_legacy_snapshot_is_split_into_segments(tmp_path):
+    legacy = {
+        'users': {'u1': {'phone': '+1', 'password_hash': ''}},
+        'phone_map': {'+1': 'u1'},
+        'timelines': {'u1': [{'timestamp': 2e10, 'lat': 1.0, 'lon': 1.0, 'source': 'online'},
+                             {'timestamp': 1e10, 'lat': 2.0, 'lon': 2.0, 'source': 'synced'}]},
+        'queues': {'u1': [{'timestamp': 3e10, 'lat': 0.0, 'lon': 0.0, 'source': 'offline'}]},
+    }
+    with open(tmp_path / 'storage.json', 'w', encoding='utf-8') as f:
+        json.dump(legacy, f)
+    s = make_store(tmp_path)
+    s.close()
+    assert os.path.exists(tmp_path / 'storage.segments' / 'u1.seg')
+
+    s2 = make_store(tmp_path)
+    assert [p['timestamp'] for p in s2.timeline('u1')] == [1e10, 2e10]
+    assert len(s2.get_structs('u1')['queue']) == 1
+    s2.close()
+
+
+def test_lru_eviction_keeps_budget_and_reloads_dirty_users(tmp_path):
+    from GeoVerse.data_structures.user_store import RESIDENT_BYTES_PER_POINT
+    s = make_store(tmp_path, memory_budget=150 * RESIDENT_BYTES_PER_POINT)
+    uids = [s.reserve_user(f'+3000{i}') for i in range(4)]
+    for uid in uids:
+        s.get_structs(uid)
+        for i in range(60):
+            s.insert_location(uid, 1e10 + i, 1.0, 1.0)
+    stats = s.cache_stats()
+    assert stats['evictions'] >= 2
+    assert stats['estimated_bytes'] <= stats['budget_bytes']
+    assert uids[0] not in s.structs and uids[-1] in s.structs
+    # evicted user is read back from its segment with nothing lost, and reloads on demand
+    assert len(s.timeline(uids[0])) == 61
+    assert len(s.get_structs(uids[0])['timeline']) == 61
+    assert s.cache_stats()['misses'] == stats['misses'] + 1
+    s.close()
+    s2 = make_store(tmp_path)
+    assert len(s2.timeline(uids[0])) == 61
+    s2.close()
+
+
+def test_inserts_for_cold_users_do_not_materialize_structures(tmp_path):
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+3100')
+    s.get_structs(uid)
+    s.evict(uid)
+    for i in range(10):
+        s.insert_location(uid, 1e10 + i, 0.0, 0.0)
+    s.insert_location(uid, 1e10 - 1, 0.0, 0.0, online=False)
+    assert uid not in s.structs
+    assert len(s.timeline(uid)) == 11
+    assert len(s.get_structs(uid)['queue']) == 1
+    s.close()
+
+
+def test_cold_reads_overlay_pending_events_on_the_mapped_segment(tmp_path):
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+3101')
+    for i in range(0, 20, 2):
+        s.insert_location(uid, 1e10 + i, float(i), 0.0)
+    s._save()
+    s.close()
+
+    s = make_store(tmp_path)
+    # out of order, tied with segment points and with each other, plus a batch
+    for ts, lat in ((1e10 + 25, 1.0), (1e10 + 4, 2.0), (1e10 + 4, 3.0), (1e10 - 3, 4.0)):
+        s.insert_location(uid, ts, lat, 5.0)
+    s.insert_many(uid, [(1e10 + 7, 6.0, 6.0), (1e10 + 4, 7.0, 7.0), (1e10 + 30, 8.0, 8.0, False)])
+    cold = s.timeline(uid), s.search_range(uid, 1e10 + 3, 1e10 + 8), s.search_range(uid, 1e10 + 21, 2e10)
+    assert s.timelines == {} and s.structs == {}
+    s.get_structs(uid)
+    assert cold == (s.timeline(uid), s.search_range(uid, 1e10 + 3, 1e10 + 8), s.search_range(uid, 1e10 + 21, 2e10))
+    assert [p['lat'] for p in cold[1]] == [4.0, 2.0, 3.0, 7.0, 6.0, 6.0, 8.0]
+    s.close()
+
+
+def test_insert_many_merges_batch_and_logs_it_once(tmp_path):
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+1009')
+    s.insert_location(uid, 1e10 + 50, 0.0, 0.0)
+    seq = s._log.seq
+    batch = [(1e10 + 70, 1.0, 1.0, True), {'timestamp': 1e10 + 10, 'lat': 2.0, 'lon': 2.0},
+             [1e10 + 60, 3.0, 3.0, False], (1e10 + 55, 4.0, 4.0)]
+    assert s.insert_many(uid, batch) == (3, 1)
+    assert s._log.seq == seq + 1
+    st = s.get_structs(uid)
+    assert [p['timestamp'] for p in s.timeline(uid)] == [1e10 + 10, 1e10 + 50, 1e10 + 55, 1e10 + 70]
+    assert [p['timestamp'] for p in s.search_bbox(uid, -90, -180, 90, 180)] == [1e10 + 10, 1e10 + 50, 1e10 + 55, 1e10 + 70]
+    assert len(st['queue']) == 1
+    # a bad record rejects the whole batch
+    with pytest.raises(ValueError, match='point 1'):
+        s.insert_many(uid, [(1e10 + 80, 0.0, 0.0), (1e10 + 81, 91.0, 0.0)])
+    assert len(s.timeline(uid)) == 4
+    expected = s.timeline(uid)
+    s.close()
+
+    s2 = make_store(tmp_path)
+    assert s2.timeline(uid) == expected
+    assert s2.queue_state(uid)[0] == 1
+    s2.close()
+
+
+def test_json_segments_convert_to_mapped_binary(tmp_path):
+    from GeoVerse.data_structures.segment import MappedSegment, RECORD, HEADER
+    from GeoVerse.data_structures.convert_segments import convert_storage
+    seg_dir = tmp_path / 'storage.segments'
+    seg_dir.mkdir()
+    with open(tmp_path / 'storage.json', 'w', encoding='utf-8') as f:
+        json.dump({'users': {'u1': {'phone': '+1', 'password_hash': ''}}, 'phone_map': {'+1': 'u1'}, 'log_seq': 0}, f)
+    with open(seg_dir / 'u1.json', 'w', encoding='utf-8') as f:
+        json.dump({'log_seq': 0, 'timestamp': [1e10 + i for i in range(100)], 'lat': [1.0] * 100,
+                   'lon': [2.0] * 100, 'source': [0] * 99 + [2], 'queue': [
+                       {'timestamp': 5e9, 'lat': 0.0, 'lon': 0.0, 'source': 'offline'}]}, f)
+    assert convert_storage(str(tmp_path / 'storage.json')) == 1
+    assert not os.path.exists(seg_dir / 'u1.json')
+    assert os.path.getsize(seg_dir / 'u1.seg') == HEADER.size + 101 * RECORD.size
+    with MappedSegment(str(seg_dir / 'u1.seg')) as seg:
+        assert (seg.points, seg.queued) == (100, 1)
+        assert [p['timestamp'] for p in seg.search_range(1e10 + 10.5, 1e10 + 13)] == [1e10 + 11, 1e10 + 12, 1e10 + 13]
+        assert seg.search_range(1e10 + 99, 2e10)[0]['source'] == 'synced'
+        assert seg.queue()[0]['timestamp'] == 5e9
+    s = make_store(tmp_path)
+    assert len(s.timeline('u1')) == 100 and len(s.get_structs('u1')['queue']) == 1
+    s.close()
+
+
+def test_k_nearest_and_batched_lookups_match_brute_force(tmp_path):
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+1011')
+    rng = random.Random(3)
+    # coarse timestamps so equal times are common
+    s.insert_many(uid, [(1e10 + rng.randint(0, 500) * 10, 0.0, 0.0) for _ in range(400)])
+    points = s.timeline(uid)
+
+    def brute(ts, k, max_distance):
+        near = sorted(range(len(points)), key=lambda i: (abs(points[i]['timestamp'] - ts), i))
+        near = [i for i in near if max_distance is None or abs(points[i]['timestamp'] - ts) <= max_distance]
+        return sorted(abs(points[i]['timestamp'] - ts) for i in near[:k])
+
+    queries = sorted(1e10 + rng.uniform(-100, 5100) for _ in range(300))
+    for k, max_distance in [(1, None), (5, None), (8, 15.0)]:
+        batched = s.search_nearest_many(uid, queries, k, max_distance)
+        for ts, res in zip(queries, batched):
+            assert res == s.search_k_nearest(uid, ts, k, max_distance)
+            assert [p['timestamp'] for p in res] == sorted(p['timestamp'] for p in res)
+            assert sorted(abs(p['timestamp'] - ts) for p in res) == brute(ts, k, max_distance)
+    with pytest.raises(ValueError):
+        s.search_nearest_many(uid, [1e10 + 5, 1e10])
+    s.close()
+
+
+def test_retention_downsamples_old_history_consistently(tmp_path):
+    tiers = ((100, 10), (1000, 100))
+    now = 1e9
+    s = make_store(tmp_path, retention=tiers)
+    hot, cold = s.reserve_user('+1012'), s.reserve_user('+1013')
+    for uid in (hot, cold):
+        s.insert_many(uid, [(now - 1999.5 + i, 1.0, 2.0) for i in range(2000)])
+    s.close()
+    # reopened: `hot` is loaded, `cold` stays on disk
+    s = make_store(tmp_path, retention=tiers)
+    s.get_structs(hot)
+    version = s.version(hot)
+
+    # 100 recent points are kept, then one per 10 s bucket for 900 s and one per 100 s bucket before that
+    assert s.apply_retention(now) == 2 * (2000 - 100 - 90 - 10)
+    assert s.apply_retention(now) == 0
+    for uid in (hot, cold):
+        ts = [p['timestamp'] for p in s.search_range(uid, 0, now)]
+        assert len(ts) == 200
+        assert ts[:10] == [now - 1999.5 + 100 * i for i in range(10)]
+        assert ts[10:100] == [now - 999.5 + 10 * i for i in range(90)]
+        assert ts[100:] == [now - 99.5 + i for i in range(100)]
+    assert cold not in s.structs and cold not in s.timelines
+    assert os.path.getsize(s._segment_path(cold)) == HEADER.size + 200 * RECORD.size
+
+    # every index follows the downsampled timeline, and delta pollers are told to reset
+    st = s.get_structs(hot)
+    assert len(st['timeline']) == len(st['spatial']) == len(s.timeline(hot))
+    assert sum(b['count'] for b in s.rollup(hot, 'day')) == len(s.timeline(hot))
+    assert s.changes_since(hot, version)[2] is True
+    expected = {uid: s.timeline(uid) for uid in (hot, cold)}
+    s.close()
+
+    s2 = make_store(tmp_path, retention=tiers)
+    assert {uid: s2.timeline(uid) for uid in (hot, cold)} == expected
+    s2.close()
+    assert parse_retention('7d:1m,90d:1h') == DEFAULT_RETENTION and parse_retention('none') == ()
+    with pytest.raises(ValueError):
+        parse_retention('1d:1h,7d:90m')  # coarser tier not a multiple of the finer one
+
+
+def test_bounded_queue_syncs_in_chunks_and_replays(tmp_path, monkeypatch):
+    from GeoVerse.data_structures import user_store
+    from GeoVerse.data_structures.queue_ds import QueueFull
+    monkeypatch.setattr(user_store, 'SYNC_CHUNK', 7)
+    s = make_store(tmp_path, queue_capacity=40)
+    uid = s.reserve_user('+1014')
+    s.get_structs(uid)
+    for i in range(50):
+        s.insert_location(uid, 1e10 + (i * 37) % 50, 0.0, 0.0, online=False)
+    assert s.queue_state(uid)[0] == 40  # drop_oldest kept the newest 40
+    kept = [float(1e10 + (i * 37) % 50) for i in range(11, 50)]  # in enqueue order
+    s.insert_location(uid, 2e10, 0.0, 0.0)
+    s.evict(uid)
+    # cold: the drops are worked out from the segment header, without loading the user
+    s.insert_location(uid, 1e10, 0.0, 0.0, online=False)
+    s.insert_many(uid, [(1e10 + 0.25, 0.0, 0.0, False), (1e10 + 0.75, 0.0, 0.0, False)])
+    assert uid not in s.timelines and s.queue_state(uid)[0] == 40
+    assert len(s.sync_queue(uid)) == 40
+    expected = s.timeline(uid)
+    assert [p['timestamp'] for p in expected if p['source'] == 'synced'] == sorted(kept[2:] + [1e10, 1e10 + 0.25, 1e10 + 0.75])
+    s.close()
+
+    s2 = make_store(tmp_path, queue_capacity=40)
+    assert s2.timeline(uid) == expected and s2.queue_state(uid)[0] == 0
+    s2.close()
+
+    s3 = make_store(tmp_path, queue_capacity=2, queue_policy='reject')
+    s3.insert_many(uid, [(1.0, 0.0, 0.0, False), (2.0, 0.0, 0.0, False)])
+    with pytest.raises(QueueFull):
+        s3.insert_location(uid, 3.0, 0.0, 0.0, online=False)
+    with pytest.raises(QueueFull):
+        s3.insert_many(uid, [(4.0, 0.0, 0.0, True), (5.0, 0.0, 0.0, False)])
+    assert s3.queue_state(uid)[0] == 2 and len(s3.timeline(uid)) == len(expected)
+    s3.close()
+
+
+def test_change_log_is_capped_and_old_pollers_reset(tmp_path, monkeypatch):
+    monkeypatch.setattr(user_store, 'CHANGE_LOG_SIZE', 10)
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+1500')
+    start = s.version(uid)
+    versions = []
+    for i in range(25):
+        s.insert_location(uid, 1e10 + i, 1.0, 2.0)
+        versions.append(s.version(uid))
+    st = s.get_structs(uid)
+    assert len(st['change_points']) <= 10
+    assert s.changes_since(uid, start) == ([], versions[-1], True)
+    points, version, reset = s.changes_since(uid, versions[-6])
+    assert not reset and version == versions[-1]
+    assert [p['timestamp'] for p in points] == [1e10 + i for i in range(20, 25)]
+    s.close()
+
+
+def test_indexes_follow_the_timeline_through_ties_and_syncs(tmp_path):
+    rnd = random.Random(5)
+    s = make_store(tmp_path)
+    uid = s.reserve_user('+1015')
+    s.insert_location(uid, 1e10, -1.0, 0.0)  # cold insert: the timeline starts here, not at now
+    s.get_structs(uid)
+    for i in range(300):
+        # many ties, including with the head
+        s.insert_location(uid, 1e10 + rnd.randrange(5), i * 0.25, 0.0, online=rnd.random() < 0.7)
+        if i % 50 == 0:
+            s.sync_queue(uid)
+    s.sync_queue(uid)
+    points = s.timeline(uid)
+    assert s.search_bbox(uid, -90, -180, 90, 180) == points
+    for start, end in ((1e10, 1e10 + 4), (1e10 + 1, 1e10 + 2)):
+        window = [p for p in points if start <= p['timestamp'] <= end]
+        lats, lons = [p['lat'] for p in window], [p['lon'] for p in window]
+        assert s.range_summary(uid, start, end) == {
+            'count': len(window), 'first': window[0], 'last': window[-1],
+            'bbox': [min(lats), min(lons), max(lats), max(lons)]}
+    minutes = s.rollup(uid, 'minute')
+    s.evict(uid)
+    rebuilt = s.rollup(uid, 'minute')
+    assert [(b['count'], b['first'], b['last'], b['bbox']) for b in minutes] == \
+        [(b['count'], b['first'], b['last'], b['bbox']) for b in rebuilt]
+    assert minutes[0]['distance_km'] == pytest.approx(rebuilt[0]['distance_km'])
+    s.close()